@@ -0,0 +1,65 @@
+# ack_tracker.py - Учет доставки через "водяной знак" подтвержденных id
+from collections import deque
+
+# Режимы учета доставки (config.DELIVERY_TRACKING)
+TRACKING_FLAG = 'flag'            # колонка sent = 1, обновляется диапазонами
+TRACKING_WATERMARK = 'watermark'  # одна строка в sync_checkpoint на получателя
+
+# =============================================================================
+# НЕПРЕРЫВНЫЙ ПРЕФИКС ПОДТВЕРЖДЕНИЙ
+# =============================================================================
+
+class AckWatermark:
+    """Хранит наибольший id, до которого подтверждены ВСЕ опубликованные записи.
+
+    id регистрируются через published() в порядке публикации (по возрастанию),
+    подтверждения приходят в любом порядке. Подтверждения "с дыркой" перед
+    ними ждут в наборе, пока дыра не закроется; если запись так и не
+    подтверждена, водяной знак останавливается перед ней, и со следующего
+    цикла она и всё после неё будут отправлены повторно.
+
+    Подтверждения id, которые этот трекер не ждет (уже за водяным знаком,
+    не зарегистрированы или опубликованы в прошлом цикле другим трекером),
+    игнорируются: иначе поздние PUBACK копились бы в наборе без предела.
+    """
+
+    def __init__(self, watermark=0):
+        self.watermark = watermark
+        self._pending = deque()
+        self._waiting = set()
+        self._acked = set()
+
+    def published(self, record_ids):
+        """Регистрирует отправляемые id (до публикации, по возрастанию)"""
+        self._pending.extend(record_ids)
+        self._waiting.update(record_ids)
+
+    def acked(self, record_ids):
+        """Учитывает подтверждения; возвращает True, если водяной знак сдвинулся"""
+        self._acked.update(record_id for record_id in record_ids if record_id in self._waiting)
+        advanced = False
+        while self._pending and self._pending[0] in self._acked:
+            record_id = self._pending.popleft()
+            self._waiting.discard(record_id)
+            self._acked.discard(record_id)
+            self.watermark = record_id
+            advanced = True
+        return advanced
+
+    def out_of_order(self):
+        """Сколько подтвержденных записей ждут закрытия дыры перед ними"""
+        return len(self._acked)
+
+# =============================================================================
+# ДИАПАЗОНЫ ID
+# =============================================================================
+
+def id_ranges(record_ids):
+    """Сворачивает id в непрерывные диапазоны [(первый, последний), ...]"""
+    ranges = []
+    for record_id in sorted(set(record_ids)):
+        if ranges and record_id == ranges[-1][1] + 1:
+            ranges[-1][1] = record_id
+        else:
+            ranges.append([record_id, record_id])
+    return [tuple(r) for r in ranges]
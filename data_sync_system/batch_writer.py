@@ -0,0 +1,197 @@
+# batch_writer.py - Отложенная пакетная запись в центральное хранилище
+import logging
+import queue
+import threading
+import time
+
+from central_backends import SQLiteBackend
+from ingest import is_transient_error
+from metrics import REGISTRY, LATENCY_BUCKETS, SIZE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+INSERTED = REGISTRY.counter('central_inserted_rows_total', 'Строк, вставленных или обновленных в центральной базе')
+WRITE_ERRORS = REGISTRY.counter('central_write_errors_total', 'Неудачных попыток записи в центральную базу')
+REJECTED = REGISTRY.counter('central_rejected_rows_total', 'Строк, отброшенных при записи в центральную базу')
+COMMIT_SECONDS = REGISTRY.histogram(
+    'central_commit_seconds', 'Время записи пакета одной транзакцией, секунд', LATENCY_BUCKETS
+)
+BATCH_ROWS = REGISTRY.histogram('central_batch_rows', 'Строк в пакете записи', SIZE_BUCKETS)
+WRITER_QUEUE = REGISTRY.gauge('central_writer_queue', 'Строк в очереди пакетной записи')
+
+# Повторы записи при временной ошибке (база занята, соединение потеряно):
+# пауза удваивается с RETRY_BASE_DELAY до RETRY_MAX_DELAY секунд
+RETRY_ATTEMPTS = 10
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 5.0
+
+# Маркер остановки фонового потока
+_STOP = object()
+
+# =============================================================================
+# ФОНОВЫЙ ПИСАТЕЛЬ
+# =============================================================================
+
+class BatchWriter:
+    """Копит строки в очереди и вставляет их одной транзакцией (executemany).
+
+    Пакет сбрасывается, когда набралось max_rows строк или с момента
+    поступления первой строки прошло max_delay_ms миллисекунд. Вся работа с
+    базой идёт в отдельном потоке со своим соединением.
+
+    database - путь к файлу SQLite (строки - параметры insert_sql) или
+    хранилище из central_backends.py с write_batch/flush/close; тогда
+    insert_sql не нужен, а хранилище закрывается вместе с писателем.
+
+    on_commit(contexts) вызывается в потоке записи после фиксации транзакции
+    со значениями context, переданными в put() вместе со строками пакета;
+    on_written(rows) - с самими записанными строками (например, чтобы
+    сбросить кэш запросов по их датчикам).
+
+    Временная ошибка базы повторяется с нарастающей паузой. Если пакет
+    отвергнут по другой причине (нарушено ограничение), строки пишутся по
+    одной: недопустимые попадают в лог и отбрасываются, а on_reject(keys)
+    получает их ключи из put(), чтобы фильтр повторов принял их снова.
+    """
+
+    def __init__(self, database, insert_sql=None, max_rows=500, max_delay_ms=200, max_queue=10000,
+                 on_commit=None, on_reject=None, on_written=None):
+        self.backend = database if insert_sql is None else SQLiteBackend(database, insert_sql)
+        self.on_commit = on_commit
+        self.on_written = on_written
+        self.on_reject = on_reject
+        self.max_rows = max(1, int(max_rows))
+        self.max_delay = max_delay_ms / 1000.0
+        self.rows_written = 0
+        self.batches_written = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+        WRITER_QUEUE.set_function(self._queue.qsize)
+
+    def start(self):
+        """Запускает фоновый поток записи"""
+        self._thread.start()
+        return self
+
+    def put(self, row, context=None, key=None):
+        """Ставит строку (кортеж параметров insert_sql) в очередь на запись.
+
+        key - ключ записи в фильтре повторов (dedup.dedup_key), для on_reject.
+        """
+        self._queue.put((row, context, key))
+
+    def flush(self, timeout=None):
+        """Записывает всё накопленное, вызывает flush() хранилища и ждёт завершения"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Сбрасывает остаток очереди на диск и останавливает поток"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        logger.info(f"💾 Записано {self.rows_written} строк в {self.batches_written} транзакциях")
+
+    def _run(self):
+        # Тройки (строка, контекст, ключ)
+        pending = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if not pending else max(0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    # Истёк срок ожидания для неполного пакета
+                    self._write(pending)
+                    pending = []
+                    continue
+
+                if item is _STOP:
+                    self._write(pending)
+                    self._flush_backend()
+                    return
+                if isinstance(item, threading.Event):
+                    self._write(pending)
+                    pending = []
+                    self._flush_backend()
+                    item.set()
+                    continue
+
+                if not pending:
+                    deadline = time.monotonic() + self.max_delay
+                pending.append(item)
+                if len(pending) >= self.max_rows:
+                    self._write(pending)
+                    pending = []
+        finally:
+            # Соединения хранилища открыты в этом потоке, здесь и закрываются
+            self.backend.close()
+
+    def _flush_backend(self):
+        try:
+            self.backend.flush()
+        except Exception as e:
+            logger.error(f"❌ Ошибка сброса хранилища: {e}")
+
+    def _write(self, items):
+        if not items:
+            return
+        try:
+            changed = self._write_rows([row for row, _, _ in items])
+            written = items
+        except Exception as e:
+            if len(items) == 1 or is_transient_error(e):
+                logger.error(f"❌ Ошибка пакетной записи ({len(items)} строк): {e}")
+                self._reject(items)
+                return
+            logger.warning(f"⚠️  Пакет из {len(items)} строк отвергнут ({e}), пишем по одной строке")
+            written, changed = [], 0
+            for item in items:
+                try:
+                    changed += self._write_rows([item[0]])
+                    written.append(item)
+                except Exception as e:
+                    logger.error(f"❌ Строка отброшена: {item[0]}: {e}")
+                    self._reject([item])
+            if not written:
+                return
+
+        self.rows_written += len(written)
+        self.batches_written += 1
+        INSERTED.inc(changed)
+        BATCH_ROWS.observe(len(written))
+        if self.on_written:
+            try:
+                self.on_written([row for row, _, _ in written])
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработчика записанных строк: {e}")
+        if self.on_commit:
+            contexts = [context for _, context, _ in written if context is not None]
+            if contexts:
+                try:
+                    self.on_commit(contexts)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка обработчика фиксации пакета: {e}")
+
+    def _write_rows(self, rows):
+        """write_batch с повторами при временной ошибке; возвращает число измененных строк"""
+        for attempt in range(RETRY_ATTEMPTS + 1):
+            try:
+                with COMMIT_SECONDS.time():
+                    return self.backend.write_batch(rows)
+            except Exception as e:
+                WRITE_ERRORS.inc()
+                if not is_transient_error(e) or attempt == RETRY_ATTEMPTS:
+                    raise
+                delay = min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY)
+                logger.warning(f"⚠️  База занята ({e}), повтор записи {len(rows)} строк через {delay} с")
+                time.sleep(delay)
+
+    def _reject(self, items):
+        REJECTED.inc(len(items))
+        keys = [key for _, _, key in items if key is not None]
+        if self.on_reject and keys:
+            self.on_reject(keys)
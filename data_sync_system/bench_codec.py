@@ -0,0 +1,61 @@
+# bench_codec.py - Сравнение кодеков полезной нагрузки: размер и скорость
+import random
+import time
+from datetime import datetime, timedelta
+
+from codec import CODECS, decode_message
+from message_format import unpack_message, OP_INSERT
+
+HEADER = {"source": "local_sqlite", "version": "2.0"}
+BATCH_SIZES = (1, 10, 100, 1000)
+ITERATIONS = 200
+
+def make_records(count, with_op=False):
+    """Синтетические показания датчиков в формате отправителя"""
+    start = datetime(2024, 1, 1)
+    records = []
+    for i in range(count):
+        record = {
+            "id": i + 1,
+            "sensor_id": random.randint(1, 50),
+            "value": round(random.uniform(-40, 60), 2),
+            "timestamp": (start + timedelta(seconds=i, microseconds=random.randint(0, 999999))).isoformat(),
+        }
+        if with_op:
+            record["op"] = OP_INSERT
+            record["seq"] = i + 1
+        records.append(record)
+    return records
+
+def measure(codec, records):
+    """Возвращает (байт на запись, мкс на запись при кодировании, при декодировании)"""
+    payload = codec.encode(records, HEADER)
+
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        codec.encode(records, HEADER)
+    encode_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        unpack_message(decode_message(payload))
+    decode_time = time.perf_counter() - started
+
+    per_record = ITERATIONS * len(records)
+    return len(payload) / len(records), encode_time / per_record * 1e6, decode_time / per_record * 1e6
+
+def main():
+    random.seed(1)
+    print(f"{'записей':>8} {'кодек':>7} {'байт/зап':>9} {'код мкс':>8} {'декод мкс':>10}")
+    for size in BATCH_SIZES:
+        records = make_records(size)
+        # Проверяем, что оба кодека восстанавливают записи без потерь
+        expected = [{**HEADER, **record} for record in records]
+        for codec in CODECS.values():
+            assert unpack_message(decode_message(codec.encode(records, HEADER))) == expected
+        for name, codec in CODECS.items():
+            size_per_record, encode_us, decode_us = measure(codec, records)
+            print(f"{size:>8} {name:>7} {size_per_record:>9.1f} {encode_us:>8.2f} {decode_us:>10.2f}")
+
+if __name__ == "__main__":
+    main()
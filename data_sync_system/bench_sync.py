@@ -0,0 +1,507 @@
+# bench_sync.py - Замеры пропускной способности отправителя и приёмника на локальном брокере
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+import config
+import hot_logging
+import sender
+import receiver
+from batch_writer import BatchWriter, INSERTED
+from codec import encode_message
+from local_broker import LocalBroker
+from publisher import PipelinedPublisher
+from receive_pipeline import ReceivePipeline
+from sync_trigger import SyncTrigger
+from timestamps import storage_mode, to_storage
+from tracing import TraceStats, trace_header, PERCENTILES
+
+try:
+    import resource
+except ImportError:
+    # Windows: пиковая память процесса не измеряется
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = 'bench_results'
+# Свой топик: замер не должен попасть к настоящим приёмникам
+TOPIC = 'bench/sensor_data'
+SENSORS = 50
+SCENARIOS = ('drain', 'steady', 'ingest')
+# Объём по умолчанию: drain - записей в очереди, steady - новых записей в секунду,
+# ingest - пакетов по BATCH_MAX_RECORDS записей
+DEFAULT_VOLUME = {'drain': 50000, 'steady': 1000, 'ingest': 2000}
+# Длительность steady, секунд
+STEADY_SECONDS = 20
+# Сколько ждать, пока приёмник запишет все строки, секунд
+SETTLE_TIMEOUT = 120
+# INFO на каждый пакет пишется и во время замера, но в консоль - только предупреждения
+BENCH_LOG_LEVEL = logging.WARNING
+# Параметры config.py, от которых зависят результаты; сохраняются вместе с ними
+CONFIG_KEYS = (
+    'PUBLISH_WINDOW', 'BATCH_MAX_RECORDS', 'BATCH_MAX_DELAY_MS',
+    'UNSENT_PAGE_SIZE', 'DELIVERY_TRACKING', 'WRITER_MAX_ROWS', 'WRITER_MAX_DELAY_MS',
+    'RECEIVE_WORKERS', 'RECEIVE_QUEUE_POLICY', 'IDEMPOTENT_INGEST', 'ROLLUPS_ENABLED',
+    'TIMESTAMP_STORAGE', 'JOURNAL_FSYNC', 'JOURNAL_COMPRESS', 'LOG_QUEUED',
+)
+
+# =============================================================================
+# СИНТЕТИЧЕСКИЕ ДАННЫЕ
+# =============================================================================
+
+def synthetic_row(ts_mode):
+    """Показание датчика для вставки в sensor_data (sensor_id, value, timestamp)"""
+    return random.randint(1, SENSORS), round(random.uniform(-40, 60), 2), to_storage(datetime.now(), ts_mode)
+
+def load_sensor_data(conn, rows, chunk=10000):
+    """Добавляет rows неотправленных показаний в sensor_data транзакциями по chunk строк"""
+    ts_mode = storage_mode(conn, 'sensor_data')
+    for start in range(0, rows, chunk):
+        conn.executemany(
+            "INSERT INTO sensor_data (sensor_id, value, timestamp, sent) VALUES (?, ?, ?, 0)",
+            [synthetic_row(ts_mode) for _ in range(min(chunk, rows - start))]
+        )
+        conn.commit()
+
+def synthetic_batches(messages, batch_size):
+    """Готовые пакеты записей для ingest: id сквозные, повторов нет"""
+    timestamp = datetime.now().isoformat()
+    return [
+        [
+            {"id": m * batch_size + i + 1, "sensor_id": random.randint(1, SENSORS),
+             "value": round(random.uniform(-40, 60), 2), "timestamp": timestamp}
+            for i in range(batch_size)
+        ]
+        for m in range(messages)
+    ]
+
+# =============================================================================
+# ИЗМЕРЕНИЯ
+# =============================================================================
+
+def _usage():
+    """(процессорное время процесса, секунд; пиковая память, МБ или None)"""
+    peak = None
+    if resource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux отдает килобайты, macOS - байты
+        peak = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    return time.process_time(), peak
+
+def _usage_since(started):
+    cpu, peak = _usage()
+    return {'cpu_seconds': round(cpu - started[0], 3), 'max_rss_mb': peak and round(peak, 1)}
+
+def latency_stats(values):
+    """Процентили задержек в миллисекундах (ближайший ранг, как в tracing.py)"""
+    if not values:
+        return None
+    values = sorted(values)
+    stats = {'count': len(values)}
+    for p in PERCENTILES:
+        stats[f'p{p}_ms'] = round(values[min(len(values) - 1, len(values) * p // 100)] * 1000, 2)
+    stats['max_ms'] = round(values[-1] * 1000, 2)
+    return stats
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'sqlite': sqlite3.sqlite_version,
+        'git_commit': commit,
+    }
+
+# =============================================================================
+# ПРОЦЕССЫ БРОКЕРА И ПРИЁМНИКА
+# =============================================================================
+
+def _broker_process(ports, stop, results):
+    logging.getLogger().setLevel(BENCH_LOG_LEVEL)
+    broker = LocalBroker('127.0.0.1', 0).start()
+    started = _usage()
+    ports.put(broker.port)
+    stop.wait()
+    results.put(('broker', {'messages': broker.routed, **_usage_since(started)}))
+    broker.stop()
+    hot_logging.stop_logging()
+
+def _receiver_process(port, workdir, latency_from, committed, ready, stop, results):
+    """Приёмник receiver.py: конвейер, пакетная запись, журнал и трассировка"""
+    logging.getLogger().setLevel(BENCH_LOG_LEVEL)
+    database = os.path.join(workdir, 'central_storage.db')
+    receiver.setup_central_database(database).close()
+    receiver.journal = receiver.open_journal(os.path.join(workdir, 'received_data.log'))
+    receiver.tracer = TraceStats('bench', None, 0, None)
+
+    latencies = []
+
+    def on_commit(contexts):
+        receiver.tracer.committed(contexts)
+        latencies.extend(context['committed'] - context[latency_from] for context in contexts)
+
+    receiver.db_writer = BatchWriter(
+        database, receiver.INSERT_SQL, config.WRITER_MAX_ROWS, config.WRITER_MAX_DELAY_MS,
+        on_commit=on_commit, on_reject=receiver.recent_ids.forget if receiver.recent_ids else None
+    ).start()
+    receiver.pipeline = ReceivePipeline(
+        receiver.process_message, config.RECEIVE_WORKERS, config.RECEIVE_QUEUE_SIZE,
+        config.RECEIVE_QUEUE_POLICY, config.RECEIVE_BLOCK_TIMEOUT, 0
+    ).start()
+
+    subscribed = threading.Event()
+    client = mqtt.Client(client_id=f"bench_receiver_{os.getpid()}", protocol=mqtt.MQTTv311)
+    client.on_connect = lambda client, userdata, flags, rc, properties=None: client.subscribe(TOPIC, qos=1)
+    client.on_subscribe = lambda *args: subscribed.set()
+    client.on_message = receiver.on_message
+    client.connect('127.0.0.1', port, 60)
+    client.loop_start()
+    subscribed.wait(10)
+
+    started = _usage()
+    ready.set()
+    while not stop.wait(0.01):
+        committed.value = INSERTED.value()
+
+    client.loop_stop()
+    client.disconnect()
+    receiver.pipeline.stop()
+    receiver.db_writer.close()
+    receiver.journal.close()
+    stages = receiver.tracer.summary().get(sender.MESSAGE_HEADER['source'], {})
+    results.put(('receiver', {
+        'rows': INSERTED.value(),
+        'latency': latency_stats(latencies),
+        'stages_seconds': stages,
+        **_usage_since(started),
+    }))
+    hot_logging.stop_logging()
+
+
+class BenchRun:
+    """Брокер и приёмник в отдельных процессах, отправитель - в текущем.
+
+    Так время процессора и память считаются для каждой роли отдельно,
+    а потоки брокера и приёмника не делят GIL с отправителем.
+    """
+
+    def __init__(self, workdir, latency_from):
+        self.workdir = workdir
+        self.latency_from = latency_from
+        self.results = multiprocessing.Queue()
+        self.committed = multiprocessing.Value('q', 0)
+        self._broker_stop = multiprocessing.Event()
+        self._receiver_stop = multiprocessing.Event()
+        self._processes = []
+        self.port = None
+        self.client = None
+
+    def start(self):
+        ports = multiprocessing.Queue()
+        self._spawn(_broker_process, ports, self._broker_stop, self.results)
+        self.port = ports.get(timeout=30)
+        ready = multiprocessing.Event()
+        self.receiver = self._spawn(
+            _receiver_process, self.port, self.workdir, self.latency_from,
+            self.committed, ready, self._receiver_stop, self.results
+        )
+        if not ready.wait(30):
+            raise RuntimeError("Приёмник не подписался на локальном брокере")
+        return self
+
+    def publisher(self):
+        """Клиент и конвейер публикации с настройками отправителя"""
+        self.client = mqtt.Client(client_id=f"bench_sender_{os.getpid()}", protocol=mqtt.MQTTv311)
+        publisher = PipelinedPublisher(self.client, TOPIC, config.PUBLISH_WINDOW, config.PUBLISH_ACK_TIMEOUT)
+        self.client.max_inflight_messages_set(config.PUBLISH_WINDOW)
+        self.client.on_publish = lambda client, userdata, mid, properties=None: publisher.handle_ack(mid)
+        connected = threading.Event()
+        self.client.on_connect = lambda *args: connected.set()
+        self.client.connect('127.0.0.1', self.port, 60)
+        self.client.loop_start()
+        connected.wait(10)
+        return publisher
+
+    def wait_committed(self, expected, timeout=SETTLE_TIMEOUT):
+        """Ждет, пока приёмник запишет expected строк; False по таймауту"""
+        deadline = time.monotonic() + timeout
+        while self.committed.value < expected:
+            if time.monotonic() > deadline or not self.receiver.is_alive():
+                return False
+            time.sleep(0.005)
+        return True
+
+    def stop(self):
+        """Останавливает процессы и возвращает их замеры {роль: {...}}"""
+        if self.client:
+            self.client.loop_stop()
+            self.client.disconnect()
+        roles = {}
+        # Сначала приёмник, чтобы брокер досчитал его сообщения
+        for event in (self._receiver_stop, self._broker_stop):
+            event.set()
+            try:
+                role, data = self.results.get(timeout=30)
+                roles[role] = data
+            except Exception:
+                pass
+        for process in self._processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+        return roles
+
+    def _spawn(self, target, *args):
+        process = multiprocessing.Process(target=target, args=args, daemon=True)
+        process.start()
+        self._processes.append(process)
+        return process
+
+# =============================================================================
+# СЦЕНАРИИ
+# =============================================================================
+
+def _count_unsent(cursor):
+    cursor.execute("SELECT COUNT(*) FROM sensor_data WHERE sent = 0")
+    return cursor.fetchone()[0]
+
+def scenario_drain(workdir, rows):
+    """Очередь из rows записей, отправитель выгружает её одним циклом sync_data"""
+    conn, cursor = sender.setup_database(os.path.join(workdir, 'local_sensor_data.db'))
+    load_sensor_data(conn, rows)
+    expected = _count_unsent(cursor)
+
+    run = BenchRun(workdir, 'published').start()
+    try:
+        publisher = run.publisher()
+        usage = _usage()
+        started = time.monotonic()
+        sender.sync_data(conn, cursor, publisher)
+        sender_seconds = time.monotonic() - started
+        sender_usage = _usage_since(usage)
+        complete = run.wait_committed(expected)
+        seconds = time.monotonic() - started
+    finally:
+        roles = run.stop()
+        conn.close()
+    roles['sender'] = {'seconds': round(sender_seconds, 3), **sender_usage}
+    return _result(publisher.published, expected, seconds, complete, roles)
+
+def scenario_steady(workdir, rate):
+    """rate новых записей в секунду в течение STEADY_SECONDS, как в цикле main() отправителя"""
+    database = os.path.join(workdir, 'local_sensor_data.db')
+    conn, cursor = sender.setup_database(database)
+    trigger = SyncTrigger(
+        database, None, config.SYNC_MIN_INTERVAL, config.SYNC_MAX_INTERVAL, config.SYNC_WATCH_INTERVAL
+    )
+    stopped = threading.Event()
+
+    def insert_rows():
+        # Отдельное соединение, как у программы, которая пишет показания датчиков
+        writer = sqlite3.connect(database, timeout=30)
+        ts_mode = storage_mode(writer, 'sensor_data')
+        began, inserted = time.monotonic(), 0
+        while not stopped.wait(0.01):
+            due = int((time.monotonic() - began) * rate) - inserted
+            if due > 0:
+                writer.executemany(
+                    "INSERT INTO sensor_data (sensor_id, value, timestamp, sent) VALUES (?, ?, ?, 0)",
+                    [synthetic_row(ts_mode) for _ in range(due)]
+                )
+                writer.commit()
+                inserted += due
+        writer.close()
+
+    run = BenchRun(workdir, 'measured').start()
+    inserter = threading.Thread(target=insert_rows, name="bench-insert")
+    try:
+        publisher = run.publisher()
+        usage = _usage()
+        started = time.monotonic()
+        inserter.start()
+        while time.monotonic() - started < STEADY_SECONDS:
+            published_before = publisher.published
+            sender.sync_data(conn, cursor, publisher)
+            trigger.wait(found_data=publisher.published != published_before)
+        stopped.set()
+        inserter.join()
+        # Остаток, накопленный за последнюю паузу
+        sender.sync_data(conn, cursor, publisher)
+        sender_usage = _usage_since(usage)
+        cursor.execute("SELECT COUNT(*) FROM sensor_data")
+        expected = cursor.fetchone()[0]
+        complete = run.wait_committed(expected)
+        seconds = time.monotonic() - started
+    finally:
+        stopped.set()
+        roles = run.stop()
+        trigger.close()
+        conn.close()
+    roles['sender'] = {'target_rows_per_second': rate, **sender_usage}
+    return _result(publisher.published, expected, seconds, complete, roles)
+
+def scenario_ingest(workdir, messages):
+    """Готовые пакеты публикуются подряд: предел приёмника, а не отправителя"""
+    batches = synthetic_batches(messages, config.BATCH_MAX_RECORDS)
+    expected = messages * config.BATCH_MAX_RECORDS
+
+    run = BenchRun(workdir, 'published').start()
+    try:
+        publisher = run.publisher()
+        usage = _usage()
+        started = time.monotonic()
+        for number, records in enumerate(batches):
+            # Заголовок собирается после ожидания окна, как в publish_batch отправителя
+            publisher.publish(lambda records=records: encode_message(
+                records, {**sender.MESSAGE_HEADER, **trace_header(time.time())}
+            ), number)
+            publisher.pop_acked()
+        publisher.wait_all()
+        sender_usage = _usage_since(usage)
+        complete = run.wait_committed(expected)
+        seconds = time.monotonic() - started
+    finally:
+        roles = run.stop()
+    roles['sender'] = sender_usage
+    return _result(publisher.published, expected, seconds, complete, roles)
+
+SCENARIO_FUNCTIONS = {'drain': scenario_drain, 'steady': scenario_steady, 'ingest': scenario_ingest}
+
+def _result(messages, rows, seconds, complete, roles):
+    receiver_stats = roles.get('receiver', {})
+    return {
+        'complete': complete,
+        'messages': messages,
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'msgs_per_second': round(messages / seconds, 1),
+        'rows_per_second': round(rows / seconds, 1),
+        'latency': receiver_stats.pop('latency', None),
+        'stages_seconds': receiver_stats.pop('stages_seconds', None),
+        'processes': roles,
+    }
+
+def run_scenario(scenario, volume):
+    """Выполняет сценарий во временном каталоге и сохраняет результат в RESULTS_DIR"""
+    # Отправитель добавляет поля трассировки: по ним приёмник считает задержки
+    sender.TRACE_ENABLED = True
+    workdir = tempfile.mkdtemp(prefix='bench_sync_')
+    try:
+        result = {
+            'scenario': scenario,
+            'volume': volume,
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'latency_from': 'measured' if scenario == 'steady' else 'published',
+            **SCENARIO_FUNCTIONS[scenario](workdir, volume),
+            'environment': _environment(),
+            'config': {key: getattr(config, key) for key in CONFIG_KEYS},
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{scenario}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return path, result
+
+# =============================================================================
+# ОТЧЁТ
+# =============================================================================
+
+# (подпись, путь к значению в результате)
+REPORT_FIELDS = (
+    ('сообщ/с', ('msgs_per_second',)),
+    ('записей/с', ('rows_per_second',)),
+    ('p50 мс', ('latency', 'p50_ms')),
+    ('p99 мс', ('latency', 'p99_ms')),
+    ('CPU отпр с', ('processes', 'sender', 'cpu_seconds')),
+    ('CPU приём с', ('processes', 'receiver', 'cpu_seconds')),
+    ('CPU брокер с', ('processes', 'broker', 'cpu_seconds')),
+    ('RSS приём МБ', ('processes', 'receiver', 'max_rss_mb')),
+)
+
+def _value(result, path):
+    for key in path:
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+def format_result(result):
+    lines = [f"📊 {result['scenario']} ({result['volume']}): {result['rows']} записей за {result['seconds']} с"
+             + ("" if result['complete'] else " ⚠️  НЕ ВСЕ ЗАПИСИ ДОШЛИ")]
+    for label, path in REPORT_FIELDS:
+        lines.append(f"  {label:<14}{_value(result, path)}")
+    return '\n'.join(lines)
+
+def compare(old, new):
+    """Таблица изменений между двумя результатами одного сценария"""
+    lines = [f"{'':<14}{'было':>12}{'стало':>12}{'изм.':>9}"]
+    for label, path in REPORT_FIELDS:
+        before, after = _value(old, path), _value(new, path)
+        change = ''
+        if isinstance(before, (int, float)) and isinstance(after, (int, float)) and before:
+            change = f"{(after - before) / before * 100:+.1f}%"
+        lines.append(f"{label:<14}{before if before is not None else '-':>12}"
+                     f"{after if after is not None else '-':>12}{change:>9}")
+    return '\n'.join(lines)
+
+# =============================================================================
+# ЗАПУСК ИЗ КОМАНДНОЙ СТРОКИ
+# =============================================================================
+
+USAGE = """Использование:
+  python bench_sync.py <drain|steady|ingest|all> [объём]
+  python bench_sync.py load <записей> [база]       - наполнить sensor_data синтетикой
+  python bench_sync.py compare <было.json> <стало.json>"""
+
+def main():
+    logging.getLogger().setLevel(BENCH_LOG_LEVEL)
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command == 'load' and len(sys.argv) > 2:
+        database = sys.argv[3] if len(sys.argv) > 3 else 'local_sensor_data.db'
+        conn, _ = sender.setup_database(database)
+        load_sensor_data(conn, int(sys.argv[2]))
+        conn.close()
+        print(f"✅ В {database} добавлено {int(sys.argv[2])} записей")
+    elif command == 'compare' and len(sys.argv) > 3:
+        with open(sys.argv[2], encoding='utf-8') as f:
+            old = json.load(f)
+        with open(sys.argv[3], encoding='utf-8') as f:
+            new = json.load(f)
+        if old['scenario'] != new['scenario']:
+            print(f"⚠️  Разные сценарии: {old['scenario']} и {new['scenario']}")
+        print(compare(old, new))
+    elif command in SCENARIOS or command == 'all':
+        random.seed(1)
+        for scenario in (SCENARIOS if command == 'all' else (command,)):
+            volume = int(sys.argv[2]) if len(sys.argv) > 2 and command != 'all' else DEFAULT_VOLUME[scenario]
+            path, result = run_scenario(scenario, volume)
+            print(format_result(result))
+            print(f"  💾 {path}")
+    else:
+        print(USAGE)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
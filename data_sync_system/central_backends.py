@@ -0,0 +1,261 @@
+# central_backends.py - Хранилища центрального узла: SQLite, MySQL, колоночный файл
+import logging
+import sqlite3
+
+from columnar import ColumnarWriter, INT64, FLOAT64, STRING
+from dedup import upsert_clause, create_origin_index
+from ingest import enable_wal
+from rollup import create_rollups, drop_rollup_triggers
+from central_query import create_query_indexes
+from timestamps import TS_TEXT, TS_MICROS, column_type, storage_mode
+
+logger = logging.getLogger(__name__)
+
+# Порядок полей строки, которую получает write_batch()
+CENTRAL_COLUMNS = (
+    'original_id', 'sensor_id', 'value', 'timestamp', 'received_at', 'source_db', 'db_type', 'version'
+)
+
+INSERT_SQL = '''
+    INSERT INTO received_data
+    (original_id, sensor_id, value, timestamp, received_at, source_db, db_type, version)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# =============================================================================
+# SQLITE
+# =============================================================================
+
+class SQLiteBackend:
+    """Файл SQLite; каждая группа строк - одна транзакция executemany.
+
+    prepare() создает схему на временном соединении, write_batch() пишет
+    через своё соединение, открытое в потоке записи. wal=True включает WAL и
+    synchronous=NORMAL: запись не блокирует читателей (central_query.py), а
+    коммит не ждет fsync.
+    """
+    name = 'sqlite'
+
+    def __init__(self, database, insert_sql=INSERT_SQL, wal=False, busy_timeout=30):
+        self.database = database
+        self.insert_sql = insert_sql
+        self.wal = wal
+        self.busy_timeout = busy_timeout
+        self.ts_mode = TS_TEXT
+        self._conn = None
+
+    def prepare(self, idempotent=False, rollups=False, ts_storage=TS_TEXT):
+        """Создает received_data, индексы и агрегаты"""
+        conn = sqlite3.connect(self.database)
+        try:
+            if self.wal:
+                enable_wal(conn, self.busy_timeout)
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS received_data (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    original_id INTEGER,
+                    sensor_id INTEGER NOT NULL,
+                    value REAL NOT NULL,
+                    timestamp {column_type(ts_storage)} NOT NULL,
+                    received_at {column_type(ts_storage)} NOT NULL,
+                    source_db TEXT,
+                    db_type TEXT,
+                    version TEXT
+                )
+            ''')
+            conn.commit()
+            self.ts_mode = storage_mode(conn, 'received_data')
+
+            if idempotent:
+                create_origin_index(conn, 'source_db')
+                self.insert_sql = INSERT_SQL + upsert_clause('source_db')
+            if rollups:
+                create_rollups(conn)
+            else:
+                drop_rollup_triggers(conn)
+            create_query_indexes(conn)
+        finally:
+            conn.close()
+        logger.info(f"✅ Центральное хранилище SQLite: {self.database}{' (WAL)' if self.wal else ''}")
+        return self
+
+    def write_batch(self, rows):
+        """Пишет строки одной транзакцией; возвращает число вставленных/обновленных"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.database, timeout=self.busy_timeout)
+            if self.wal:
+                enable_wal(self._conn, self.busy_timeout)
+        with self._conn:
+            # Повторы, отброшенные идемпотентной вставкой, в rowcount не входят
+            return self._conn.executemany(self.insert_sql, rows).rowcount
+
+    def flush(self):
+        """Переносит WAL в основной файл, не дожидаясь читателей"""
+        if self._conn is not None and self.wal:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+# =============================================================================
+# MYSQL
+# =============================================================================
+
+class MySQLBackend:
+    """Таблица InnoDB на сервере MySQL, многострочные INSERT через пул (mysql_pool.py).
+
+    При потере соединения группа повторяется на новом, если запись
+    идемпотентна (уникальный ключ источник + original_id); иначе ошибка
+    уходит писателю, чтобы не записать строки дважды. Агрегаты rollup_*
+    строятся триггерами SQLite и здесь не ведутся.
+    """
+    name = 'mysql'
+
+    def __init__(self, config, rows_per_statement=500, reconnect_attempts=30, reconnect_delay=2.0):
+        from mysql_pool import MySQLPool
+        self.config = config
+        self.rows_per_statement = max(1, int(rows_per_statement))
+        # Пишет один поток BatchWriter, второе соединение - для prepare() и проверок
+        self.pool = MySQLPool(config, 2, reconnect_attempts=reconnect_attempts,
+                              reconnect_delay=reconnect_delay)
+        self.ts_mode = TS_TEXT
+        self.idempotent = False
+
+    def prepare(self, idempotent=False, rollups=False, ts_storage=TS_TEXT):
+        """Создает received_data с индексами, если её нет"""
+        self.idempotent = idempotent
+        ts_type = 'BIGINT' if ts_storage == TS_MICROS else 'VARCHAR(32)'
+        origin_key = "UNIQUE KEY idx_received_data_origin (source_db, original_id)," if idempotent else ""
+
+        def create(session):
+            cursor = session.connection.cursor()
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS received_data (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    original_id BIGINT,
+                    sensor_id INT NOT NULL,
+                    value DOUBLE NOT NULL,
+                    timestamp {ts_type} NOT NULL,
+                    received_at {ts_type} NOT NULL,
+                    source_db VARCHAR(255),
+                    db_type VARCHAR(32),
+                    version VARCHAR(64),
+                    {origin_key}
+                    KEY idx_received_data_sensor_time (sensor_id, timestamp)
+                ) ENGINE=InnoDB
+            ''')
+            # Режим существующей таблицы - по типу колонки timestamp
+            cursor.execute('''
+                SELECT DATA_TYPE FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'received_data'
+                  AND COLUMN_NAME = 'timestamp'
+            ''')
+            declared = cursor.fetchone()
+            cursor.close()
+            return declared[0] if declared else ''
+
+        declared = self.pool.run(create)
+        if isinstance(declared, bytes):
+            declared = declared.decode('utf-8')
+        self.ts_mode = TS_MICROS if 'int' in declared.lower() else TS_TEXT
+        if rollups:
+            logger.warning("⚠️  Агрегаты rollup_* ведутся только в SQLite хранилище")
+        logger.info(f"✅ Центральное хранилище MySQL: {self.config['database']}")
+        return self
+
+    def write_batch(self, rows):
+        """Пишет строки одной транзакцией многострочными INSERT"""
+        columns = ", ".join(CENTRAL_COLUMNS)
+        upsert = '''
+            ON DUPLICATE KEY UPDATE
+                sensor_id = VALUES(sensor_id), value = VALUES(value),
+                timestamp = VALUES(timestamp), received_at = VALUES(received_at)
+        ''' if self.idempotent else ''
+        placeholders = "(" + ", ".join(["%s"] * len(CENTRAL_COLUMNS)) + ")"
+
+        def insert(session):
+            cursor = session.connection.cursor()
+            changed = 0
+            for start in range(0, len(rows), self.rows_per_statement):
+                chunk = rows[start:start + self.rows_per_statement]
+                cursor.execute(
+                    f"INSERT INTO received_data ({columns}) VALUES "
+                    + ", ".join([placeholders] * len(chunk)) + upsert,
+                    [field for row in chunk for field in row]
+                )
+                changed += cursor.rowcount
+            cursor.close()
+            return changed
+
+        return self.pool.run(insert, retry=self.idempotent)
+
+    def flush(self):
+        """Каждая группа уже зафиксирована транзакцией"""
+
+    def close(self):
+        self.pool.close()
+
+# =============================================================================
+# КОЛОНОЧНЫЙ ФАЙЛ
+# =============================================================================
+
+COLUMNAR_SCHEMA = (
+    ('original_id', INT64), ('sensor_id', INT64), ('value', FLOAT64),
+    ('timestamp', INT64), ('received_at', INT64),
+    ('source_db', STRING), ('db_type', STRING), ('version', STRING),
+)
+
+class ColumnarFileBackend:
+    """Файл, который только дописывается: группа строк - блок колонок (columnar.py).
+
+    Нет индексов и транзакций, запись - последовательная, поэтому это самый
+    быстрый приём. Время хранится микросекундами. Повторы QoS 1 отсекает
+    только фильтр в памяти (dedup.RecentIds), уникального ключа в файле нет.
+    Данные читаются columnar.read_blocks() по нужным колонкам.
+    """
+    name = 'columnar'
+
+    def __init__(self, path):
+        self.path = path
+        self.ts_mode = TS_MICROS
+        self._writer = None
+
+    def prepare(self, idempotent=False, rollups=False, ts_storage=TS_TEXT):
+        if rollups:
+            logger.warning("⚠️  Агрегаты rollup_* ведутся только в SQLite хранилище")
+        logger.info(f"✅ Центральное хранилище - колоночный файл: {self.path}")
+        return self
+
+    def write_batch(self, rows):
+        """Дописывает строки одним блоком"""
+        if self._writer is None:
+            self._writer = ColumnarWriter(self.path, COLUMNAR_SCHEMA)
+        return self._writer.append(rows)
+
+    def flush(self):
+        """fsync файла"""
+        if self._writer is not None:
+            self._writer.sync()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+# =============================================================================
+# ВЫБОР ХРАНИЛИЩА
+# =============================================================================
+
+def create_backend(kind, sqlite_database=None, mysql_config=None, columnar_path=None,
+                   wal=True, busy_timeout=30, mysql_rows_per_statement=500,
+                   reconnect_attempts=30, reconnect_delay=2.0):
+    """Хранилище по имени: 'sqlite', 'mysql' или 'columnar'"""
+    if kind == 'sqlite':
+        return SQLiteBackend(sqlite_database, wal=wal, busy_timeout=busy_timeout)
+    if kind == 'mysql':
+        return MySQLBackend(mysql_config, mysql_rows_per_statement, reconnect_attempts, reconnect_delay)
+    if kind == 'columnar':
+        return ColumnarFileBackend(columnar_path)
+    raise ValueError(f"Неизвестное центральное хранилище: {kind}")
@@ -0,0 +1,195 @@
+# central_query.py - Чтение центрального хранилища: диапазоны, последние значения, агрегаты
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from rollup import ROLLUP_TABLES, bucket_of
+from timestamps import TS_MICROS, storage_mode, to_iso, to_storage
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк читать из курсора за раз
+FETCH_SIZE = 1000
+
+# Триггеры счетчика sensor_changes из прежней версии: удаляются при открытии базы
+_LEGACY_CHANGE_TRIGGERS = (
+    'trg_received_data_changes_insert',
+    'trg_received_data_changes_update',
+    'trg_received_data_changes_delete',
+)
+
+def create_query_indexes(conn):
+    """Индекс для выборок по датчику и времени"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_received_data_sensor_time
+        ON received_data (sensor_id, timestamp)
+    ''')
+    # Счетчик изменений добавлял запись в горячий путь приёма; кэш теперь
+    # сбрасывает писатель (CentralQuery.changed) или data_version
+    for trigger in _LEGACY_CHANGE_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS sensor_changes")
+    conn.commit()
+
+# =============================================================================
+# КЭШ РЕЗУЛЬТАТОВ
+# =============================================================================
+
+class ResultCache:
+    """LRU кэш готовых результатов с удалением по датчику"""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return rows
+
+    def put(self, key, rows):
+        if not self.capacity:
+            return
+        with self._lock:
+            self._entries[key] = rows
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, sensor_ids):
+        """Удаляет результаты по датчикам, в которые пришли новые строки"""
+        sensor_ids = set(sensor_ids)
+        with self._lock:
+            for key in [k for k in self._entries if k[1] in sensor_ids]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# =============================================================================
+# ЗАПРОСЫ
+# =============================================================================
+
+class CentralQuery:
+    """Запросы к received_data центральной базы.
+
+    Результаты отдаются генераторами и читаются из курсора порциями.
+    Полностью прочитанный результат до max_cached_rows строк кэшируется.
+
+    notified=True - все записи в базу идут через писателя этого процесса,
+    и он после каждой фиксации вызывает changed() с датчиками пакета
+    (CentralStorage.query): из кэша удаляются только они. Иначе перед
+    каждым запросом проверяется PRAGMA data_version, и если базу изменило
+    другое соединение, кэш очищается целиком.
+
+    Время в аргументах и результатах - ISO строки или datetime независимо
+    от того, как оно хранится в базе (TIMESTAMP_STORAGE).
+    """
+
+    def __init__(self, database='central_storage.db', cache_size=256, max_cached_rows=10000,
+                 notified=False):
+        self.database = database
+        self.max_cached_rows = max_cached_rows
+        self.notified = notified
+        self.cache = ResultCache(cache_size)
+
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+        create_query_indexes(self._conn)
+        self.ts_mode = storage_mode(self._conn, 'received_data')
+        self._lock = threading.Lock()
+        self._data_version = self._pragma_data_version()
+        # Растет при каждом сбросе кэша: результат, читавшийся во время сброса, не кэшируется
+        self._generation = 0
+
+    def range(self, sensor_id, start, end):
+        """Строки (original_id, sensor_id, value, timestamp) за [start, end) по времени"""
+        start, end = to_storage(start, self.ts_mode), to_storage(end, self.ts_mode)
+        return self._cached(('range', sensor_id, start, end), '''
+            SELECT original_id, sensor_id, value, timestamp FROM received_data
+            WHERE sensor_id = ? AND timestamp >= ? AND timestamp < ?
+            ORDER BY timestamp
+        ''', (sensor_id, start, end))
+
+    def latest(self, sensor_id, limit=1):
+        """Последние limit строк датчика, от новых к старым"""
+        return self._cached(('latest', sensor_id, limit), '''
+            SELECT original_id, sensor_id, value, timestamp FROM received_data
+            WHERE sensor_id = ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+        ''', (sensor_id, limit))
+
+    def aggregate(self, sensor_id, start, end, granularity='hour'):
+        """Агрегаты (bucket, count, min, max, avg, last) интервалов, пересекающих [start, end)"""
+        first = bucket_of(start, granularity)
+        # Префикс интервала меньше любого времени внутри него
+        last = to_iso(end).replace(' ', 'T')
+        return self._cached(('aggregate', sensor_id, granularity, first, last), f'''
+            SELECT bucket, count, min_value, max_value, sum_value / count, last_value
+            FROM {ROLLUP_TABLES[granularity]}
+            WHERE sensor_id = ? AND bucket >= ? AND bucket < ?
+            ORDER BY bucket
+        ''', (sensor_id, first, last))
+
+    def changed(self, sensor_ids):
+        """Писатель зафиксировал строки этих датчиков (вставка или обновление на месте)"""
+        with self._lock:
+            self._generation += 1
+        self.cache.invalidate(sensor_ids)
+
+    def close(self):
+        logger.info(f"📊 Кэш запросов: попаданий {self.cache.hits}, промахов {self.cache.misses}")
+        self._conn.close()
+
+    def _cached(self, key, sql, params):
+        self._refresh()
+        rows = self.cache.get(key)
+        if rows is not None:
+            return iter(rows)
+        return self._stream(key, sql, params)
+
+    def _stream(self, key, sql, params):
+        collected = []
+        generation = self._generation
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchmany(FETCH_SIZE)
+        while rows:
+            for row in rows:
+                if self.ts_mode == TS_MICROS and key[0] != 'aggregate':
+                    row = row[:3] + (to_iso(row[3]),)
+                if collected is not None:
+                    collected.append(row)
+                    if len(collected) > self.max_cached_rows:
+                        collected = None
+                yield row
+            with self._lock:
+                rows = cursor.fetchmany(FETCH_SIZE)
+        # Кэшируем только полностью прочитанный и не устаревший за время чтения результат
+        if collected is not None and generation == self._generation:
+            self.cache.put(key, collected)
+
+    def _refresh(self):
+        """Очищает кэш, если базу изменило другое соединение, а писатель об этом не сообщает"""
+        if self.notified:
+            return
+        with self._lock:
+            version = self._pragma_data_version()
+            if version == self._data_version:
+                return
+            self._data_version = version
+            self._generation += 1
+        self.cache.clear()
+
+    def _pragma_data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
@@ -0,0 +1,208 @@
+# codec.py - Кодеки полезной нагрузки MQTT: JSON и компактный двоичный формат
+#
+# Отправители пишут JSON. Двоичный формат компактнее на ~40%, но по
+# bench_codec.py кодируется и декодируется медленнее JSON (модуль json
+# написан на C), поэтому в config.py он не предлагается; приёмники его
+# по-прежнему понимают
+import json
+import math
+import struct
+from datetime import datetime, timedelta
+
+from message_format import BATCH_TYPE, pack_records
+
+# Первый байт двоичного сообщения. JSON всегда начинается с '{', поэтому
+# приёмник по первому байту понимает формат и принимает оба
+BINARY_MAGIC = 0xB5
+BINARY_VERSION = 2
+
+# Флаги двоичного заголовка
+FLAG_HAS_OP = 0x01      # есть колонка op (режим захвата изменений)
+FLAG_TS_MICROS = 0x02   # timestamp - микросекунды от эпохи, а не строки
+FLAG_HAS_SEQ = 0x04     # есть колонка seq (номер изменения outbox)
+
+_PREFIX = struct.Struct('<BBBIH')  # magic, версия, флаги, число записей, длина заголовка
+_TEXT_LENGTH = struct.Struct('<I')
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# =============================================================================
+# JSON
+# =============================================================================
+
+class JsonCodec:
+    """Прежний текстовый формат: одна запись или пакет из message_format"""
+    name = 'json'
+
+    def encode(self, records, header):
+        return json.dumps(pack_records(records, header), ensure_ascii=False).encode('utf-8')
+
+    def decode(self, raw):
+        return json.loads(raw.decode('utf-8'))
+
+# =============================================================================
+# ДВОИЧНЫЙ ФОРМАТ
+# =============================================================================
+
+def _row_struct(flags):
+    """Раскладка одной записи: id, sensor_id, value[, время][, seq][, op]"""
+    layout = '<qid'
+    if flags & FLAG_TS_MICROS:
+        layout += 'q'
+    if flags & FLAG_HAS_SEQ:
+        layout += 'q'
+    if flags & FLAG_HAS_OP:
+        layout += 'c'
+    return struct.Struct(layout)
+
+# Раскладки для всех сочетаний флагов компилируются один раз
+_ROWS = {flags: _row_struct(flags) for flags in range(8)}
+
+class BinaryCodec:
+    """Двоичный формат: записи фиксированной длины, упакованные struct.
+
+    prefix   '<BBBIH'  magic, версия, флаги, N, длина заголовка
+    header   JSON объект: значения сохраняют тип (числа, строки, None)
+    records  N записей раскладки _ROWS[флаги]:
+             id int64, sensor_id int32, value float64 (None - NaN),
+             время int64 микросекунд, если FLAG_TS_MICROS,
+             seq int64, если FLAG_HAS_SEQ, op 1 байт ASCII, если FLAG_HAS_OP
+    time     без FLAG_TS_MICROS: u32 длина, затем строки времени через '\\0'
+
+    Записи пакуются pack_into в один буфер и читаются iter_unpack, без
+    разбора по полям. Декодер возвращает пакет в формате message_format,
+    поэтому дальше сообщение разбирается тем же unpack_message.
+    """
+    name = 'binary'
+
+    def encode(self, records, header):
+        count = len(records)
+        flags = 0
+        timestamps = [r.get("timestamp") for r in records]
+        micros = _timestamps_to_micros(timestamps)
+        if micros is not None:
+            flags |= FLAG_TS_MICROS
+        if any("seq" in r for r in records):
+            flags |= FLAG_HAS_SEQ
+        if any("op" in r for r in records):
+            flags |= FLAG_HAS_OP
+        row = _ROWS[flags]
+
+        header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        offset = _PREFIX.size + len(header_bytes)
+        buffer = bytearray(offset + row.size * count)
+        _PREFIX.pack_into(buffer, 0, BINARY_MAGIC, BINARY_VERSION, flags, count, len(header_bytes))
+        buffer[_PREFIX.size:offset] = header_bytes
+
+        columns = [
+            [r["id"] for r in records],
+            [r["sensor_id"] for r in records],
+            [math.nan if r["value"] is None else r["value"] for r in records],
+        ]
+        if micros is not None:
+            columns.append(micros)
+        if flags & FLAG_HAS_SEQ:
+            columns.append([r["seq"] for r in records])
+        if flags & FLAG_HAS_OP:
+            columns.append([(r.get("op") or ' ').encode('ascii') for r in records])
+
+        pack_into = row.pack_into
+        step = row.size
+        for fields in zip(*columns):
+            pack_into(buffer, offset, *fields)
+            offset += step
+
+        if micros is None:
+            text = '\0'.join(str(ts or '') for ts in timestamps).encode('utf-8')
+            buffer += _TEXT_LENGTH.pack(len(text)) + text
+        return bytes(buffer)
+
+    def decode(self, raw):
+        magic, version, flags, count, header_length = _PREFIX.unpack_from(raw, 0)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError(f"Неподдерживаемый двоичный формат: версия {version}")
+        offset = _PREFIX.size
+        header = json.loads(raw[offset:offset + header_length].decode('utf-8'))
+        offset += header_length
+
+        row = _ROWS[flags & 0x07]
+        end = offset + row.size * count
+        fields = list(zip(*row.iter_unpack(memoryview(raw)[offset:end]))) or [()] * len(row.format)
+        columns = {
+            "id": list(fields[0]),
+            "sensor_id": list(fields[1]),
+            "value": [None if v != v else v for v in fields[2]],
+        }
+        position = 3
+        if flags & FLAG_TS_MICROS:
+            columns["timestamp"] = _micros_to_iso(fields[position])
+            position += 1
+        else:
+            (length,) = _TEXT_LENGTH.unpack_from(raw, end)
+            text = raw[end + _TEXT_LENGTH.size:end + _TEXT_LENGTH.size + length].decode('utf-8')
+            columns["timestamp"] = text.split('\0') if count else []
+        if flags & FLAG_HAS_SEQ:
+            columns["seq"] = list(fields[position])
+            position += 1
+        if flags & FLAG_HAS_OP:
+            columns["op"] = [op.decode('ascii') for op in fields[position]]
+        return {"type": BATCH_TYPE, "header": header, "count": count, "columns": columns}
+
+def _timestamps_to_micros(timestamps):
+    """ISO строки -> микросекунды, если все они восстанавливаются без потерь.
+
+    Принимаются только строки вида datetime.isoformat() без пояса:
+    'ГГГГ-ММ-ДДTЧЧ:ММ:СС' или с 6 знаками ненулевых микросекунд. Начало
+    до минуты разбирается один раз на минуту.
+    """
+    minutes = {}
+    micros = []
+    for ts in timestamps:
+        if not isinstance(ts, str) or len(ts) not in (19, 26) or ts[16] != ':':
+            return None
+        seconds = ts[17:19]
+        fraction = ts[20:]
+        if not seconds.isdigit() or (fraction and (ts[19] != '.' or not fraction.isdigit()
+                                                   or fraction == '000000')):
+            return None
+        minute = minutes.get(ts[:16])
+        if minute is None:
+            try:
+                moment = datetime.fromisoformat(ts[:16])
+            except ValueError:
+                return None
+            if moment.isoformat()[:16] != ts[:16]:
+                return None
+            minute = minutes[ts[:16]] = (moment - _EPOCH) // _MICROSECOND
+        micros.append(minute + int(seconds) * 1000000 + (int(fraction) if fraction else 0))
+    return micros
+
+def _micros_to_iso(values):
+    """Микросекунды -> строки datetime.isoformat(); начало до минуты - одно на минуту"""
+    prefixes = {}
+    result = []
+    for value in values:
+        seconds, fraction = divmod(value, 1000000)
+        minute, seconds = divmod(seconds, 60)
+        prefix = prefixes.get(minute)
+        if prefix is None:
+            prefix = prefixes[minute] = (_EPOCH + timedelta(minutes=minute)).isoformat()[:17]
+        result.append(f"{prefix}{seconds:02d}.{fraction:06d}" if fraction else f"{prefix}{seconds:02d}")
+    return result
+
+# =============================================================================
+# ВЫБОР КОДЕКА
+# =============================================================================
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), BinaryCodec())}
+
+def encode_message(records, header, codec='json'):
+    """Кодирует записи выбранным кодеком ('json' или 'binary')"""
+    return CODECS[codec].encode(records, header)
+
+def decode_message(raw):
+    """Декодирует сообщение любого поддерживаемого формата по первому байту"""
+    if raw[:1] == bytes([BINARY_MAGIC]):
+        return CODECS['binary'].decode(raw)
+    return CODECS['json'].decode(raw)
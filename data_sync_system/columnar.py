@@ -0,0 +1,163 @@
+# columnar.py - Колоночные файлы: блоки строк, каждая колонка сжата отдельно
+import json
+import math
+import os
+import struct
+import zlib
+
+# Начало каждого блока
+BLOCK_MAGIC = b'SDC1'
+_BLOCK_HEAD = struct.Struct('>4sI')  # magic, длина заголовка блока
+
+# Типы колонок
+INT64 = 'int64'      # целые; None хранится как INT64_NULL
+FLOAT64 = 'float64'  # числа с плавающей точкой; None хранится как NaN
+STRING = 'str'       # строки и None (JSON список)
+
+INT64_NULL = -2 ** 63
+
+def encode_column(column_type, values):
+    """Значения колонки -> сжатые байты"""
+    if column_type == INT64:
+        data = struct.pack(f'<{len(values)}q', *(INT64_NULL if v is None else v for v in values))
+    elif column_type == FLOAT64:
+        data = struct.pack(f'<{len(values)}d', *(math.nan if v is None else v for v in values))
+    elif column_type == STRING:
+        data = json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    else:
+        raise ValueError(f"Неизвестный тип колонки: {column_type}")
+    return zlib.compress(data, 6)
+
+def decode_column(column_type, data, rows):
+    """Сжатые байты -> список значений колонки"""
+    data = zlib.decompress(data)
+    if column_type == INT64:
+        return [None if v == INT64_NULL else v for v in struct.unpack(f'<{rows}q', data)]
+    if column_type == FLOAT64:
+        return [None if math.isnan(v) else v for v in struct.unpack(f'<{rows}d', data)]
+    if column_type == STRING:
+        return json.loads(data.decode('utf-8'))
+    raise ValueError(f"Неизвестный тип колонки: {column_type}")
+
+def encode_block(schema, rows):
+    """Блок из строк-кортежей в порядке schema [(имя, тип), ...]"""
+    chunks = [encode_column(column_type, [row[i] for row in rows])
+              for i, (_, column_type) in enumerate(schema)]
+    header = json.dumps({
+        'rows': len(rows),
+        'columns': [[name, column_type, len(chunk)]
+                    for (name, column_type), chunk in zip(schema, chunks)],
+    }).encode('utf-8')
+    return _BLOCK_HEAD.pack(BLOCK_MAGIC, len(header)) + header + b''.join(chunks)
+
+# =============================================================================
+# ЧТЕНИЕ
+# =============================================================================
+
+def _block_headers(f):
+    """(заголовок, смещение первой колонки) каждого целого блока файла.
+
+    Недописанный последний блок (сбой во время записи) пропускается.
+    """
+    size = os.fstat(f.fileno()).st_size
+    offset = 0
+    while offset + _BLOCK_HEAD.size <= size:
+        f.seek(offset)
+        magic, header_length = _BLOCK_HEAD.unpack(f.read(_BLOCK_HEAD.size))
+        if magic != BLOCK_MAGIC or offset + _BLOCK_HEAD.size + header_length > size:
+            return
+        try:
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        except ValueError:
+            return
+        data_offset = offset + _BLOCK_HEAD.size + header_length
+        end = data_offset + sum(length for _, _, length in header['columns'])
+        if end > size:
+            return
+        yield header, data_offset
+        offset = end
+
+def valid_length(path):
+    """Длина файла без недописанного хвоста"""
+    if not os.path.exists(path):
+        return 0
+    end = 0
+    with open(path, 'rb') as f:
+        for header, data_offset in _block_headers(f):
+            end = data_offset + sum(length for _, _, length in header['columns'])
+    return end
+
+def read_blocks(path, columns=None):
+    """Блоки файла как словари {колонка: список значений}.
+
+    columns - нужные колонки; остальные не читаются с диска и не распаковываются.
+    """
+    with open(path, 'rb') as f:
+        for header, data_offset in list(_block_headers(f)):
+            block = {}
+            offset = data_offset
+            for name, column_type, length in header['columns']:
+                if columns is None or name in columns:
+                    f.seek(offset)
+                    block[name] = decode_column(column_type, f.read(length), header['rows'])
+                offset += length
+            yield block
+
+def read_columns(path, columns=None):
+    """Все значения колонок файла одним словарём"""
+    result = {}
+    for block in read_blocks(path, columns):
+        for name, values in block.items():
+            result.setdefault(name, []).extend(values)
+    return result
+
+# =============================================================================
+# ЗАПИСЬ
+# =============================================================================
+
+class ColumnarWriter:
+    """Дописывает блоки в конец файла.
+
+    Файл только растет: каждый блок - законченная группа строк, так что
+    читатели могут открывать его во время записи. При открытии
+    недописанный хвост после сбоя отрезается. length - длина целых блоков,
+    если она уже известна (например, из контрольной точки): тогда заголовки
+    блоков файла не перечитываются.
+    """
+
+    def __init__(self, path, schema, length=None):
+        self.path = path
+        self.schema = list(schema)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if length is None or length > size:
+            length = valid_length(path)
+        self._file = open(path, 'ab')
+        if self._file.tell() != length:
+            self._file.truncate(length)
+            self._file.seek(length)
+        self.length = length
+        self.rows_written = 0
+
+    def append(self, rows):
+        """Один блок из строк-кортежей в порядке schema"""
+        if not rows:
+            return 0
+        block = encode_block(self.schema, rows)
+        self._file.write(block)
+        self._file.flush()
+        self.length += len(block)
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def sync(self):
+        """Сбрасывает записанное на диск (fsync)"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
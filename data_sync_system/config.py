@@ -1,23 +1,240 @@
-# config.py - Конфигурация базы данных
-DATABASE_CONFIG = {
-    'sqlite': {
-        'type': 'sqlite',
-        'database': 'local_sensor_data.db'
-    },
-    'mysql': {
-        'type': 'mysql',
-        'host': 'localhost',
-        'user': 'root',
-        'password': 'password',
-        'database': 'sensor_data',
-        'port': 3306
-    }
-}
-
-# Активная база данных ('sqlite' или 'mysql')
-ACTIVE_DATABASE = 'sqlite'
-
-# MQTT настройки
-MQTT_BROKER = "broker.hivemq.com"
-MQTT_PORT = 1883
-MQTT_TOPIC = "my_school_project/sensor_data_v3"
\ No newline at end of file
+# config.py - Конфигурация базы данных
+import os
+
+DATABASE_CONFIG = {
+    'sqlite': {
+        'type': 'sqlite',
+        'database': 'local_sensor_data.db'
+    },
+    'mysql': {
+        'type': 'mysql',
+        'host': 'localhost',
+        'user': 'root',
+        'password': 'password',
+        'database': 'sensor_data',
+        'port': 3306
+    }
+}
+
+# Активная база данных ('sqlite' или 'mysql')
+ACTIVE_DATABASE = 'sqlite'
+
+# MySQL (mysql_pool.py): пул соединений отправителя. Нужно не меньше 2:
+# потоковое чтение неотправленных идет параллельно с отметками о доставке
+MYSQL_POOL_SIZE = 4
+# Соединение, простоявшее дольше этого, проверяется ping перед выдачей, секунд
+MYSQL_PING_INTERVAL = 30
+# Повторы при потере соединения (например, перезапуск сервера) и пауза между ними, секунд
+MYSQL_RECONNECT_ATTEMPTS = 30
+MYSQL_RECONNECT_DELAY = 2.0
+
+# MQTT настройки
+# Переменные окружения SYNC_MQTT_BROKER / SYNC_MQTT_PORT переопределяют брокер,
+# например для работы с local_broker.py без интернета
+MQTT_BROKER = os.environ.get('SYNC_MQTT_BROKER', "broker.hivemq.com")
+MQTT_PORT = int(os.environ.get('SYNC_MQTT_PORT', 1883))
+MQTT_TOPIC = "my_school_project/sensor_data_v3"
+
+# Конвейерная публикация (QoS 1)
+# Сколько сообщений может ожидать PUBACK одновременно (1 = прежний последовательный режим)
+PUBLISH_WINDOW = 100
+# Сколько секунд ждать подтверждения самого старого сообщения
+PUBLISH_ACK_TIMEOUT = 10
+
+# Пакетные сообщения: несколько записей в одном MQTT сообщении
+# Максимум записей в пакете (1 = по одной записи в старом формате)
+BATCH_MAX_RECORDS = 100
+# Сколько миллисекунд копить записи, прежде чем отправить неполный пакет
+BATCH_MAX_DELAY_MS = 200
+
+# Пакетная запись в центральную базу
+# Сколько строк вставлять одной транзакцией
+WRITER_MAX_ROWS = 500
+# Максимальная задержка записи неполного пакета, мс
+WRITER_MAX_DELAY_MS = 200
+
+# Конвейер приёма: on_message только ставит сообщение в очередь
+# Количество потоков, которые декодируют и сохраняют сообщения. Сообщения
+# одного топика всегда обрабатывает один поток по порядку, поэтому больше
+# одного потока имеет смысл, только если отправители пишут в разные топики
+RECEIVE_WORKERS = 1
+# Максимальная длина очереди сырых сообщений (делится между потоками)
+RECEIVE_QUEUE_SIZE = 10000
+# Что делать при заполненной очереди: 'block', 'drop_newest' или 'drop_oldest'.
+# Сообщение уже подтверждено брокеру, поэтому drop_* теряют данные безвозвратно
+RECEIVE_QUEUE_POLICY = 'block'
+# Сколько секунд политика 'block' может задерживать сетевой поток MQTT, потом
+# сообщение отбрасывается; None - ждать, пока освободится место (без потерь)
+RECEIVE_BLOCK_TIMEOUT = None
+# Как часто писать в лог состояние очереди, секунд (0 = не писать)
+RECEIVE_STATS_INTERVAL = 60
+
+# Центральное хранилище универсального приёмника (central_backends.py):
+# 'sqlite'   - файл CENTRAL_SQLITE_DATABASE в режиме WAL (чтение - central_query.py)
+# 'mysql'    - таблица received_data в CENTRAL_MYSQL_CONFIG, многострочные INSERT
+# 'columnar' - колоночный файл CENTRAL_COLUMNAR_FILE, только дописывается (columnar.py)
+CENTRAL_BACKEND = 'sqlite'
+CENTRAL_SQLITE_DATABASE = 'central_universal.db'
+CENTRAL_SQLITE_WAL = True
+CENTRAL_MYSQL_CONFIG = dict(DATABASE_CONFIG['mysql'], database='central_sensor_data')
+CENTRAL_COLUMNAR_FILE = 'central_universal.col'
+
+# Выгрузка центральной SQLite базы в колоночные файлы по дням (export_columnar.py):
+# аналитика читает <EXPORT_DIRECTORY>/day=ГГГГ-ММ-ДД/, а не базу приёма.
+# Универсальный приёмник запускает выгрузку фоновым процессом; вручную:
+# python export_columnar.py [--once]
+# Выгружаются только новые строки: обновления уже выгруженных (upsert) в файлы не попадают
+EXPORT_ENABLED = False
+EXPORT_DIRECTORY = 'analytics'
+# Строк в одной группе чтения (один блок на день в группе)
+EXPORT_BATCH_ROWS = 50000
+# Как часто выгружать новые строки, секунд
+EXPORT_INTERVAL = 300
+# Понижение приоритета процесса выгрузки (os.nice, кроме Windows)
+EXPORT_NICE = 10
+
+# Многопроцессный приёмник (multi_receiver.py)
+# Количество процессов-приёмников в группе общей подписки
+RECEIVER_PROCESSES = 4
+# Имя группы: брокер распределяет сообщения '$share/<группа>/<топик>' между процессами
+RECEIVER_SHARE_GROUP = 'central_receivers'
+# Общая база всех процессов (WAL, ожидание блокировки - SQLITE_BUSY_TIMEOUT).
+# Повтор QoS 1, который брокер отдал другому процессу группы, отсекает
+# уникальный ключ (source, original_id), поэтому нужен IDEMPOTENT_INGEST
+RECEIVER_DATABASE = 'central_storage.db'
+
+# Сколько неотправленных записей читать из базы за один запрос
+UNSENT_PAGE_SIZE = 1000
+
+# Учет доставки на отправителе:
+# 'flag'      - колонка sent = 1, обновляется диапазонами id одной транзакцией
+# 'watermark' - только строка в sync_checkpoint с последним непрерывно подтвержденным id
+#               (рассчитан на SQLite, где записи фиксируются строго по возрастанию id)
+DELIVERY_TRACKING = 'flag'
+
+# Откуда отправитель берет новые данные:
+# 'table'  - опрос sensor_data по флагу sent (или водяному знаку)
+# 'outbox' - триггеры на sensor_data пишут вставки/изменения/удаления в sensor_outbox
+SYNC_SOURCE = 'table'
+
+# Пробуждение цикла синхронизации
+# Пауза после цикла, который нашел данные, секунд
+SYNC_MIN_INTERVAL = 0.5
+# Максимальная пауза при простое (пауза удваивается после каждого пустого цикла)
+SYNC_MAX_INTERVAL = 30
+# Как часто проверять PRAGMA data_version у SQLite, секунд
+SYNC_WATCH_INTERVAL = 0.1
+# UDP порт на 127.0.0.1 для уведомлений от производителей (None = выключено)
+SYNC_NOTIFY_PORT = 47017
+
+# Идемпотентный приём: уникальный ключ (источник, original_id) в центральной
+# базе и фильтр повторов QoS 1 в памяти. Если в существующей базе уже есть
+# дубликаты, приёмник не стартует: один раз уберите их командой
+# python dedup.py <база> (удаленные строки сохраняются в received_data_duplicates)
+IDEMPOTENT_INGEST = False
+# Сколько последних ключей помнит фильтр повторов
+DEDUP_CACHE_SIZE = 100000
+
+# Агрегаты по датчикам (rollup_minute/hour/day), обновляются триггерами при приёме
+ROLLUPS_ENABLED = True
+# Сколько строк received_data пересчитывать за транзакцию при перестроении
+ROLLUP_REBUILD_BATCH = 50000
+
+# Чтение центральной базы (central_query.py)
+# Сколько результатов запросов хранить в LRU кэше
+QUERY_CACHE_SIZE = 256
+# Результаты длиннее этого числа строк не кэшируются
+QUERY_CACHE_MAX_ROWS = 10000
+
+# Хранение времени (timestamp, received_at) в новых таблицах:
+# 'text' - ISO строки, 'micros' - целые микросекунды от эпохи (INTEGER/BIGINT).
+# Существующие таблицы переводятся migrate_timestamps.py, режим таблицы
+# определяется по её схеме; по MQTT время всегда передается ISO строкой
+TIMESTAMP_STORAGE = 'text'
+# Сколько строк копировать за транзакцию при миграции
+TIMESTAMP_MIGRATION_BATCH = 10000
+
+# Очистка доставленных данных на отправителе (retention.py): удаляет доставленные
+# строки sensor_data, поэтому включается явно. Место возвращается файловой системе
+# только в режиме auto_vacuum=INCREMENTAL: новые базы создаются в нём, существующую
+# один раз переводит python retention.py <база> (полный VACUUM, отправитель остановить)
+RETENTION_ENABLED = False
+# Доставленные записи старше этого удаляются, часов
+RETENTION_MAX_AGE_HOURS = 24
+# Сколько последних доставленных записей хранить независимо от возраста
+RETENTION_MAX_DELIVERED_ROWS = 100000
+# Строк в одной транзакции удаления
+RETENTION_BATCH_ROWS = 1000
+# Страниц, возвращаемых за один шаг PRAGMA incremental_vacuum
+RETENTION_VACUUM_PAGES = 256
+# Как часто запускать очистку, секунд
+RETENTION_INTERVAL = 300
+
+# Запись показаний производителями (DatabaseManager.ingest, ingest.py)
+# Сколько показаний записывать одной транзакцией
+INGEST_MAX_ROWS = 1000
+# Максимальная задержка записи неполной группы, мс
+INGEST_MAX_DELAY_MS = 100
+# Максимум элементов в очереди (показаний или массивов); при заполнении add() ждет
+INGEST_MAX_QUEUE = 100000
+# MySQL: строк в одном многострочном INSERT
+INGEST_MYSQL_ROWS_PER_STATEMENT = 500
+# Локальная SQLite: WAL и synchronous=NORMAL - запись не блокирует чтение отправителя
+SQLITE_WAL = True
+# Сколько секунд ждать блокировку другого писателя
+SQLITE_BUSY_TIMEOUT = 30
+
+# Журнал принятых данных (journal.py): received_data.log, received_universal.log
+# Сегмент закрывается по размеру, МБ, или по возрасту, секунд
+JOURNAL_SEGMENT_MAX_MB = 64
+JOURNAL_SEGMENT_MAX_SECONDS = 3600
+# Когда выполнять fsync: 'batch' - после каждого сообщения,
+# 'interval' - раз в JOURNAL_FSYNC_INTERVAL секунд, 'never' - на усмотрение ОС
+JOURNAL_FSYNC = 'interval'
+JOURNAL_FSYNC_INTERVAL = 1.0
+# Сжимать закрытые сегменты gzip
+JOURNAL_COMPRESS = True
+# Размер буфера записи, КБ
+JOURNAL_BUFFER_KB = 256
+# Журнал каждого процесса multi_receiver.py ({index} - номер процесса)
+RECEIVER_SHARD_JOURNAL = 'received_data_shard{index}.log'
+
+# Восстановление центральной базы из журнала (rebuild_central.py)
+# Процессов, разбирающих журнал
+REBUILD_WORKERS = 4
+# Размер куска журнала для одного процесса и одной транзакции, МБ
+REBUILD_CHUNK_MB = 16
+
+# Логирование (hot_logging.py)
+# Писать логи в фоновом потоке через очередь, не задерживая приём и отправку
+LOG_QUEUED = True
+# Подробности каждого сообщения/записи: 'all', 'sample' или 'off' (только строка на пакет)
+LOG_MESSAGE_DETAIL = 'sample'
+# В режиме 'sample': каждое N-е сообщение, но не больше LOG_DETAIL_MAX_PER_SECOND в секунду
+LOG_DETAIL_SAMPLE_EVERY = 100
+LOG_DETAIL_MAX_PER_SECOND = 5
+# Режим можно поменять без перезапуска, записав all, sample или off в этот файл
+LOG_DETAIL_SWITCH_FILE = 'logs/message_detail'
+
+# Метрики (metrics.py): текстовый формат Prometheus на http://METRICS_HOST:<порт>/metrics
+METRICS_ENABLED = True
+# Только локальный доступ; '0.0.0.0' - для сбора с другой машины
+METRICS_HOST = '127.0.0.1'
+# Порты отправителя и приёмника (0 - без HTTP); процессы multi_receiver.py
+# занимают порты сразу после порта приёмника: 9103, 9104, ...
+METRICS_SENDER_PORT = 9101
+METRICS_RECEIVER_PORT = 9102
+# Периодический снимок метрик в JSON ('' - не писать); {name} - имя процесса
+METRICS_SNAPSHOT_FILE = 'logs/metrics_{name}.json'
+METRICS_SNAPSHOT_INTERVAL = 60
+
+# Трассировка задержек (tracing.py): отправители добавляют в заголовок пакета
+# время выборки и публикации, приёмники считают процентили по этапам.
+# Отчёт: python tracing.py
+TRACE_ENABLED = False
+# Сколько последних сообщений каждого источника учитывать в процентилях
+TRACE_WINDOW = 10000
+# Как часто писать сводку в лог и снимок, секунд
+TRACE_REPORT_INTERVAL = 60
+# Снимок процентилей для отчёта; {name} - имя процесса-приёмника
+TRACE_SNAPSHOT_FILE = 'logs/trace_{name}.json'
@@ -0,0 +1,169 @@
+# dedup.py - Идемпотентный приём: уникальный ключ записи и фильтр повторов QoS 1
+import logging
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DUPLICATES = REGISTRY.counter('receive_duplicates_total', 'Повторов QoS 1, отброшенных до записи в базу')
+
+# =============================================================================
+# ФИЛЬТР НЕДАВНИХ ПОВТОРОВ
+# =============================================================================
+
+def dedup_key(record):
+    """Ключ доставленного изменения: источник и seq (outbox) или id записи.
+
+    Изменения outbox (есть поле op) различаются только по seq: у всех
+    изменений одной строки id одинаковый. Изменение без seq (старый
+    отправитель) ключа не получает, и фильтр его не отбрасывает.
+    """
+    if 'op' in record:
+        seq = record.get('seq')
+        return None if seq is None else (record.get('source'), seq, record['op'])
+    return record.get('source'), record.get('id'), None
+
+class RecentIds:
+    """Ограниченный LRU набор недавно принятых ключей.
+
+    После переподключения брокер повторяет неподтвержденные сообщения QoS 1,
+    и они отбрасываются здесь, не доходя до SQLite. Ключи, вытесненные из
+    набора, всё равно отсекает уникальный индекс базы.
+    """
+
+    def __init__(self, capacity=100000):
+        self.capacity = max(1, int(capacity))
+        self.duplicates = 0
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key):
+        """Возвращает True для повтора; новый ключ запоминает"""
+        if key is None:
+            return False
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                self.duplicates += 1
+                DUPLICATES.inc()
+                return True
+            self._keys[key] = None
+            if len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+            return False
+
+    def forget(self, keys):
+        """Забывает ключи записей, которые не удалось сохранить: их повтор будет принят"""
+        with self._lock:
+            for key in keys:
+                self._keys.pop(key, None)
+
+# =============================================================================
+# УНИКАЛЬНЫЙ КЛЮЧ В ЦЕНТРАЛЬНОЙ БАЗЕ
+# =============================================================================
+
+def upsert_clause(source_column):
+    """Окончание INSERT: повтор не пишется, изменение записи обновляет строку.
+
+    Строка обновляется только при отличии данных, так что точный повтор не
+    создает запись на диск.
+    """
+    return f'''
+    ON CONFLICT({source_column}, original_id) DO UPDATE SET
+        sensor_id = excluded.sensor_id,
+        value = excluded.value,
+        timestamp = excluded.timestamp,
+        received_at = excluded.received_at
+    WHERE (sensor_id, value, timestamp) IS NOT
+          (excluded.sensor_id, excluded.value, excluded.timestamp)
+'''
+
+# Таблица, куда remove_duplicates() откладывает удаленные строки
+DUPLICATES_TABLE = 'received_data_duplicates'
+
+def _index_name(source_column):
+    return f'idx_received_data_origin_{source_column}'
+
+def _duplicates_where(source_column):
+    return f'''
+        {source_column} IS NOT NULL AND original_id IS NOT NULL
+        AND id NOT IN (
+            SELECT MAX(id) FROM received_data
+            GROUP BY {source_column}, original_id
+        )
+    '''
+
+def create_origin_index(conn, source_column):
+    """Создает уникальный индекс (источник, original_id) в received_data.
+
+    Строки базы не удаляются: если в таблице уже есть дубликаты, индекс
+    не создается и поднимается RuntimeError - их нужно один раз убрать
+    командой python dedup.py <база>.
+    """
+    index = _index_name(source_column)
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)
+    ).fetchone()
+    if exists:
+        return
+
+    (duplicates,) = conn.execute(
+        f"SELECT COUNT(*) FROM received_data WHERE {_duplicates_where(source_column)}"
+    ).fetchone()
+    if duplicates:
+        raise RuntimeError(
+            f"В received_data {duplicates} дубликатов ({source_column}, original_id), "
+            f"уникальный индекс не создан. Уберите их: python dedup.py <база>"
+        )
+    with conn:
+        conn.execute(f'''
+            CREATE UNIQUE INDEX {index}
+            ON received_data ({source_column}, original_id)
+        ''')
+
+def remove_duplicates(conn, source_column, backup_table=DUPLICATES_TABLE):
+    """Удаляет дубликаты (источник, original_id), оставляя последнюю принятую строку.
+
+    Удаленные строки копируются в backup_table (None - без копии).
+    Возвращает число удаленных строк.
+    """
+    where = _duplicates_where(source_column)
+    with conn:
+        if backup_table:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {backup_table} AS SELECT * FROM received_data WHERE 0")
+            conn.execute(f"INSERT INTO {backup_table} SELECT * FROM received_data WHERE {where}")
+        removed = conn.execute(f"DELETE FROM received_data WHERE {where}").rowcount
+    if removed:
+        saved = f", копия в {backup_table}" if backup_table else ""
+        logger.info(f"🧹 Удалено дубликатов ({source_column}, original_id): {removed}{saved}")
+    return removed
+
+# =============================================================================
+# ЗАПУСК ИЗ КОМАНДНОЙ СТРОКИ
+# =============================================================================
+
+def main():
+    """python dedup.py [база] - разовая очистка дубликатов перед IDEMPOTENT_INGEST"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    database = sys.argv[1] if len(sys.argv) > 1 else 'central_storage.db'
+    conn = sqlite3.connect(database)
+    try:
+        # Схема receiver.py - колонка source, универсального приёмника - source_db
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(received_data)")}
+        if not columns:
+            print(f"❌ В {database} нет таблицы received_data")
+            sys.exit(1)
+        source_column = 'source_db' if 'source_db' in columns else 'source'
+        removed = remove_duplicates(conn, source_column)
+        create_origin_index(conn, source_column)
+        print(f"✅ Уникальный индекс создан, удалено дубликатов: {removed}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+# export_columnar.py - Выгрузка received_data в колоночные файлы по дням для аналитики
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from columnar import ColumnarWriter, INT64, FLOAT64, STRING, read_blocks
+from timestamps import TS_MICROS, storage_mode, to_local, to_micros
+
+logger = logging.getLogger(__name__)
+
+# Колонки времени: в выгрузке всегда микросекунды
+TIME_COLUMNS = ('timestamp', 'received_at')
+
+PARTITION_FILE = 'received_data.col'
+CHECKPOINT_FILE = '_checkpoint.json'
+
+def partition_of(micros):
+    """Каталог дня (местного) для времени показания: 'day=2024-01-01'"""
+    return f"day={to_local(micros).date().isoformat()}"
+
+def export_schema(conn):
+    """Колонки выгрузки [(имя, тип)] по схеме received_data этой базы.
+
+    Схемы приёмников различаются (source, version у receiver.py; source_db,
+    db_type, version у универсального), поэтому колонки берутся из PRAGMA
+    table_info, а тип - по объявленному типу колонки.
+    """
+    schema = []
+    for _, name, declared, *_ in conn.execute("PRAGMA table_info(received_data)"):
+        declared = declared.upper()
+        if name in TIME_COLUMNS or 'INT' in declared:
+            schema.append((name, INT64))
+        elif any(kind in declared for kind in ('REAL', 'FLOA', 'DOUB')):
+            schema.append((name, FLOAT64))
+        else:
+            schema.append((name, STRING))
+    if not schema or schema[0][0] != 'id' or 'timestamp' not in dict(schema):
+        raise sqlite3.OperationalError("В базе нет таблицы received_data с колонками id и timestamp")
+    return schema
+
+# =============================================================================
+# ВЫГРУЗКА
+# =============================================================================
+
+class ColumnarExporter:
+    """Переносит новые строки received_data в <directory>/day=ГГГГ-ММ-ДД/received_data.col.
+
+    Строки читаются по возрастанию id через соединение только для чтения
+    (база приёма в WAL не блокируется) группами по batch_rows; каждая группа
+    раскладывается по дням показаний и дописывается блоками колонок.
+    Колонки берутся из схемы received_data (export_schema), файлы дней
+    остаются открытыми до конца прохода.
+    Прогресс - последний выгруженный id и длины файлов - сохраняется в
+    _checkpoint.json после fsync файлов. Если выгрузка прервана, при
+    следующем запуске файлы обрезаются до длин из контрольной точки, и
+    строки выгружаются ровно один раз.
+
+    Выгружаются только новые id: если идемпотентный приём (IDEMPOTENT_INGEST)
+    позже обновил уже выгруженную строку, в файлах остается прежнее
+    значение. Чтобы выгрузка отражала обновления, её нужно построить заново
+    (удалить каталог). Строку, время которой не переводится в микросекунды,
+    выгрузка пропускает с предупреждением.
+    """
+
+    def __init__(self, database, directory, batch_rows=50000, interval=300):
+        self.database = database
+        self.directory = directory
+        self.batch_rows = max(1, int(batch_rows))
+        self.interval = interval
+        self.last_id = 0
+        self.files = {}
+        self._writers = {}
+        self._load_checkpoint()
+
+    def export(self):
+        """Выгружает все строки, появившиеся после контрольной точки; возвращает отчёт"""
+        started = time.monotonic()
+        exported = 0
+        skipped = 0
+        conn = sqlite3.connect(f"file:{self.database}?mode=ro", uri=True)
+        try:
+            ts_mode = storage_mode(conn, 'received_data')
+            schema = export_schema(conn)
+            columns = ", ".join(name for name, _ in schema)
+            while True:
+                rows = conn.execute(
+                    f"SELECT {columns} FROM received_data WHERE id > ? ORDER BY id LIMIT ?",
+                    (self.last_id, self.batch_rows)
+                ).fetchall()
+                if not rows:
+                    break
+                written = self._write(rows, schema, ts_mode)
+                exported += written
+                skipped += len(rows) - written
+                if len(rows) < self.batch_rows:
+                    break
+        finally:
+            conn.close()
+            self._close_writers()
+
+        report = {
+            'exported_rows': exported,
+            'skipped_rows': skipped,
+            'last_id': self.last_id,
+            'partitions': len(self.files),
+            'seconds': round(time.monotonic() - started, 3),
+        }
+        if skipped:
+            logger.warning(f"⚠️  Выгрузка: пропущено строк с неверным временем: {skipped}")
+        if exported:
+            logger.info(
+                f"📦 Выгрузка: {exported} строк до id {self.last_id}, "
+                f"дней: {len(self.files)}, за {report['seconds']} с"
+            )
+        return report
+
+    def run(self, stop=None):
+        """Выгружает каждые interval секунд, пока не установлен stop (multiprocessing.Event)"""
+        while True:
+            try:
+                self.export()
+            except (sqlite3.Error, OSError) as e:
+                logger.error(f"❌ Ошибка выгрузки: {e}")
+            if stop is None:
+                time.sleep(self.interval)
+            elif stop.wait(self.interval):
+                return
+
+    def _write(self, rows, schema, ts_mode):
+        """Дописывает группу строк по дням; возвращает число выгруженных"""
+        names = [name for name, _ in schema]
+        time_indexes = [names.index(name) for name in TIME_COLUMNS if name in names]
+        ts_index = names.index('timestamp')
+        by_day = {}
+        for row in rows:
+            row = list(row)
+            try:
+                if ts_mode != TS_MICROS:
+                    for i in time_indexes:
+                        row[i] = to_micros(row[i])
+                partition = partition_of(row[ts_index])
+            except (ValueError, TypeError, AttributeError, OverflowError) as e:
+                logger.warning(f"⚠️  Строка id {row[0]} не выгружена: {e}")
+                continue
+            by_day.setdefault(partition, []).append(row)
+
+        for partition, day_rows in by_day.items():
+            name = f"{partition}/{PARTITION_FILE}"
+            writer = self._writer(name, schema)
+            writer.append(day_rows)
+            writer.sync()
+            self.files[name] = writer.length
+
+        # Пропущенные строки тоже остаются позади контрольной точки
+        self.last_id = rows[-1][0]
+        self._save_checkpoint()
+        return sum(len(day_rows) for day_rows in by_day.values())
+
+    def _writer(self, name, schema):
+        """Открытый файл дня; длина берется из контрольной точки, файл не перечитывается"""
+        writer = self._writers.get(name)
+        if writer is None or writer.schema != schema:
+            if writer is not None:
+                writer.close()
+            writer = ColumnarWriter(os.path.join(self.directory, name), schema, self.files.get(name, 0))
+            self._writers[name] = writer
+        return writer
+
+    def _close_writers(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def _checkpoint_path(self):
+        return os.path.join(self.directory, CHECKPOINT_FILE)
+
+    def _load_checkpoint(self):
+        """Читает контрольную точку и отрезает от файлов то, что записано после неё"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._checkpoint_path()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            self.last_id = checkpoint['last_id']
+            self.files = checkpoint['files']
+
+        for entry in os.listdir(self.directory):
+            name = f"{entry}/{PARTITION_FILE}"
+            path = os.path.join(self.directory, name)
+            if not os.path.isfile(path):
+                continue
+            length = self.files.get(name, 0)
+            if os.path.getsize(path) > length:
+                logger.warning(f"⚠️  {name}: отрезаем данные, записанные после контрольной точки")
+                with open(path, 'r+b') as f:
+                    f.truncate(length)
+
+    def _save_checkpoint(self):
+        """Атомарно заменяет _checkpoint.json"""
+        path = self._checkpoint_path()
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({
+                'last_id': self.last_id,
+                'files': self.files,
+                'updated_at': datetime.now().isoformat(),
+            }, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+# =============================================================================
+# ЧТЕНИЕ ВЫГРУЗКИ
+# =============================================================================
+
+def scan(directory, columns=None, first_day=None, last_day=None):
+    """Блоки выгрузки {колонка: значения} за дни first_day..last_day ('ГГГГ-ММ-ДД').
+
+    Читаются только нужные дни и колонки, база приёма не затрагивается.
+    """
+    for entry in sorted(os.listdir(directory)):
+        if not entry.startswith('day='):
+            continue
+        day = entry[len('day='):]
+        if (first_day and day < first_day) or (last_day and day > last_day):
+            continue
+        path = os.path.join(directory, entry, PARTITION_FILE)
+        if os.path.exists(path):
+            yield from read_blocks(path, columns)
+
+# =============================================================================
+# ФОНОВЫЙ ПРОЦЕСС
+# =============================================================================
+
+def lower_priority(nice):
+    """Понижает приоритет процесса (на Windows os.nice нет, приоритет не меняется)"""
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+def run_exporter(database, directory, batch_rows, interval, nice, stop):
+    """Тело фонового процесса: низкий приоритет и выгрузка до остановки"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    lower_priority(nice)
+    try:
+        ColumnarExporter(database, directory, batch_rows, interval).run(stop)
+    except KeyboardInterrupt:
+        pass
+
+def start_exporter(database, directory, batch_rows=50000, interval=300, nice=10):
+    """Запускает выгрузку в отдельном процессе; возвращает (процесс, событие остановки)"""
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=run_exporter, args=(database, directory, batch_rows, interval, nice, stop),
+        name="columnar-export", daemon=True
+    )
+    process.start()
+    logger.info(f"📦 Выгрузка в {directory} каждые {interval} с (PID {process.pid})")
+    return process, stop
+
+def stop_exporter(process, stop, timeout=30):
+    """Останавливает фоновую выгрузку после текущей группы"""
+    stop.set()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+
+# =============================================================================
+# ЗАПУСК ИЗ КОМАНДНОЙ СТРОКИ
+# =============================================================================
+
+def main():
+    """python export_columnar.py [--once] [база] [каталог]"""
+    from config import CENTRAL_SQLITE_DATABASE, EXPORT_DIRECTORY, EXPORT_BATCH_ROWS
+    from config import EXPORT_INTERVAL, EXPORT_NICE
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = sys.argv[1:]
+    once = '--once' in args
+    args = [arg for arg in args if arg != '--once']
+    database = args[0] if args else CENTRAL_SQLITE_DATABASE
+    directory = args[1] if len(args) > 1 else EXPORT_DIRECTORY
+
+    lower_priority(EXPORT_NICE)
+    exporter = ColumnarExporter(database, directory, EXPORT_BATCH_ROWS, EXPORT_INTERVAL)
+    if once:
+        report = exporter.export()
+        print(f"✅ Выгружено {report['exported_rows']} строк, последний id {report['last_id']}, "
+              f"пропущено {report['skipped_rows']}")
+        return
+    try:
+        exporter.run()
+    except KeyboardInterrupt:
+        logger.info(f"\n🛑 Выгрузка остановлена, последний id {exporter.last_id}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# hot_logging.py - Логирование без задержек на пути обработки сообщений
+import atexit
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Режимы подробностей отдельных сообщений и записей
+DETAIL_ALL = 'all'        # каждое
+DETAIL_SAMPLE = 'sample'  # каждое N-е и не чаще заданного числа в секунду
+DETAIL_OFF = 'off'        # только сводка по пакету
+DETAIL_MODES = (DETAIL_ALL, DETAIL_SAMPLE, DETAIL_OFF)
+
+_listener = None
+_queue_handler = None
+
+def setup_logging(logfile=None, queued=True, level=logging.INFO):
+    """Настраивает корневой логгер: консоль и, если задан, файл logfile.
+
+    При queued=True обработчики работают в потоке QueueListener, а потоки
+    приёма и отправки только кладут запись в очередь и не ждут диск и
+    консоль. Повторный вызов (модуль импортирован другим скриптом) ничего
+    не меняет.
+    """
+    global _listener, _queue_handler
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if logfile:
+        os.makedirs(os.path.dirname(logfile) or '.', exist_ok=True)
+        handlers.insert(0, logging.FileHandler(logfile, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    root.setLevel(level)
+
+    if not queued:
+        for handler in handlers:
+            root.addHandler(handler)
+        return
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.addHandler(_queue_handler)
+    _listener.start()
+    # Остаток очереди дописывается при выходе
+    atexit.register(stop_logging)
+    if hasattr(os, 'register_at_fork'):
+        # Поток QueueListener в дочерний процесс (multi_receiver.py) не переходит
+        os.register_at_fork(after_in_child=_restart_listener)
+
+def stop_logging():
+    """Останавливает фоновый поток, дописав все записи из очереди"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _restart_listener():
+    global _listener
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+def fields(**values):
+    """Компактная структурированная строка: key=value через пробел"""
+    return ' '.join(f"{key}={value}" for key, value in values.items())
+
+# =============================================================================
+# ПОДРОБНОСТИ ОТДЕЛЬНЫХ СООБЩЕНИЙ
+# =============================================================================
+
+class MessageDetail:
+    """Решает, писать ли в лог подробности очередного сообщения или записи.
+
+    Режим меняется без перезапуска: set_mode() или словом all/sample/off
+    в switch_file, который проверяется не чаще раза в секунду.
+    """
+
+    def __init__(self, mode=DETAIL_SAMPLE, sample_every=100, max_per_second=5, switch_file=None):
+        self.sample_every = max(1, sample_every)
+        self.max_per_second = max_per_second
+        self.switch_file = switch_file
+        self.mode = None
+        self.set_mode(mode)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._window = 0
+        self._written = 0
+        self._checked_at = 0.0
+        self._switch_mtime = None
+
+    def set_mode(self, mode):
+        if mode not in DETAIL_MODES:
+            raise ValueError(f"Неизвестный режим подробностей: {mode}")
+        if mode != self.mode:
+            self.mode = mode
+            logging.getLogger(__name__).info(f"🔎 Подробности сообщений: {mode}")
+
+    def enabled(self):
+        self._check_switch()
+        if self.mode == DETAIL_ALL:
+            return True
+        if self.mode == DETAIL_OFF or next(self._counter) % self.sample_every:
+            return False
+        if not self.max_per_second:
+            return True
+        window = int(time.monotonic())
+        with self._lock:
+            if window != self._window:
+                self._window = window
+                self._written = 0
+            if self._written >= self.max_per_second:
+                return False
+            self._written += 1
+            return True
+
+    def _check_switch(self):
+        if not self.switch_file:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < 1:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.switch_file)
+            if mtime == self._switch_mtime:
+                return
+            self._switch_mtime = mtime
+            with open(self.switch_file, encoding='utf-8') as f:
+                mode = f.read().strip().lower()
+            self.set_mode(mode)
+        except OSError:
+            # Файла нет - остается текущий режим
+            self._switch_mtime = None
+        except ValueError as e:
+            logging.getLogger(__name__).warning(f"⚠️  {self.switch_file}: {e}")
@@ -0,0 +1,225 @@
+# ingest.py - Групповая запись показаний датчиков в локальную базу отправителя
+import logging
+import math
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from metrics import REGISTRY, LATENCY_BUCKETS, SIZE_BUCKETS
+from mysql_pool import CommitUncertain, is_connection_lost
+
+logger = logging.getLogger(__name__)
+
+INGESTED = REGISTRY.counter('ingest_rows_total', 'Показаний, записанных в sensor_data')
+INGEST_ERRORS = REGISTRY.counter('ingest_write_errors_total', 'Неудачных попыток записи группы показаний')
+INGEST_REJECTED = REGISTRY.counter('ingest_rejected_rows_total', 'Показаний, отброшенных базой как недопустимые')
+INGEST_UNCERTAIN = REGISTRY.counter(
+    'ingest_uncertain_rows_total', 'Показаний, потерявших соединение на COMMIT (не повторяются)'
+)
+INGEST_COMMIT_SECONDS = REGISTRY.histogram(
+    'ingest_commit_seconds', 'Время записи группы показаний одной транзакцией, секунд', LATENCY_BUCKETS
+)
+INGEST_BATCH_ROWS = REGISTRY.histogram('ingest_batch_rows', 'Показаний в группе записи', SIZE_BUCKETS)
+INGEST_QUEUE = REGISTRY.gauge('ingest_queue', 'Элементов в очереди групповой записи')
+
+# Пауза перед повтором неудачной записи, секунд
+RETRY_PAUSE = 1.0
+
+# Маркер остановки фонового потока
+_STOP = object()
+
+def enable_wal(conn, busy_timeout=30):
+    """WAL и synchronous=NORMAL для локальной SQLite базы.
+
+    В WAL запись производителей не блокирует чтение отправителя, а
+    synchronous=NORMAL не ждет fsync на каждом коммите (база не портится,
+    при сбое питания теряются только последние транзакции). busy_timeout -
+    сколько секунд ждать блокировку другого писателя вместо ошибки.
+    """
+    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+    return mode
+
+def reading(item):
+    """Показание в виде (sensor_id, value, timestamp).
+
+    Принимает кортеж (sensor_id, value[, timestamp]) или словарь с теми же
+    ключами; без времени берется момент вызова. Время без пояса - местное
+    (соглашение timestamps.py), с поясом - переводится. Недопустимое показание
+    (sensor_id не целое, value не конечное число, время не разбирается)
+    вызывает ValueError сразу, а не при записи группы.
+    """
+    if isinstance(item, dict):
+        sensor_id, value, timestamp = item['sensor_id'], item['value'], item.get('timestamp')
+    else:
+        sensor_id, value, *rest = item
+        timestamp = rest[0] if rest else None
+
+    if isinstance(sensor_id, bool) or not isinstance(sensor_id, int):
+        raise ValueError(f"sensor_id должен быть целым числом: {sensor_id!r}")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"value должно быть конечным числом: {value!r}")
+    if timestamp is None:
+        timestamp = datetime.now()
+    elif isinstance(timestamp, str):
+        datetime.fromisoformat(timestamp)
+    elif isinstance(timestamp, bool) or not isinstance(timestamp, (datetime, int)):
+        raise ValueError(f"timestamp должен быть datetime, ISO строкой или микросекундами: {timestamp!r}")
+    return sensor_id, value, timestamp
+
+def is_transient_error(error):
+    """Ошибку исправит повтор: база занята другим писателем или соединение потеряно.
+
+    Обрыв во время COMMIT (CommitUncertain) временной ошибкой не считается:
+    транзакция могла быть зафиксирована.
+    """
+    if isinstance(error, sqlite3.OperationalError):
+        message = str(error).lower()
+        return 'locked' in message or 'busy' in message
+    return is_connection_lost(error)
+
+# =============================================================================
+# БУФЕР ПОКАЗАНИЙ
+# =============================================================================
+
+class ReadingBuffer:
+    """Принимает показания из любых потоков и пишет их группами.
+
+    add() и add_many() только ставят показания в очередь. Фоновый поток
+    вызывает write(rows) - вставку одной транзакцией - когда набралось
+    max_rows показаний или с первого из них прошло max_delay_ms. Один
+    писатель вместо тысячи мелких коммитов: нет борьбы за блокировку базы.
+    Группа, не записанная из-за временной ошибки (is_transient_error),
+    повторяется через RETRY_PAUSE; пока она не записана, очередь растет и
+    при max_queue элементах add() ждет. Группу, отвергнутую базой по другой
+    причине, буфер делит пополам, пока не найдет недопустимые строки: они
+    пишутся в лог и отбрасываются, остальные записываются. Группа, потерявшая
+    соединение во время COMMIT (mysql_pool.CommitUncertain), не повторяется:
+    она могла быть записана, а повтор задвоил бы показания. Её строки
+    пишутся в лог для сверки.
+    """
+
+    def __init__(self, write, max_rows=1000, max_delay_ms=100, max_queue=100000, on_close=None,
+                 transient=is_transient_error):
+        self.write = write
+        self.on_close = on_close
+        self.transient = transient
+        self.max_rows = max(1, int(max_rows))
+        self.max_delay = max_delay_ms / 1000.0
+        self.rows_written = 0
+        self.batches_written = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="reading-buffer", daemon=True)
+        INGEST_QUEUE.set_function(self._queue.qsize)
+
+    def start(self):
+        """Запускает фоновый поток записи"""
+        self._thread.start()
+        return self
+
+    def add(self, sensor_id, value, timestamp=None):
+        """Одно показание; время по умолчанию - момент вызова. Недопустимое - ValueError"""
+        self._queue.put([reading((sensor_id, value, timestamp))])
+
+    def add_many(self, readings):
+        """Массив показаний (кортежи или словари, см. reading()) одним элементом очереди.
+
+        Если хотя бы одно показание недопустимо - ValueError, массив не ставится в очередь.
+        """
+        rows = [reading(item) for item in readings]
+        if rows:
+            self._queue.put(rows)
+
+    def flush(self, timeout=None):
+        """Записывает всё накопленное и ждёт завершения записи"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Дописывает очередь и останавливает поток"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if self.on_close:
+            self.on_close()
+        logger.info(f"📥 Записано {self.rows_written} показаний в {self.batches_written} транзакциях")
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if not pending else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # Истёк срок ожидания неполной группы (или пауза перед повтором)
+                pending = self._write(pending)
+                deadline = time.monotonic() + RETRY_PAUSE
+                continue
+
+            if item is _STOP:
+                pending = self._write(pending)
+                if pending:
+                    logger.error(f"❌ Не записано {len(pending)} показаний при остановке")
+                return
+            if isinstance(item, threading.Event):
+                pending = self._write(pending)
+                deadline = time.monotonic() + RETRY_PAUSE
+                item.set()
+                continue
+
+            if not pending:
+                deadline = time.monotonic() + self.max_delay
+            pending.extend(item)
+            if len(pending) >= self.max_rows:
+                pending = self._write(pending)
+                deadline = time.monotonic() + RETRY_PAUSE
+
+    def _write(self, pending):
+        """Пишет группами по max_rows; возвращает то, что нужно повторить"""
+        for start in range(0, len(pending), self.max_rows):
+            retry = self._write_group(pending[start:start + self.max_rows])
+            if retry:
+                return retry + pending[start + self.max_rows:]
+        return []
+
+    def _write_group(self, rows):
+        """Пишет группу, отбрасывая недопустимые строки; возвращает незаписанные из-за временной ошибки"""
+        # Части группы в порядке записи: следующая - в конце списка
+        parts = [rows]
+        while parts:
+            part = parts.pop()
+            try:
+                with INGEST_COMMIT_SECONDS.time():
+                    self.write(part)
+            except CommitUncertain as e:
+                INGEST_ERRORS.inc()
+                INGEST_UNCERTAIN.inc(len(part))
+                logger.error(
+                    f"❌ Соединение потеряно во время COMMIT, {len(part)} показаний могли быть "
+                    f"записаны и не повторяются ({e}): {part}"
+                )
+                continue
+            except Exception as e:
+                INGEST_ERRORS.inc()
+                if self.transient(e):
+                    logger.error(f"❌ Ошибка записи {len(part)} показаний, повтор через {RETRY_PAUSE} с: {e}")
+                    return part + [row for later in reversed(parts) for row in later]
+                if len(part) == 1:
+                    INGEST_REJECTED.inc()
+                    logger.error(f"❌ Показание отброшено: {part[0]}: {e}")
+                    continue
+                middle = len(part) // 2
+                parts.append(part[middle:])
+                parts.append(part[:middle])
+                continue
+            self.rows_written += len(part)
+            self.batches_written += 1
+            INGESTED.inc(len(part))
+            INGEST_BATCH_ROWS.observe(len(part))
+        return []
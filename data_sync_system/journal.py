@@ -0,0 +1,166 @@
+# journal.py - Журнал принятых данных: буферизованная запись с разбиением на сегменты
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Политики fsync
+FSYNC_BATCH = 'batch'        # после каждой пачки записей
+FSYNC_INTERVAL = 'interval'  # не реже чем раз в fsync_interval секунд
+FSYNC_NEVER = 'never'        # сброс в ОС при заполнении буфера, без fsync
+
+def _segment_pattern(path):
+    stem, ext = os.path.splitext(path)
+    return stem, ext or '.log'
+
+def segment_path(path, index):
+    """received_data.log, 3 -> received_data.000003.log"""
+    stem, ext = _segment_pattern(path)
+    return f"{stem}.{index:06d}{ext}"
+
+def _numbered_segments(path):
+    """Пары (номер, файл) сегментов, сжатых и несжатых"""
+    stem, ext = _segment_pattern(path)
+    pattern = re.compile(re.escape(stem) + r'\.(\d+)' + re.escape(ext) + r'(\.gz)?')
+    numbered = []
+    for candidate in glob.glob(f"{glob.escape(stem)}.*{ext}*"):
+        match = pattern.fullmatch(candidate)
+        if match:
+            numbered.append((int(match.group(1)), candidate))
+    return numbered
+
+def list_segments(path):
+    """Все сегменты журнала по порядку: сначала старый файл без номера, затем по номерам"""
+    # Если сжатие не успело удалить исходный файл, берем несжатый
+    by_index = {}
+    for index, candidate in sorted(_numbered_segments(path)):
+        if index not in by_index or not candidate.endswith('.gz'):
+            by_index[index] = candidate
+    legacy = [path] if os.path.exists(path) else []
+    return legacy + [by_index[i] for i in sorted(by_index)]
+
+# =============================================================================
+# ЗАПИСЬ ЖУРНАЛА
+# =============================================================================
+
+class JournalWriter:
+    """Добавляет записи JSON-строками в текущий сегмент журнала.
+
+    Файл открывается один раз и пишется через буфер buffer_size; пачка
+    записей одного сообщения уходит одним write. Сегмент закрывается, когда
+    превышает segment_max_bytes или живет дольше segment_max_seconds;
+    закрытые сегменты при compress=True сжимаются gzip в фоновом потоке.
+    """
+
+    def __init__(self, path, segment_max_bytes=64 * 1024 * 1024, segment_max_seconds=3600,
+                 fsync=FSYNC_INTERVAL, fsync_interval=1.0, compress=True, buffer_size=256 * 1024):
+        if fsync not in (FSYNC_BATCH, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f"Неизвестная политика fsync: {fsync}")
+        self.path = path
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compress = compress
+        self.buffer_size = buffer_size
+        self.records_written = 0
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._index = max((i for i, _ in _numbered_segments(path)), default=0)
+        self._opened_at = 0.0
+        self._size = 0
+        self._dirty = False
+        self._compressors = []
+        self._stopped = threading.Event()
+        self._syncer = None
+        if fsync == FSYNC_INTERVAL:
+            self._syncer = threading.Thread(target=self._sync_loop, name="journal-fsync", daemon=True)
+            self._syncer.start()
+
+    def append(self, entries):
+        """Добавляет пачку записей (словарей) одной операцией записи"""
+        data = ''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in entries).encode('utf-8')
+        if not data:
+            return
+        with self._lock:
+            if self._file is None or self._segment_full():
+                self._rotate()
+            self._file.write(data)
+            self._size += len(data)
+            self._dirty = True
+            self.records_written += len(entries)
+            if self.fsync == FSYNC_BATCH:
+                self._sync()
+
+    def flush(self):
+        """Сбрасывает буфер и выполняет fsync"""
+        with self._lock:
+            if self._file is not None and self._dirty:
+                self._sync()
+
+    def close(self):
+        self._stopped.set()
+        if self._syncer:
+            self._syncer.join()
+        with self._lock:
+            # Следующий запуск начнет новый сегмент, этот уже закрыт
+            self._close_segment(compress=self.compress)
+        for thread in self._compressors:
+            thread.join()
+        logger.info(f"📒 Журнал {self.path}: записано {self.records_written} записей")
+
+    def _segment_full(self):
+        return (self._size >= self.segment_max_bytes
+                or time.monotonic() - self._opened_at >= self.segment_max_seconds)
+
+    def _rotate(self):
+        self._close_segment(compress=self.compress)
+        self._index += 1
+        path = segment_path(self.path, self._index)
+        self._file = open(path, 'ab', buffering=self.buffer_size)
+        self._opened_at = time.monotonic()
+        self._size = self._file.tell()
+
+    def _close_segment(self, compress):
+        """Закрывает текущий сегмент; сжатие идет в фоне, close() его дожидается"""
+        if self._file is None:
+            return
+        self._sync()
+        self._file.close()
+        closed = self._file.name
+        self._file = None
+        if compress:
+            thread = threading.Thread(target=self._compress, args=(closed,), name="journal-gzip", daemon=True)
+            thread.start()
+            self._compressors = [t for t in self._compressors if t.is_alive()] + [thread]
+
+    def _sync(self):
+        self._file.flush()
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self._file.fileno())
+        self._dirty = False
+
+    def _sync_loop(self):
+        while not self._stopped.wait(self.fsync_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"❌ Ошибка fsync журнала: {e}")
+
+    @staticmethod
+    def _compress(path):
+        try:
+            with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path + '.gz.tmp', path + '.gz')
+            os.remove(path)
+        except OSError as e:
+            logger.error(f"❌ Ошибка сжатия сегмента {path}: {e}")
@@ -0,0 +1,238 @@
+# local_broker.py - Минимальный MQTT 3.1.1 брокер для работы и замеров без интернета
+import itertools
+import logging
+import socket
+import socketserver
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Типы пакетов MQTT 3.1.1 (старшие 4 бита первого байта)
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+SHARE_PREFIX = '$share/'
+
+def topic_matches(topic_filter, topic):
+    """Топик подходит под фильтр подписки с + и #"""
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+def _packet(packet_type, flags, body):
+    return bytes([packet_type << 4 | flags]) + _encode_length(len(body)) + body
+
+def _string(data, offset):
+    length = struct.unpack_from('!H', data, offset)[0]
+    return data[offset + 2:offset + 2 + length].decode('utf-8'), offset + 2 + length
+
+# =============================================================================
+# СОЕДИНЕНИЕ КЛИЕНТА
+# =============================================================================
+
+class _Session(socketserver.StreamRequestHandler):
+    """Одно соединение: чтение пакетов в своём потоке, запись под блокировкой"""
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.write_lock = threading.Lock()
+        self.packet_ids = itertools.cycle(range(1, 65536))
+        self.client_id = None
+
+    def send(self, data):
+        with self.write_lock:
+            self.request.sendall(data)
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            while True:
+                first = self.rfile.read(1)
+                if not first:
+                    return
+                length, multiplier = 0, 1
+                while True:
+                    byte = self.rfile.read(1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = self.rfile.read(length)
+                packet_type, flags = first[0] >> 4, first[0] & 0x0F
+
+                if packet_type == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic, offset = _string(body, 0)
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                    broker.route(topic, body[offset:], qos)
+                    if qos:
+                        # PUBACK после передачи подписчикам, как у настоящего брокера
+                        self.send(_packet(PUBACK, 0, packet_id))
+                elif packet_type == PUBACK:
+                    # Повторная доставка не поддерживается, подтверждения подписчиков не нужны
+                    pass
+                elif packet_type == CONNECT:
+                    _, offset = _string(body, 0)
+                    self.client_id, _ = _string(body, offset + 4)
+                    self.send(_packet(CONNACK, 0, b'\x00\x00'))
+                elif packet_type == SUBSCRIBE:
+                    granted = bytearray()
+                    offset = 2
+                    while offset < len(body):
+                        topic_filter, offset = _string(body, offset)
+                        qos = min(body[offset], 1)
+                        offset += 1
+                        broker.subscribe(self, topic_filter, qos)
+                        granted.append(qos)
+                    self.send(_packet(SUBACK, 0, body[:2] + bytes(granted)))
+                elif packet_type == UNSUBSCRIBE:
+                    offset = 2
+                    while offset < len(body):
+                        topic_filter, offset = _string(body, offset)
+                        broker.unsubscribe(self, topic_filter)
+                    self.send(_packet(UNSUBACK, 0, body[:2]))
+                elif packet_type == PINGREQ:
+                    self.send(_packet(PINGRESP, 0, b''))
+                elif packet_type == DISCONNECT:
+                    return
+        except (OSError, IndexError):
+            pass
+        finally:
+            broker.drop(self)
+
+    def deliver(self, topic, payload, qos):
+        body = struct.pack('!H', len(topic)) + topic
+        if qos:
+            body += struct.pack('!H', next(self.packet_ids))
+        try:
+            self.send(_packet(PUBLISH, qos << 1, body + payload))
+        except OSError:
+            pass
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# =============================================================================
+# БРОКЕР
+# =============================================================================
+
+class LocalBroker:
+    """Брокер для одной машины: QoS 0 и 1, фильтры с + и #, общие подписки $share.
+
+    Сообщения не хранятся: нет retain, сессий и повторной доставки.
+    Этого достаточно, чтобы отправитель и приёмники работали без
+    broker.hivemq.com, а замеры не зависели от сети. port=0 - свободный порт.
+    """
+
+    def __init__(self, host='127.0.0.1', port=1883):
+        self.host = host
+        self.port = port
+        # (сессия, фильтр) -> QoS; общие: (группа, фильтр) -> список [сессия, QoS]
+        self._subscriptions = {}
+        self._shared = {}
+        self._turns = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.routed = 0
+
+    def start(self):
+        self._server = _Server((self.host, self.port), _Session)
+        self._server.broker = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="local-broker", daemon=True)
+        self._thread.start()
+        logger.info(f"📡 Локальный брокер: {self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+
+    def subscribe(self, session, topic_filter, qos):
+        with self._lock:
+            if topic_filter.startswith(SHARE_PREFIX):
+                group, _, shared_filter = topic_filter[len(SHARE_PREFIX):].partition('/')
+                members = self._shared.setdefault((group, shared_filter), [])
+                members[:] = [m for m in members if m[0] is not session] + [[session, qos]]
+            else:
+                self._subscriptions[(session, topic_filter)] = qos
+
+    def unsubscribe(self, session, topic_filter):
+        with self._lock:
+            if topic_filter.startswith(SHARE_PREFIX):
+                group, _, shared_filter = topic_filter[len(SHARE_PREFIX):].partition('/')
+                members = self._shared.get((group, shared_filter), [])
+                members[:] = [m for m in members if m[0] is not session]
+            else:
+                self._subscriptions.pop((session, topic_filter), None)
+
+    def drop(self, session):
+        """Соединение закрыто: убираем все его подписки"""
+        with self._lock:
+            for key in [key for key in self._subscriptions if key[0] is session]:
+                del self._subscriptions[key]
+            for members in self._shared.values():
+                members[:] = [m for m in members if m[0] is not session]
+
+    def route(self, topic, payload, qos):
+        """Передает сообщение подписчикам; общей группе - одному участнику по очереди"""
+        targets = []
+        with self._lock:
+            self.routed += 1
+            for (session, topic_filter), granted in self._subscriptions.items():
+                if topic_matches(topic_filter, topic):
+                    targets.append((session, min(qos, granted)))
+            for key, members in self._shared.items():
+                if members and topic_matches(key[1], topic):
+                    turn = self._turns.get(key, 0) % len(members)
+                    self._turns[key] = turn + 1
+                    session, granted = members[turn]
+                    targets.append((session, min(qos, granted)))
+        encoded = topic.encode('utf-8')
+        for session, target_qos in targets:
+            session.deliver(encoded, payload, target_qos)
+
+# =============================================================================
+# ЗАПУСК ИЗ КОМАНДНОЙ СТРОКИ
+# =============================================================================
+
+def main():
+    """python local_broker.py [порт] - брокер для запуска системы без интернета"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1883
+    broker = LocalBroker('127.0.0.1', port).start()
+    logger.info("⏹️  Для остановки нажмите Ctrl+C")
+    logger.info(f"💡 Отправитель и приёмники: SYNC_MQTT_BROKER=127.0.0.1 SYNC_MQTT_PORT={broker.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        logger.info(f"\n🛑 Брокер остановлен, передано сообщений: {broker.routed}")
+    finally:
+        broker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# message_format.py - Формат пакетных MQTT сообщений (несколько записей в одном)
+import time
+
+from metrics import REGISTRY, SIZE_BUCKETS
+
+# Маркер пакетного сообщения. Сообщения без него - старый формат "одна запись"
+BATCH_TYPE = "batch"
+
+# Поля, которые отличаются у каждой записи; остальное уходит в общий заголовок
+RECORD_FIELDS = ("id", "sensor_id", "value", "timestamp")
+# Необязательные поля записи: передаются, только если они есть у записей пакета.
+# seq - номер изменения в outbox: по нему приёмник отличает повтор QoS 1 от
+# следующего изменения той же строки
+OPTIONAL_FIELDS = ("op", "seq")
+
+# Вид изменения в поле "op" (режим захвата изменений); без поля - вставка
+OP_INSERT = "I"
+OP_UPDATE = "U"
+OP_DELETE = "D"
+
+BATCH_RECORDS = REGISTRY.histogram('sync_batch_records', 'Записей в отправленном пакете', SIZE_BUCKETS)
+
+# =============================================================================
+# УПАКОВКА
+# =============================================================================
+
+def pack_records(records, header):
+    """Упаковывает записи в словарь-сообщение.
+
+    records - список словарей с полями RECORD_FIELDS, header - общие поля
+    (source, version, database_type). Одна запись упаковывается в прежний
+    формат, чтобы её понимали и старые приёмники.
+    """
+    fields = RECORD_FIELDS + tuple(
+        field for field in OPTIONAL_FIELDS if any(field in r for r in records)
+    )
+    if len(records) == 1:
+        return {**{field: records[0].get(field) for field in fields}, **header}
+    return {
+        "type": BATCH_TYPE,
+        "header": header,
+        "count": len(records),
+        "columns": {field: [r.get(field) for r in records] for field in fields},
+    }
+
+# =============================================================================
+# РАСПАКОВКА
+# =============================================================================
+
+def unpack_message(payload):
+    """Возвращает список записей из сообщения любого формата.
+
+    Каждая запись - плоский словарь, как в старом формате "одна запись":
+    поля заголовка пакета копируются в каждую запись.
+    """
+    if not isinstance(payload, dict) or payload.get("type") != BATCH_TYPE:
+        return [payload]
+
+    header = payload.get("header", {})
+    columns = payload.get("columns", {})
+    count = len(next(iter(columns.values()), []))
+    return [
+        {**header, **{field: values[i] for field, values in columns.items()}}
+        for i in range(count)
+    ]
+
+def is_delete(record):
+    """Запись сообщает об удалении строки на стороне отправителя"""
+    return record.get("op") == OP_DELETE
+
+# =============================================================================
+# НАКОПИТЕЛЬ ПАКЕТА
+# =============================================================================
+
+class BatchAccumulator:
+    """Копит записи, пока не наберётся max_records или не пройдёт max_delay_ms
+    с момента добавления первой записи пакета"""
+
+    def __init__(self, max_records=100, max_delay_ms=200):
+        self.max_records = max(1, int(max_records))
+        self.max_delay = max_delay_ms / 1000.0
+        self.records = []
+        # Время (от эпохи) первой записи текущего пакета; take() его не сбрасывает
+        self.picked_at = None
+        self._started_at = None
+
+    def add(self, record):
+        """Добавляет запись; возвращает True, если пакет пора отправлять"""
+        if not self.records:
+            self._started_at = time.monotonic()
+            self.picked_at = time.time()
+        self.records.append(record)
+        return self.is_due()
+
+    def is_due(self):
+        if not self.records:
+            return False
+        return (len(self.records) >= self.max_records
+                or time.monotonic() - self._started_at >= self.max_delay)
+
+    def take(self):
+        """Забирает накопленные записи и начинает новый пакет"""
+        records, self.records = self.records, []
+        self._started_at = None
+        if records:
+            BATCH_RECORDS.observe(len(records))
+        return records
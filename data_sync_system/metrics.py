@@ -0,0 +1,259 @@
+# metrics.py - Счётчики, показатели и гистограммы; HTTP /metrics в формате Prometheus
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм по умолчанию
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# =============================================================================
+# МЕТРИКИ
+# =============================================================================
+
+class Counter:
+    """Монотонно растущий счётчик"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def value(self):
+        return self._value
+
+    def samples(self):
+        return [(self.name, '', self._value)]
+
+
+class Gauge:
+    """Текущее значение: задается set() или функцией, вызываемой при чтении"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._value = 0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        """Значение читается из function() в момент снятия метрик"""
+        self._function = function
+
+    def value(self):
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception:
+                return float('nan')
+        return self._value
+
+    def samples(self):
+        return [(self.name, '', self.value())]
+
+
+class Histogram:
+    """Распределение наблюдений по корзинам с верхними границами buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def time(self):
+        """with histogram.time(): ... - наблюдает длительность блока в секундах"""
+        return _Timer(self)
+
+    def value(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative, running = {}, 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            running += bucket_count
+            cumulative[str(bound)] = running
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+    def samples(self):
+        snapshot = self.value()
+        samples = [
+            (f"{self.name}_bucket", f'{{le="{bound}"}}', count)
+            for bound, count in snapshot['buckets'].items()
+        ]
+        samples.append((f"{self.name}_sum", '', snapshot['sum']))
+        samples.append((f"{self.name}_count", '', snapshot['count']))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+# =============================================================================
+# РЕЕСТР
+# =============================================================================
+
+class Registry:
+    """Набор метрик процесса. Повторная регистрация имени возвращает ту же метрику"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        return self._register(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._register(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help_text, buckets)
+
+    def _register(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Метрика {name} уже зарегистрирована как {metric.kind}")
+            return metric
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        lines = []
+        for metric in self._sorted():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Значения всех метрик словарем (для JSON снимка)"""
+        return {metric.name: metric.value() for metric in self._sorted()}
+
+    def _sorted(self):
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda m: m.name)
+
+# Реестр процесса: модули регистрируют в нем свои метрики при импорте
+REGISTRY = Registry()
+
+# =============================================================================
+# HTTP И СНИМКИ
+# =============================================================================
+
+class MetricsServer:
+    """Отдает метрики по HTTP (GET /metrics) и пишет снимок в JSON файл.
+
+    port=0 - без HTTP, пустой snapshot_file - без снимков. Занятый порт
+    не останавливает процесс: метрики остаются доступны в снимках.
+    """
+
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=9101,
+                 snapshot_file=None, snapshot_interval=60):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.snapshot_file = snapshot_file
+        self.snapshot_interval = snapshot_interval
+        self._httpd = None
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.port:
+            try:
+                self._httpd = ThreadingHTTPServer((self.host, self.port), self._handler())
+                self._httpd.daemon_threads = True
+                self._spawn(self._httpd.serve_forever, "metrics-http")
+                logger.info(f"📈 Метрики: http://{self.host}:{self.port}/metrics")
+            except OSError as e:
+                logger.warning(f"⚠️  Порт метрик {self.port} недоступен: {e}")
+        if self.snapshot_file:
+            os.makedirs(os.path.dirname(self.snapshot_file) or '.', exist_ok=True)
+            self._spawn(self._snapshot_loop, "metrics-snapshot")
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self.snapshot_file:
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        data = {'time': time.time(), 'metrics': self.registry.snapshot()}
+        tmp = self.snapshot_file + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.snapshot_file)
+        except OSError as e:
+            logger.error(f"❌ Ошибка записи снимка метрик: {e}")
+
+    def _snapshot_loop(self):
+        while not self._stopped.wait(self.snapshot_interval):
+            self.write_snapshot()
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Опрос каждые несколько секунд не должен попадать в лог
+                pass
+
+        return Handler
@@ -0,0 +1,325 @@
+# migrate_timestamps.py - Перевод колонок времени SQLite таблиц из ISO строк в микросекунды
+import logging
+import re
+import sqlite3
+import sys
+
+from rollup import ROLLUP_TABLES, ROLLUP_TRIGGERS, rollup_triggers_sql
+from timestamps import TS_MICROS, storage_mode, to_micros
+
+logger = logging.getLogger(__name__)
+
+# Колонки, которые переводятся в INTEGER
+TIME_COLUMNS = ('timestamp', 'received_at')
+# Таблицы отправителей и приёмников, которые умеет переводить миграция
+MIGRATABLE_TABLES = ('sensor_data', 'sensor_outbox', 'received_data')
+
+# =============================================================================
+# МИГРАЦИЯ ОДНОЙ ТАБЛИЦЫ
+# =============================================================================
+
+class TimestampMigration:
+    """Переводит таблицу в режим 'micros', не останавливая запись в неё.
+
+    1. Рядом создается копия таблицы с INTEGER колонками времени и
+       триггеры, запоминающие id строк, измененных или удаленных во
+       время копирования (например, флаг sent у отправителя).
+    2. Строки копируются порциями по batch_rows, позиция сохраняется в
+       timestamp_migration - прерванную миграцию можно продолжить.
+    3. Одной короткой транзакцией докопируются новые и измененные строки,
+       старая таблица заменяется копией, индексы и триггеры пересоздаются.
+    4. Строки, которые успел записать ISO строкой процесс, запущенный до
+       миграции, переводятся на месте (repair).
+
+    Вместе с received_data так же перестраиваются таблицы агрегатов
+    rollup_*: колонка last_timestamp становится INTEGER, иначе микросекунды
+    хранились бы строками и сравнивались как текст.
+
+    После шага 3 процессы, пишущие в таблицу, нужно перезапустить: режим
+    хранения они определяют по схеме при старте.
+    """
+
+    def __init__(self, conn, table, batch_rows=10000):
+        if table not in MIGRATABLE_TABLES:
+            raise ValueError(f"Таблица {table} не поддерживается миграцией")
+        self.conn = conn
+        self.table = table
+        self.batch_rows = batch_rows
+        self.copy_table = f'{table}_micros'
+        self.dirty_table = f'{table}_migration_dirty'
+        self.triggers = (f'trg_{table}_migration_update', f'trg_{table}_migration_delete')
+        self._columns = None
+        self._time_indexes = None
+
+    def run(self):
+        if storage_mode(self.conn, self.table) != TS_MICROS:
+            self._prepare()
+            self._copy()
+            self._swap()
+        elif self._text_rollups():
+            # received_data переведена раньше, чем миграция стала перестраивать агрегаты
+            self.conn.execute("PRAGMA legacy_alter_table = ON")
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._rebuild_rollups()
+            self.conn.execute("COMMIT")
+            self.conn.execute("PRAGMA legacy_alter_table = OFF")
+        self.repair()
+
+    def _prepare(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS timestamp_migration (
+                table_name TEXT PRIMARY KEY,
+                position INTEGER NOT NULL
+            )
+        ''')
+        state = self.conn.execute(
+            "SELECT position FROM timestamp_migration WHERE table_name = ?", (self.table,)
+        ).fetchone()
+        if state:
+            self.conn.execute("COMMIT")
+            logger.info(f"🔁 {self.table}: продолжаем миграцию с id {state[0]}")
+            return
+
+        (table_sql,) = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table,)
+        ).fetchone()
+        self.conn.execute(self._micros_ddl(table_sql))
+        self.conn.execute(f"CREATE TABLE {self.dirty_table} (row_id INTEGER PRIMARY KEY)")
+        self.conn.execute(f'''
+            CREATE TRIGGER {self.triggers[0]} AFTER UPDATE ON {self.table}
+            BEGIN INSERT OR IGNORE INTO {self.dirty_table} VALUES (NEW.rowid); END
+        ''')
+        self.conn.execute(f'''
+            CREATE TRIGGER {self.triggers[1]} AFTER DELETE ON {self.table}
+            BEGIN INSERT OR IGNORE INTO {self.dirty_table} VALUES (OLD.rowid); END
+        ''')
+        self.conn.execute(
+            "INSERT INTO timestamp_migration (table_name, position) VALUES (?, 0)", (self.table,)
+        )
+        self.conn.execute("COMMIT")
+        logger.info(f"🚀 {self.table}: начата миграция времени в микросекунды")
+
+    def _micros_ddl(self, table_sql):
+        sql = re.sub(r'^CREATE TABLE\s+("?)\w+\1', f'CREATE TABLE {self.copy_table}', table_sql)
+        for column in TIME_COLUMNS:
+            sql = re.sub(rf'\b({column})\s+TEXT\b', r'\1 INTEGER', sql, flags=re.IGNORECASE)
+        return sql
+
+    def _copy(self):
+        (position,) = self.conn.execute(
+            "SELECT position FROM timestamp_migration WHERE table_name = ?", (self.table,)
+        ).fetchone()
+        while True:
+            self.conn.execute("BEGIN IMMEDIATE")
+            last = self._copy_rows(
+                f"SELECT rowid, * FROM {self.table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (position, self.batch_rows)
+            )
+            if last is None:
+                self.conn.execute("COMMIT")
+                return
+            position = last
+            self.conn.execute(
+                "UPDATE timestamp_migration SET position = ? WHERE table_name = ?",
+                (position, self.table)
+            )
+            self.conn.execute("COMMIT")
+            logger.info(f"📦 {self.table}: скопировано до id {position}")
+
+    def _copy_rows(self, select_sql, params):
+        """Копирует строки с переводом времени; возвращает rowid последней или None"""
+        cursor = self.conn.execute(select_sql, params)
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        if self._columns is None:
+            self._columns = [d[0] for d in cursor.description[1:]]
+            self._time_indexes = [i for i, c in enumerate(self._columns) if c in TIME_COLUMNS]
+
+        converted = []
+        for row in rows:
+            values = list(row[1:])
+            for i in self._time_indexes:
+                values[i] = to_micros(values[i])
+            converted.append(values)
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO {self.copy_table} ({', '.join(self._columns)}) "
+            f"VALUES ({', '.join('?' * len(self._columns))})",
+            converted
+        )
+        return rows[-1][0]
+
+    def _swap(self):
+        # Переименование не трогает триггеры других таблиц (outbox ссылается на sensor_outbox)
+        self.conn.execute("PRAGMA legacy_alter_table = ON")
+        self.conn.execute("BEGIN IMMEDIATE")
+        # Всё, что появилось после последней порции
+        (position,) = self.conn.execute(
+            "SELECT position FROM timestamp_migration WHERE table_name = ?", (self.table,)
+        ).fetchone()
+        while True:
+            last = self._copy_rows(
+                f"SELECT rowid, * FROM {self.table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (position, self.batch_rows)
+            )
+            if last is None:
+                break
+            position = last
+
+        # Строки, измененные или удаленные после копирования
+        self.conn.execute(
+            f"DELETE FROM {self.copy_table} WHERE rowid IN (SELECT row_id FROM {self.dirty_table})"
+        )
+        after = 0
+        while True:
+            ids = self.conn.execute(
+                f"SELECT row_id FROM {self.dirty_table} WHERE row_id > ? ORDER BY row_id LIMIT ?",
+                (after, self.batch_rows)
+            ).fetchall()
+            if not ids:
+                break
+            self._copy_rows(
+                f"SELECT rowid, * FROM {self.table} WHERE rowid > ? AND rowid <= ? "
+                f"AND rowid IN (SELECT row_id FROM {self.dirty_table})",
+                (after, ids[-1][0])
+            )
+            after = ids[-1][0]
+
+        # Индексы и триггеры старой таблицы (кроме служебных) пересоздаются на новой
+        rebuilt = self.conn.execute('''
+            SELECT name, sql FROM sqlite_master
+            WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        ''', (self.table,)).fetchall()
+        skip = set(self.triggers) | set(ROLLUP_TRIGGERS)
+        had_rollups = any(name in ROLLUP_TRIGGERS for name, _ in rebuilt)
+
+        self.conn.execute(f"DROP TABLE {self.table}")
+        self.conn.execute(f"DROP TABLE {self.dirty_table}")
+        self.conn.execute(f"ALTER TABLE {self.copy_table} RENAME TO {self.table}")
+        for name, sql in rebuilt:
+            if name not in skip:
+                self.conn.execute(sql)
+        if had_rollups:
+            # Интервалы агрегатов теперь считаются из микросекунд
+            for sql in rollup_triggers_sql(TS_MICROS):
+                self.conn.execute(sql)
+        self._rebuild_rollups()
+
+        self.conn.execute("DELETE FROM timestamp_migration WHERE table_name = ?", (self.table,))
+        self.conn.execute("COMMIT")
+        self.conn.execute("PRAGMA legacy_alter_table = OFF")
+        logger.info(f"✅ {self.table}: таблица переведена на микросекунды")
+
+    def _text_rollups(self):
+        """Таблицы агрегатов received_data, где last_timestamp еще не INTEGER"""
+        if self.table != 'received_data':
+            return []
+        tables = []
+        for table in ROLLUP_TABLES.values():
+            for _, name, declared, *_ in self.conn.execute(f"PRAGMA table_info({table})"):
+                if name == 'last_timestamp' and 'INT' not in declared.upper():
+                    tables.append(table)
+        return tables
+
+    def _rebuild_rollups(self):
+        """Пересоздает таблицы агрегатов с INTEGER last_timestamp (внутри транзакции)"""
+        for table in self._text_rollups():
+            copy_table = f'{table}_micros'
+            (table_sql,) = self.conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()
+            sql = re.sub(r'^CREATE TABLE\s+("?)\w+\1', f'CREATE TABLE {copy_table}', table_sql)
+            sql = re.sub(r'\b(last_timestamp)\s+TEXT\b', r'\1 INTEGER', sql, flags=re.IGNORECASE)
+            self.conn.execute(f"DROP TABLE IF EXISTS {copy_table}")
+            self.conn.execute(sql)
+
+            cursor = self.conn.execute(f"SELECT * FROM {table}")
+            columns = [d[0] for d in cursor.description]
+            ts_index = columns.index('last_timestamp')
+            insert_sql = (f"INSERT INTO {copy_table} ({', '.join(columns)}) "
+                          f"VALUES ({', '.join('?' * len(columns))})")
+            while True:
+                rows = cursor.fetchmany(self.batch_rows)
+                if not rows:
+                    break
+                converted = []
+                for row in rows:
+                    values = list(row)
+                    values[ts_index] = _rollup_micros(values[ts_index])
+                    converted.append(values)
+                self.conn.executemany(insert_sql, converted)
+            cursor.close()
+
+            self.conn.execute(f"DROP TABLE {table}")
+            self.conn.execute(f"ALTER TABLE {copy_table} RENAME TO {table}")
+            logger.info(f"✅ {table}: last_timestamp переведен на микросекунды")
+
+    def repair(self):
+        """Переводит ISO строки, записанные в уже мигрированную таблицу"""
+        columns = [
+            row[1] for row in self.conn.execute(f"PRAGMA table_info({self.table})")
+            if row[1] in TIME_COLUMNS
+        ]
+        repaired = 0
+        for column in columns:
+            position = 0
+            while True:
+                rows = self.conn.execute(f'''
+                    SELECT rowid, {column} FROM {self.table}
+                    WHERE rowid > ? AND typeof({column}) = 'text'
+                    ORDER BY rowid LIMIT ?
+                ''', (position, self.batch_rows)).fetchall()
+                if not rows:
+                    break
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.executemany(
+                    f"UPDATE {self.table} SET {column} = ? WHERE rowid = ?",
+                    [(to_micros(value), rowid) for rowid, value in rows]
+                )
+                self.conn.execute("COMMIT")
+                repaired += len(rows)
+                position = rows[-1][0]
+        if repaired:
+            logger.info(f"🔧 {self.table}: переведено значений, записанных строкой: {repaired}")
+
+def _rollup_micros(value):
+    """last_timestamp агрегата -> микросекунды.
+
+    В TEXT колонке лежат ISO строки, записанные до миграции, и микросекунды,
+    сохраненные строкой цифр триггерами после неё.
+    """
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return to_micros(value)
+
+# =============================================================================
+# ЗАПУСК ИЗ КОМАНДНОЙ СТРОКИ
+# =============================================================================
+
+def migrate_database(database, tables=None, batch_rows=10000):
+    """Переводит все (или указанные) таблицы базы в режим 'micros'"""
+    conn = sqlite3.connect(database, isolation_level=None, timeout=30)
+    try:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in tables or MIGRATABLE_TABLES:
+            if table in existing:
+                TimestampMigration(conn, table, batch_rows).run()
+    finally:
+        conn.close()
+
+def main():
+    """python migrate_timestamps.py <база> [таблица ...]"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    from config import TIMESTAMP_MIGRATION_BATCH
+
+    if len(sys.argv) < 2:
+        print("Использование: python migrate_timestamps.py <база> [таблица ...]")
+        sys.exit(1)
+    try:
+        migrate_database(sys.argv[1], sys.argv[2:], TIMESTAMP_MIGRATION_BATCH)
+    except KeyboardInterrupt:
+        logger.info("\n🛑 Миграция прервана, следующий запуск продолжит её")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# multi_receiver.py - Многопроцессный приёмник на общей подписке MQTT ($share)
+import multiprocessing
+import signal
+import time
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+import receiver
+import hot_logging
+from batch_writer import BatchWriter
+from central_backends import SQLiteBackend
+from receive_pipeline import ReceivePipeline
+from metrics import REGISTRY, MetricsServer
+from config import RECEIVER_PROCESSES, RECEIVER_SHARE_GROUP, RECEIVER_DATABASE
+from config import RECEIVER_SHARD_JOURNAL, IDEMPOTENT_INGEST, SQLITE_BUSY_TIMEOUT
+from config import WRITER_MAX_ROWS, WRITER_MAX_DELAY_MS
+from config import RECEIVE_WORKERS, RECEIVE_QUEUE_SIZE, RECEIVE_QUEUE_POLICY
+from config import RECEIVE_BLOCK_TIMEOUT, RECEIVE_STATS_INTERVAL
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_RECEIVER_PORT
+from config import METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL
+
+logger = receiver.logger
+
+# Пауза перед перезапуском упавшего процесса растет до этого значения, секунд
+MAX_RESTART_DELAY = 60
+# Процесс, проработавший дольше этого, считается стабильным, секунд
+STABLE_RUN_SECONDS = 60
+
+def shared_topic(group, topic):
+    """Топик общей подписки: брокер отдает каждое сообщение одному из участников"""
+    return f"$share/{group}/{topic}"
+
+# =============================================================================
+# ПРОЦЕСС-ПРИЁМНИК
+# =============================================================================
+
+def run_worker(index, group, database=RECEIVER_DATABASE):
+    """Один процесс группы: своя подписка, свой конвейер и свой журнал.
+
+    Все процессы пишут одну базу в WAL: транзакции разных процессов идут по
+    очереди (busy_timeout), а уникальный ключ (source, original_id) отсекает
+    повтор QoS 1, который брокер отдал другому процессу. Фильтр RecentIds у
+    каждого процесса свой и отсекает только повторы, пришедшие ему же.
+    """
+    topic = shared_topic(group, receiver.MQTT_TOPIC)
+    client = None
+
+    try:
+        # Обработчики receiver.py работают с этими глобальными объектами
+        receiver.setup_central_database(database, wal=True).close()
+        # Общий файл журнала несколько процессов перемешали бы, у каждого свой
+        receiver.journal = receiver.open_journal(RECEIVER_SHARD_JOURNAL.format(index=index))
+        receiver.tracer = receiver.open_tracer(f"receiver_{index}")
+        receiver.db_writer = BatchWriter(
+            SQLiteBackend(database, receiver.INSERT_SQL, wal=True, busy_timeout=SQLITE_BUSY_TIMEOUT),
+            None, WRITER_MAX_ROWS, WRITER_MAX_DELAY_MS,
+            on_commit=receiver.tracer.committed if receiver.tracer else None,
+            on_reject=receiver.recent_ids.forget if receiver.recent_ids else None
+        ).start()
+        receiver.pipeline = ReceivePipeline(
+            receiver.process_message, RECEIVE_WORKERS, RECEIVE_QUEUE_SIZE,
+            RECEIVE_QUEUE_POLICY, RECEIVE_BLOCK_TIMEOUT, RECEIVE_STATS_INTERVAL
+        ).start()
+        if METRICS_ENABLED:
+            # У каждого процесса свои метрики и свой порт
+            receiver.metrics_server = MetricsServer(
+                REGISTRY, METRICS_HOST, METRICS_RECEIVER_PORT + 1 + index,
+                METRICS_SNAPSHOT_FILE.format(name=f'receiver_{index}'), METRICS_SNAPSHOT_INTERVAL
+            ).start()
+
+        client_id = f"receiver_{group}_{index}_{datetime.now().strftime('%H%M%S')}"
+        client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv311)
+
+        def on_connect(client, userdata, flags, rc, properties=None):
+            if rc == 0:
+                client.subscribe(topic, qos=1)
+                logger.info(f"✅ Процесс #{index} подписан на '{topic}', база: {database}")
+            else:
+                logger.error(f"❌ Процесс #{index}: ошибка подключения. Код: {rc}")
+
+        client.on_connect = on_connect
+        client.on_message = receiver.on_message
+        client.on_disconnect = receiver.on_disconnect
+
+        # Супервизор останавливает процессы через SIGTERM
+        signal.signal(signal.SIGTERM, lambda signum, frame: client.disconnect())
+
+        client.connect(receiver.MQTT_BROKER, receiver.MQTT_PORT, 60)
+        client.loop_forever()
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if client:
+            client.disconnect()
+        if receiver.pipeline:
+            receiver.pipeline.stop()
+        if receiver.db_writer:
+            receiver.db_writer.close()
+        if receiver.journal:
+            receiver.journal.close()
+        if receiver.tracer:
+            receiver.tracer.close()
+        if receiver.metrics_server:
+            receiver.metrics_server.stop()
+        logger.info(f"🎯 Процесс #{index} завершил работу")
+        # Дочерний процесс завершается без atexit: дописываем очередь логов сами
+        hot_logging.stop_logging()
+
+# =============================================================================
+# СУПЕРВИЗОР
+# =============================================================================
+
+class Supervisor:
+    """Запускает процессы-приёмники и перезапускает упавшие"""
+
+    def __init__(self, processes=RECEIVER_PROCESSES, group=RECEIVER_SHARE_GROUP,
+                 database=RECEIVER_DATABASE):
+        self.processes = processes
+        self.group = group
+        self.database = database
+        self.workers = {}
+        self.started_at = {}
+        self.restarts = {}
+        self.next_start = {}
+
+    def start_worker(self, index):
+        process = multiprocessing.Process(
+            target=run_worker, args=(index, self.group, self.database), name=f"receiver-{index}"
+        )
+        process.start()
+        self.workers[index] = process
+        self.started_at[index] = time.monotonic()
+        logger.info(f"🚀 Запущен процесс #{index} (PID {process.pid})")
+
+    def check_workers(self):
+        """Перезапускает завершившиеся процессы с нарастающей паузой"""
+        now = time.monotonic()
+        for index, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+
+            if index not in self.next_start:
+                if now - self.started_at[index] > STABLE_RUN_SECONDS:
+                    self.restarts[index] = 0
+                delay = min(2 ** self.restarts.get(index, 0), MAX_RESTART_DELAY)
+                self.restarts[index] = self.restarts.get(index, 0) + 1
+                self.next_start[index] = now + delay
+                logger.warning(
+                    f"⚠️  Процесс #{index} завершился с кодом {process.exitcode}, "
+                    f"перезапуск через {delay} с"
+                )
+            elif now >= self.next_start[index]:
+                del self.next_start[index]
+                self.start_worker(index)
+
+    def stop(self):
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.workers.values():
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+
+    def prepare_database(self):
+        """Создает схему общей базы до запуска процессов.
+
+        Иначе процессы одновременно строили бы уникальный индекс и агрегаты.
+        """
+        receiver.setup_central_database(self.database, wal=True).close()
+        if not IDEMPOTENT_INGEST:
+            logger.warning(
+                "⚠️  IDEMPOTENT_INGEST выключен: повтор, доставленный другому процессу, "
+                "будет записан дважды"
+            )
+
+    def run(self):
+        self.prepare_database()
+        for index in range(self.processes):
+            self.start_worker(index)
+        try:
+            while True:
+                time.sleep(1)
+                self.check_workers()
+        finally:
+            self.stop()
+
+# =============================================================================
+# ГЛАВНАЯ ФУНКЦИЯ
+# =============================================================================
+
+def main():
+    logger.info(f"🚀 МНОГОПРОЦЕССНЫЙ ПРИЁМНИК: {RECEIVER_PROCESSES} процессов")
+    logger.info(f"📡 Группа общей подписки: {RECEIVER_SHARE_GROUP}")
+    logger.info("=" * 50)
+
+    supervisor = Supervisor()
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        logger.info("\n🛑 ПРИЁМНИКИ ОСТАНОВЛЕНЫ ПОЛЬЗОВАТЕЛЕМ")
+    finally:
+        logger.info("🎯 СУПЕРВИЗОР ЗАВЕРШИЛ РАБОТУ")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# mysql_pool.py - Пул соединений MySQL: проверка, переподключение, подготовленные запросы
+import logging
+import queue
+import threading
+import time
+
+try:
+    import mysql.connector
+    from mysql.connector import errors
+    MYSQL_AVAILABLE = True
+except ImportError:
+    MYSQL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Коды ошибок потерянного соединения: сервер недоступен, перезапускается,
+# закрыл соединение по таймауту, обрыв сети во время запроса
+LOST_CONNECTION_ERRORS = (1053, 2003, 2006, 2013, 2055, 4031)
+
+def is_connection_lost(error):
+    """Ошибку исправит переподключение, а не исправление запроса"""
+    return getattr(error, 'errno', None) in LOST_CONNECTION_ERRORS or (
+        MYSQL_AVAILABLE and isinstance(error, errors.InterfaceError)
+    )
+
+class CommitUncertain(Exception):
+    """Соединение потеряно во время COMMIT: неизвестно, зафиксирована ли транзакция"""
+
+
+# =============================================================================
+# СОЕДИНЕНИЕ ПУЛА
+# =============================================================================
+
+class MySQLSession:
+    """Соединение пула и подготовленные на нём запросы.
+
+    Для каждого текста запроса держится свой курсор prepared=True: сервер
+    разбирает запрос один раз, дальше передаются только параметры.
+    Подготовленные запросы живут в сессии сервера и после переподключения
+    готовятся заново.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._prepared = {}
+        self.connection = connect()
+        self.last_used = time.monotonic()
+        # Соединение в неизвестном состоянии: переподключить перед следующей выдачей
+        self.broken = False
+
+    def execute(self, sql, params=()):
+        """Выполняет подготовленный запрос; курсор нужно дочитать до следующего"""
+        cursor = self._prepared.get(sql)
+        if cursor is None:
+            cursor = self._prepared[sql] = self.connection.cursor(prepared=True)
+        cursor.execute(sql, params)
+        return cursor
+
+    def executemany(self, sql, seq_params):
+        for params in seq_params:
+            self.execute(sql, params)
+
+    def reconnect(self):
+        """Новое соединение вместо потерянного"""
+        self._prepared.clear()
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        self.connection = self._connect()
+        self.broken = False
+
+    def check(self, ping_interval):
+        """Проверяет соединение, простоявшее дольше ping_interval секунд"""
+        if self.broken:
+            self.reconnect()
+        elif time.monotonic() - self.last_used > ping_interval:
+            try:
+                self.connection.ping()
+            except errors.Error:
+                logger.info("🔌 Соединение MySQL из пула не отвечает, переподключаемся")
+                self.reconnect()
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+# =============================================================================
+# ПУЛ
+# =============================================================================
+
+class MySQLPool:
+    """Ограниченный пул соединений с прозрачным переподключением.
+
+    Соединения создаются по мере надобности, не больше size. Перед
+    выдачей давно не использованное соединение проверяется ping, потерянное
+    заменяется новым. run() повторяет работу на новом соединении, пока
+    сервер перезапускается (до reconnect_attempts раз через reconnect_delay
+    секунд), поэтому отправитель продолжает работу сразу после его запуска.
+    """
+
+    def __init__(self, config, size=4, ping_interval=30, reconnect_attempts=30,
+                 reconnect_delay=2.0, connect_timeout=10):
+        if not MYSQL_AVAILABLE:
+            raise RuntimeError("MySQL connector не установлен")
+        self.config = config
+        self.size = max(1, int(size))
+        self.ping_interval = ping_interval
+        self.reconnect_attempts = max(1, int(reconnect_attempts))
+        self.reconnect_delay = reconnect_delay
+        self.connect_timeout = connect_timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return mysql.connector.connect(
+            host=self.config['host'],
+            user=self.config['user'],
+            password=self.config['password'],
+            database=self.config['database'],
+            port=self.config.get('port', 3306),
+            connection_timeout=self.connect_timeout,
+            autocommit=False,
+        )
+
+    def acquire(self, timeout=None):
+        """Исправное соединение из пула; ждёт свободное, если созданы все size"""
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    return MySQLSession(self._connect)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                session = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                raise RuntimeError(f"Нет свободного соединения MySQL за {timeout} с (пул {self.size})")
+        try:
+            session.check(self.ping_interval)
+        except Exception:
+            self.release(session, broken=True)
+            raise
+        return session
+
+    def release(self, session, broken=False):
+        session.broken = session.broken or broken
+        session.last_used = time.monotonic()
+        self._idle.put(session)
+
+    def run(self, work, retry=True):
+        """Выполняет work(session) и фиксирует транзакцию.
+
+        При потере соединения работа повторяется на новом. retry=False -
+        для вставок: обрыв до COMMIT поднимается как есть (ничего не
+        записано, повтор безопасен), а обрыв во время COMMIT - как
+        CommitUncertain: строки могли быть записаны, и повтор их задвоит.
+        """
+        attempts = self.reconnect_attempts if retry else 1
+        for attempt in range(1, attempts + 1):
+            session = None
+            committing = False
+            try:
+                session = self.acquire(self.connect_timeout)
+                result = work(session)
+                committing = True
+                session.connection.commit()
+                return result
+            except errors.Error as e:
+                if session is not None:
+                    self._rollback(session)
+                if committing and not retry and is_connection_lost(e):
+                    session.broken = True
+                    raise CommitUncertain(str(e)) from e
+                if not is_connection_lost(e) or attempt == attempts:
+                    raise
+                if session is not None:
+                    session.broken = True
+                logger.warning(
+                    f"⚠️  Соединение с MySQL потеряно ({e}), повтор {attempt}/{attempts - 1} "
+                    f"через {self.reconnect_delay} с"
+                )
+                time.sleep(self.reconnect_delay)
+            finally:
+                if session is not None:
+                    self.release(session)
+
+    def stream(self, sql, params=(), fetch_rows=1000):
+        """Строки большого SELECT по мере чтения с сервера.
+
+        Небуферизованный курсор на отдельном соединении: в памяти не больше
+        fetch_rows строк, выборка не мешает запросам через run(). Если
+        чтение прервано, соединение переподключается перед следующей выдачей.
+        """
+        session = self.acquire(self.connect_timeout)
+        finished = False
+        try:
+            cursor = session.connection.cursor(buffered=False)
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(fetch_rows)
+                if not rows:
+                    break
+                yield from rows
+            cursor.close()
+            # Завершаем снимок REPEATABLE READ, иначе следующая выборка не увидит новых строк
+            session.connection.commit()
+            finished = True
+        finally:
+            self.release(session, broken=not finished)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    @staticmethod
+    def _rollback(session):
+        try:
+            session.connection.rollback()
+        except Exception:
+            session.broken = True
@@ -1,183 +1,289 @@
-import sys
-import os
-import json
-from datetime import datetime
-import logging
-import paho.mqtt.client as mqtt
-
-sys.path.append('C:\\Users\\Student\\AppData\\Roaming\\Python\\Python313\\site-packages')
-
-try:
-    import mysql.connector
-    MYSQL_AVAILABLE = True
-except ImportError:
-    MYSQL_AVAILABLE = False
-
-import sqlite3
-
-try:
-    from config import MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
-except ImportError:
-    print("❌ Файл config.py не найден! Создайте его сначала.")
-    sys.exit(1)
-
-# =============================================================================
-# НАСТРОЙКА ЛОГИРОВАНИЯ
-# =============================================================================
-def setup_logging():
-    os.makedirs('logs', exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('logs/universal_receiver.log', encoding='utf-8'),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    return logging.getLogger(__name__)
-
-logger = setup_logging()
-
-# =============================================================================
-# УНИВЕРСАЛЬНОЕ ХРАНИЛИЩЕ ДАННЫХ
-# =============================================================================
-
-class CentralStorage:
-    def __init__(self):
-        self.connection = None
-        self.cursor = None
-        
-    def connect(self):
-        """Подключается к центральному хранилищу (SQLite)"""
-        try:
-            self.connection = sqlite3.connect('central_universal.db', check_same_thread=False)
-            self.cursor = self.connection.cursor()
-            
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS received_data (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    original_id INTEGER,
-                    sensor_id INTEGER NOT NULL,
-                    value REAL NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    received_at TEXT NOT NULL,
-                    source_db TEXT,
-                    db_type TEXT,
-                    version TEXT
-                )
-            ''')
-            self.connection.commit()
-            logger.info("✅ Центральное хранилище готово")
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка центрального хранилища: {e}")
-            return False
-    
-    def save_data(self, payload):
-        """Сохраняет полученные данные"""
-        try:
-            self.cursor.execute('''
-                INSERT INTO received_data 
-                (original_id, sensor_id, value, timestamp, received_at, source_db, db_type, version) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                payload.get('id'),
-                payload.get('sensor_id'),
-                payload.get('value'),
-                payload.get('timestamp'),
-                datetime.now().isoformat(),
-                payload.get('source'),
-                payload.get('database_type'),
-                payload.get('version')
-            ))
-            self.connection.commit()
-            
-            logger.info(f"💾 Сохранено в центральное хранилище: ID {payload.get('id')}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения: {e}")
-            return False
-    
-    def close(self):
-        if self.connection:
-            self.connection.close()
-
-# =============================================================================
-# MQTT КЛИЕНТ
-# =============================================================================
-
-def on_connect(client, userdata, flags, rc, properties):
-    if rc == 0:
-        logger.info("✅ УНИВЕРСАЛЬНЫЙ ПРИЁМНИК ПОДКЛЮЧЕН!")
-        client.subscribe(MQTT_TOPIC)
-        logger.info(f"📡 Подписка на топик: '{MQTT_TOPIC}'")
-    else:
-        logger.error(f"❌ Ошибка подключения. Код: {rc}")
-
-def on_message(client, userdata, msg):
-    try:
-        payload = json.loads(msg.payload.decode())
-        
-        logger.info(f"\n📨 ПОЛУЧЕНО СООБЩЕНИЕ ИЗ {payload.get('database_type', 'unknown').upper()}")
-        logger.info(f"├─ Источник: {payload.get('source')}")
-        logger.info(f"├─ ID записи: {payload.get('id')}")
-        logger.info(f"├─ Датчик: {payload.get('sensor_id')}")
-        logger.info(f"├─ Значение: {payload.get('value')}°C")
-        logger.info(f"└─ Версия: {payload.get('version')}")
-
-        # Сохраняем в центральное хранилище
-        storage.save_data(payload)
-        
-        # Дублируем в лог
-        with open("received_universal.log", "a", encoding="utf-8") as f:
-            log_entry = {
-                "received_at": datetime.now().isoformat(),
-                "data": payload
-            }
-            f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
-            
-        logger.info("✅ Данные успешно обработаны")
-
-    except Exception as e:
-        logger.error(f"💥 Ошибка обработки: {e}")
-
-# =============================================================================
-# ГЛАВНАЯ ФУНКЦИЯ
-# =============================================================================
-
-def main():
-    global storage
-    logger.info("🚀 УНИВЕРСАЛЬНЫЙ ПРИЁМНИК ЗАПУЩЕН")
-    logger.info("=" * 50)
-    
-    client = None
-    storage = CentralStorage()
-    
-    try:
-        if not storage.connect():
-            return
-        
-        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "universal_receiver")
-        client.on_connect = on_connect
-        client.on_message = on_message
-
-        logger.info(f"🔗 Подключение к {MQTT_BROKER}...")
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-
-        logger.info("🎧 Ожидание данных из различных СУБД...")
-        client.loop_forever()
-        
-    except KeyboardInterrupt:
-        logger.info("\n🛑 ПРИЁМНИК ОСТАНОВЛЕН")
-    except Exception as e:
-        logger.error(f"💥 Критическая ошибка: {e}")
-    finally:
-        if client:
-            client.disconnect()
-        storage.close()
-        logger.info("🎯 ПРИЁМНИК ЗАВЕРШИЛ РАБОТУ")
-
-if __name__ == "__main__":
+import sys
+import time
+from datetime import datetime
+import logging
+import paho.mqtt.client as mqtt
+
+sys.path.append('C:\\Users\\Student\\AppData\\Roaming\\Python\\Python313\\site-packages')
+
+from message_format import unpack_message, is_delete
+from codec import decode_message
+from batch_writer import BatchWriter
+from central_backends import create_backend
+from receive_pipeline import ReceivePipeline
+from journal import JournalWriter
+from dedup import RecentIds, dedup_key
+from central_query import CentralQuery
+from export_columnar import start_exporter, stop_exporter
+from timestamps import to_storage
+import hot_logging
+from hot_logging import MessageDetail, fields
+from metrics import REGISTRY, MetricsServer
+from tracing import TraceStats
+
+try:
+    from config import MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
+    from config import WRITER_MAX_ROWS, WRITER_MAX_DELAY_MS
+    from config import CENTRAL_BACKEND, CENTRAL_SQLITE_DATABASE, CENTRAL_SQLITE_WAL
+    from config import CENTRAL_MYSQL_CONFIG, CENTRAL_COLUMNAR_FILE, SQLITE_BUSY_TIMEOUT
+    from config import INGEST_MYSQL_ROWS_PER_STATEMENT, MYSQL_RECONNECT_ATTEMPTS, MYSQL_RECONNECT_DELAY
+    from config import EXPORT_ENABLED, EXPORT_DIRECTORY, EXPORT_BATCH_ROWS, EXPORT_INTERVAL, EXPORT_NICE
+    from config import RECEIVE_WORKERS, RECEIVE_QUEUE_SIZE, RECEIVE_QUEUE_POLICY
+    from config import RECEIVE_BLOCK_TIMEOUT, RECEIVE_STATS_INTERVAL
+    from config import IDEMPOTENT_INGEST, DEDUP_CACHE_SIZE, ROLLUPS_ENABLED
+    from config import QUERY_CACHE_SIZE, QUERY_CACHE_MAX_ROWS, TIMESTAMP_STORAGE
+    from config import JOURNAL_SEGMENT_MAX_MB, JOURNAL_SEGMENT_MAX_SECONDS, JOURNAL_FSYNC
+    from config import JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPRESS, JOURNAL_BUFFER_KB
+    from config import LOG_QUEUED, LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY
+    from config import LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+    from config import METRICS_ENABLED, METRICS_HOST, METRICS_RECEIVER_PORT
+    from config import METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL
+    from config import TRACE_ENABLED, TRACE_WINDOW, TRACE_REPORT_INTERVAL, TRACE_SNAPSHOT_FILE
+except ImportError:
+    print("❌ Файл config.py не найден! Создайте его сначала.")
+    sys.exit(1)
+
+# =============================================================================
+# НАСТРОЙКА ЛОГИРОВАНИЯ
+# =============================================================================
+def setup_logging():
+    hot_logging.setup_logging('logs/universal_receiver.log', LOG_QUEUED)
+    return logging.getLogger(__name__)
+
+logger = setup_logging()
+# Подробности отдельных записей - выборочно, режим меняется на лету
+detail = MessageDetail(
+    LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY, LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+)
+
+# =============================================================================
+# УНИВЕРСАЛЬНОЕ ХРАНИЛИЩЕ ДАННЫХ
+# =============================================================================
+
+class CentralStorage:
+    """Приём в центральное хранилище: фильтр повторов, пакетная запись, журнал.
+
+    Само хранилище (SQLite, MySQL или колоночный файл) выбирается
+    CENTRAL_BACKEND и скрыто за write_batch/flush/close (central_backends.py).
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.writer = None
+        self.journal = None
+        self.tracer = None
+        self.ts_mode = TIMESTAMP_STORAGE
+        # Недавно принятые записи, повторы отбрасываются до записи в базу
+        self.recent_ids = RecentIds(DEDUP_CACHE_SIZE) if IDEMPOTENT_INGEST else None
+        # Открытые query(): писатель сообщает им датчики зафиксированных строк
+        self.queries = []
+        
+    def connect(self):
+        """Подключается к центральному хранилищу (CENTRAL_BACKEND)"""
+        try:
+            self.backend = create_backend(
+                CENTRAL_BACKEND, CENTRAL_SQLITE_DATABASE, CENTRAL_MYSQL_CONFIG, CENTRAL_COLUMNAR_FILE,
+                CENTRAL_SQLITE_WAL, SQLITE_BUSY_TIMEOUT, INGEST_MYSQL_ROWS_PER_STATEMENT,
+                MYSQL_RECONNECT_ATTEMPTS, MYSQL_RECONNECT_DELAY
+            ).prepare(IDEMPOTENT_INGEST, ROLLUPS_ENABLED, TIMESTAMP_STORAGE)
+            self.ts_mode = self.backend.ts_mode
+
+            if TRACE_ENABLED:
+                self.tracer = TraceStats(
+                    'universal_receiver', TRACE_WINDOW, TRACE_REPORT_INTERVAL,
+                    TRACE_SNAPSHOT_FILE.format(name='universal_receiver')
+                ).run_reports()
+            # Строки пишутся пакетами в фоновом потоке
+            self.writer = BatchWriter(
+                self.backend, None, WRITER_MAX_ROWS, WRITER_MAX_DELAY_MS,
+                on_commit=self.tracer.committed if self.tracer else None,
+                on_reject=self.recent_ids.forget if self.recent_ids else None,
+                on_written=self._rows_written
+            ).start()
+            self.journal = JournalWriter(
+                'received_universal.log', JOURNAL_SEGMENT_MAX_MB * 1024 * 1024, JOURNAL_SEGMENT_MAX_SECONDS,
+                JOURNAL_FSYNC, JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPRESS, JOURNAL_BUFFER_KB * 1024
+            )
+            logger.info("✅ Центральное хранилище готово")
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка центрального хранилища: {e}")
+            return False
+    
+    def is_duplicate(self, payload):
+        """Повтор уже принятой записи (QoS 1 после переподключения)"""
+        return self.recent_ids is not None and self.recent_ids.seen(dedup_key(payload))
+
+    def save_data(self, payload, trace=None):
+        """Ставит полученные данные в очередь пакетной записи"""
+        try:
+            self.writer.put((
+                payload.get('id'),
+                payload.get('sensor_id'),
+                payload.get('value'),
+                to_storage(payload.get('timestamp'), self.ts_mode),
+                to_storage(datetime.now(), self.ts_mode),
+                payload.get('source'),
+                payload.get('database_type'),
+                payload.get('version')
+            ), trace, dedup_key(payload) if self.recent_ids else None)
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения: {e}")
+            return False
+    
+    def log_records(self, records):
+        """Дублирует записи сообщения в журнал received_universal.log"""
+        received_at = datetime.now().isoformat()
+        self.journal.append([{"received_at": received_at, "data": record} for record in records])
+
+    def query(self):
+        """Интерфейс чтения хранилища с кэшем результатов (central_query.py).
+
+        Кэш сбрасывается по датчикам строк, которые зафиксировал писатель
+        этого процесса; запись в базу из других процессов он не увидит.
+        """
+        if CENTRAL_BACKEND != 'sqlite':
+            raise RuntimeError(f"central_query.py читает только SQLite хранилище, выбрано '{CENTRAL_BACKEND}'")
+        query = CentralQuery(CENTRAL_SQLITE_DATABASE, QUERY_CACHE_SIZE, QUERY_CACHE_MAX_ROWS, notified=True)
+        self.queries.append(query)
+        return query
+
+    def _rows_written(self, rows):
+        """Сбрасывает кэш открытых query() по датчикам записанных строк (поле 1 строки)"""
+        if self.queries:
+            sensor_ids = {row[1] for row in rows}
+            for query in self.queries:
+                query.changed(sensor_ids)
+
+    def close(self):
+        # Писатель дописывает очередь и закрывает хранилище в своём потоке
+        if self.writer:
+            self.writer.close()
+        elif self.backend:
+            self.backend.close()
+        if self.journal:
+            self.journal.close()
+        if self.tracer:
+            self.tracer.close()
+        if self.recent_ids:
+            logger.info(f"♻️  Отброшено повторов: {self.recent_ids.duplicates}")
+
+# =============================================================================
+# MQTT КЛИЕНТ
+# =============================================================================
+
+def on_connect(client, userdata, flags, rc, properties):
+    if rc == 0:
+        logger.info("✅ УНИВЕРСАЛЬНЫЙ ПРИЁМНИК ПОДКЛЮЧЕН!")
+        client.subscribe(MQTT_TOPIC)
+        logger.info(f"📡 Подписка на топик: '{MQTT_TOPIC}'")
+    else:
+        logger.error(f"❌ Ошибка подключения. Код: {rc}")
+
+def on_message(client, userdata, msg):
+    """Только ставит сообщение в очередь, разбор и запись - в рабочих потоках"""
+    pipeline.submit(msg.topic, msg.payload)
+
+def process_message(topic, raw_payload):
+    try:
+        received_at = time.time()
+        payload = decode_message(raw_payload)
+        records = unpack_message(payload)
+        accepted = []
+
+        for record in records:
+            if storage.is_duplicate(record):
+                continue
+            accepted.append(record)
+
+            if detail.enabled():
+                logger.info(
+                    f"├─ {record.get('database_type', 'unknown').upper()} {record.get('source')} "
+                    f"ID {record.get('id')}: датчик {record.get('sensor_id')} = {record.get('value')}°C, "
+                    f"версия {record.get('version')}"
+                )
+
+        # Удаления на отправителе в центральном хранилище не применяются
+        inserts = [record for record in accepted if not is_delete(record)]
+        # Трассировка идет с последней строкой: её фиксация завершает сообщение
+        tracer = storage.tracer
+        trace = tracer.start(records, received_at) if tracer and inserts else None
+        for i, record in enumerate(inserts):
+            storage.save_data(record, trace if i == len(inserts) - 1 else None)
+            
+        # Дублируем в лог одной записью на сообщение
+        storage.log_records(accepted)
+        # Одна строка на сообщение-пакет
+        logger.info("📨 " + fields(
+            topic=topic, source=records[0].get('source', 'unknown') if records else None,
+            records=len(records), new=len(accepted)
+        ))
+
+    except Exception as e:
+        logger.error(f"💥 Ошибка обработки: {e}")
+
+# =============================================================================
+# ГЛАВНАЯ ФУНКЦИЯ
+# =============================================================================
+
+def main():
+    global storage, pipeline
+    logger.info("🚀 УНИВЕРСАЛЬНЫЙ ПРИЁМНИК ЗАПУЩЕН")
+    logger.info("=" * 50)
+    
+    client = None
+    pipeline = None
+    metrics_server = None
+    exporter = None
+    storage = CentralStorage()
+    
+    try:
+        if not storage.connect():
+            return
+
+        pipeline = ReceivePipeline(
+            process_message, RECEIVE_WORKERS, RECEIVE_QUEUE_SIZE,
+            RECEIVE_QUEUE_POLICY, RECEIVE_BLOCK_TIMEOUT, RECEIVE_STATS_INTERVAL
+        ).start()
+        if METRICS_ENABLED:
+            metrics_server = MetricsServer(
+                REGISTRY, METRICS_HOST, METRICS_RECEIVER_PORT,
+                METRICS_SNAPSHOT_FILE.format(name='universal_receiver'), METRICS_SNAPSHOT_INTERVAL
+            ).start()
+        # Выгрузка для аналитики - отдельный процесс с пониженным приоритетом
+        if EXPORT_ENABLED and CENTRAL_BACKEND == 'sqlite':
+            exporter = start_exporter(
+                CENTRAL_SQLITE_DATABASE, EXPORT_DIRECTORY, EXPORT_BATCH_ROWS, EXPORT_INTERVAL, EXPORT_NICE
+            )
+        
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "universal_receiver")
+        client.on_connect = on_connect
+        client.on_message = on_message
+
+        logger.info(f"🔗 Подключение к {MQTT_BROKER}...")
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+
+        logger.info("🎧 Ожидание данных из различных СУБД...")
+        client.loop_forever()
+        
+    except KeyboardInterrupt:
+        logger.info("\n🛑 ПРИЁМНИК ОСТАНОВЛЕН")
+    except Exception as e:
+        logger.error(f"💥 Критическая ошибка: {e}")
+    finally:
+        if client:
+            client.disconnect()
+        if pipeline:
+            pipeline.stop()
+        storage.close()
+        if exporter:
+            stop_exporter(*exporter)
+        if metrics_server:
+            metrics_server.stop()
+        logger.info("🎯 ПРИЁМНИК ЗАВЕРШИЛ РАБОТУ")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
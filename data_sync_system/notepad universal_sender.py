@@ -1,313 +1,814 @@
-import sys
-import os
-import time
-import json
-from datetime import datetime
-import logging
-import paho.mqtt.client as mqtt
-
-# Добавляем путь к библиотекам
-sys.path.append('C:\\Users\\Student\\AppData\\Roaming\\Python\\Python313\\site-packages')
-
-try:
-    import mysql.connector
-    MYSQL_AVAILABLE = True
-except ImportError:
-    MYSQL_AVAILABLE = False
-    print("❌ MySQL connector не установлен. Используйте: pip install mysql-connector-python")
-
-import sqlite3
-
-# Импортируем конфигурацию
-try:
-    from config import DATABASE_CONFIG, ACTIVE_DATABASE, MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
-except ImportError:
-    print("❌ Файл config.py не найден! Создайте его сначала.")
-    sys.exit(1)
-
-# =============================================================================
-# НАСТРОЙКА ЛОГИРОВАНИЯ
-# =============================================================================
-def setup_logging():
-    os.makedirs('logs', exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('logs/universal_sender.log', encoding='utf-8'),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    return logging.getLogger(__name__)
-
-logger = setup_logging()
-
-# =============================================================================
-# 1. УНИВЕРСАЛЬНОЕ ПОДКЛЮЧЕНИЕ К БАЗЕ ДАННЫХ
-# =============================================================================
-
-class DatabaseManager:
-    def __init__(self, config):
-        self.config = config
-        self.connection = None
-        self.cursor = None
-        
-    def connect(self):
-        """Устанавливает соединение с выбранной СУБД"""
-        try:
-            if self.config['type'] == 'sqlite':
-                self.connection = sqlite3.connect(
-                    self.config['database'], 
-                    check_same_thread=False
-                )
-                self.cursor = self.connection.cursor()
-                logger.info(f"✅ Подключено к SQLite: {self.config['database']}")
-                
-            elif self.config['type'] == 'mysql' and MYSQL_AVAILABLE:
-                self.connection = mysql.connector.connect(
-                    host=self.config['host'],
-                    user=self.config['user'],
-                    password=self.config['password'],
-                    database=self.config['database'],
-                    port=self.config.get('port', 3306)
-                )
-                self.cursor = self.connection.cursor()
-                logger.info(f"✅ Подключено к MySQL: {self.config['database']}")
-                
-            else:
-                if self.config['type'] == 'mysql' and not MYSQL_AVAILABLE:
-                    raise Exception("MySQL connector не установлен")
-                else:
-                    raise Exception("Тип базы данных не поддерживается")
-                
-            self._create_tables()
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка подключения к базе данных: {e}")
-            return False
-    
-    def _create_tables(self):
-        """Создает необходимые таблицы"""
-        if self.config['type'] == 'sqlite':
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sensor_data (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sensor_id INTEGER NOT NULL,
-                    value REAL NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    sent INTEGER DEFAULT 0,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        elif self.config['type'] == 'mysql':
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sensor_data (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    sensor_id INT NOT NULL,
-                    value FLOAT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    sent INT DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        
-        self.connection.commit()
-        logger.info("✅ Таблицы созданы/проверены")
-    
-    def insert_test_data(self):
-        """Добавляет тестовые данные"""
-        test_data = [
-            (1, 23.5, datetime.now().isoformat(), 0),
-            (2, 18.9, datetime.now().isoformat(), 0),
-            (1, 24.1, datetime.now().isoformat(), 0),
-            (3, 19.7, datetime.now().isoformat(), 0),
-            (2, 22.3, datetime.now().isoformat(), 0),
-        ]
-        
-        if self.config['type'] == 'sqlite':
-            self.cursor.executemany(
-                "INSERT OR IGNORE INTO sensor_data (sensor_id, value, timestamp, sent) VALUES (?, ?, ?, ?)", 
-                test_data
-            )
-        else:
-            self.cursor.executemany(
-                "INSERT IGNORE INTO sensor_data (sensor_id, value, timestamp, sent) VALUES (%s, %s, %s, %s)", 
-                test_data
-            )
-        
-        self.connection.commit()
-        logger.info("✅ Тестовые данные добавлены")
-    
-    def get_unsent_data(self):
-        """Получает неотправленные данные"""
-        query = "SELECT id, sensor_id, value, timestamp FROM sensor_data WHERE sent = 0 ORDER BY id"
-        self.cursor.execute(query)
-        return self.cursor.fetchall()
-    
-    def mark_as_sent(self, record_id):
-        """Помечает запись как отправленную"""
-        if self.config['type'] == 'sqlite':
-            self.cursor.execute("UPDATE sensor_data SET sent = 1 WHERE id = ?", (record_id,))
-        else:
-            self.cursor.execute("UPDATE sensor_data SET sent = 1 WHERE id = %s", (record_id,))
-        self.connection.commit()
-    
-    def close(self):
-        """Закрывает соединение"""
-        if self.connection:
-            self.connection.close()
-
-# =============================================================================
-# 2. MQTT КЛИЕНТ
-# =============================================================================
-
-def setup_mqtt_client():
-    client_id = f"universal_sender_{datetime.now().strftime('%H%M%S')}"
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
-    
-    delivery_status = {}
-
-    def on_connect(client, userdata, flags, rc, properties):
-        if rc == 0:
-            logger.info("✅ Успешно подключились к MQTT брокеру!")
-        else:
-            logger.error(f"❌ Ошибка подключения к брокеру. Код: {rc}")
-
-    def on_publish(client, userdata, mid, reason_code, properties):
-        delivery_status[mid] = True
-        logger.debug(f"📨 Подтверждение доставки для сообщения ID {mid}")
-
-    client.on_connect = on_connect
-    client.on_publish = on_publish
-
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        client.loop_start()
-        time.sleep(2)
-        return client, delivery_status
-    except Exception as e:
-        logger.error(f"❌ Не удалось подключиться к MQTT брокеру: {e}")
-        raise
-
-# =============================================================================
-# 3. ФУНКЦИЯ СИНХРОНИЗАЦИИ
-# =============================================================================
-
-def sync_data(db_manager, client, delivery_status):
-    try:
-        new_records = db_manager.get_unsent_data()
-
-        if not new_records:
-            logger.info("💤 Новых данных для отправки нет")
-            return True
-
-        logger.info(f"📦 Найдено {len(new_records)} новых записей")
-
-        success_count = 0
-        for record in new_records:
-            record_id, sensor_id, value, timestamp = record
-
-            payload = {
-                "id": record_id,
-                "sensor_id": sensor_id,
-                "value": value,
-                "timestamp": timestamp,
-                "source": ACTIVE_DATABASE,
-                "database_type": DATABASE_CONFIG[ACTIVE_DATABASE]['type'],
-                "version": "3.0"
-            }
-            json_payload = json.dumps(payload, ensure_ascii=False)
-
-            logger.info(f"🚀 Отправляем запись ID {record_id} из {DATABASE_CONFIG[ACTIVE_DATABASE]['type'].upper()}")
-
-            msg_info = client.publish(MQTT_TOPIC, json_payload, qos=1)
-            
-            if msg_info.rc != mqtt.MQTT_ERR_SUCCESS:
-                logger.error(f"❌ Ошибка публикации записи ID {record_id}")
-                continue
-                
-            message_mid = msg_info.mid
-            delivery_status[message_mid] = False
-
-            # Ждем подтверждения
-            wait_time = 0
-            while not delivery_status.get(message_mid, False) and wait_time < 10:
-                time.sleep(0.5)
-                wait_time += 0.5
-
-            if delivery_status.get(message_mid, False):
-                db_manager.mark_as_sent(record_id)
-                success_count += 1
-                logger.info(f"✅ Запись ID {record_id} доставлена и помечена")
-                delivery_status.pop(message_mid, None)
-            else:
-                logger.warning(f"⚠️  Таймаут доставки записи ID {record_id}")
-                return False
-
-        logger.info(f"🎉 Успешно отправлено {success_count} из {len(new_records)} записей")
-        return True
-
-    except Exception as e:
-        logger.error(f"💥 Ошибка синхронизации: {e}")
-        return False
-
-# =============================================================================
-# 4. ГЛАВНАЯ ФУНКЦИЯ
-# =============================================================================
-
-def main():
-    logger.info(f"🚀 УНИВЕРСАЛЬНАЯ СИСТЕМА ПЕРЕДАЧИ ДАННЫХ")
-    logger.info(f"📊 Активная СУБД: {ACTIVE_DATABASE.upper()}")
-    logger.info("=" * 50)
-    
-    db_manager = None
-    client = None
-    
-    try:
-        # Инициализация базы данных
-        db_manager = DatabaseManager(DATABASE_CONFIG[ACTIVE_DATABASE])
-        if not db_manager.connect():
-            return
-        
-        # Добавляем тестовые данные
-        db_manager.insert_test_data()
-        
-        # MQTT клиент
-        client, delivery_status = setup_mqtt_client()
-        
-        # Основной цикл
-        cycle_count = 0
-        logger.info("\n🔄 Служба синхронизации запущена")
-        
-        while True:
-            cycle_count += 1
-            logger.info(f"\n{'='*30}")
-            logger.info(f"ЦИКЛ СИНХРОНИЗАЦИИ #{cycle_count}")
-            logger.info(f"{'='*30}")
-            
-            sync_success = sync_data(db_manager, client, delivery_status)
-            
-            if sync_success:
-                logger.info("✅ Цикл завершен успешно")
-            else:
-                logger.warning("⚠️  В цикле возникли проблемы")
-            
-            logger.info("⏳ Ожидание 30 секунд...")
-            time.sleep(30)
-            
-    except KeyboardInterrupt:
-        logger.info("\n🛑 ОСТАНОВКА СИСТЕМЫ")
-    except Exception as e:
-        logger.error(f"💥 Критическая ошибка: {e}")
-    finally:
-        logger.info("\n🔚 Завершение работы...")
-        if client:
-            client.loop_stop()
-            client.disconnect()
-        if db_manager:
-            db_manager.close()
-        logger.info("🎯 СИСТЕМА ОСТАНОВЛЕНА")
-
-if __name__ == "__main__":
+import sys
+import time
+from datetime import datetime
+import logging
+import paho.mqtt.client as mqtt
+
+# Добавляем путь к библиотекам
+sys.path.append('C:\\Users\\Student\\AppData\\Roaming\\Python\\Python313\\site-packages')
+
+try:
+    import mysql.connector
+    MYSQL_AVAILABLE = True
+except ImportError:
+    MYSQL_AVAILABLE = False
+    print("❌ MySQL connector не установлен. Используйте: pip install mysql-connector-python")
+
+import sqlite3
+
+from publisher import PipelinedPublisher, DeliveryTimeout
+from message_format import BatchAccumulator
+from codec import encode_message
+from ack_tracker import AckWatermark, TRACKING_WATERMARK, id_ranges
+from sync_trigger import SyncTrigger
+from timestamps import column_type, storage_mode, to_storage, to_iso
+from retention import Retention, enable_incremental_vacuum
+import hot_logging
+from hot_logging import MessageDetail, fields
+from metrics import REGISTRY, MetricsServer
+from tracing import trace_header
+from ingest import ReadingBuffer, enable_wal, reading
+from mysql_pool import MySQLPool, is_connection_lost
+
+# Импортируем конфигурацию
+try:
+    from config import DATABASE_CONFIG, ACTIVE_DATABASE, MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
+    from config import MYSQL_POOL_SIZE, MYSQL_PING_INTERVAL, MYSQL_RECONNECT_ATTEMPTS, MYSQL_RECONNECT_DELAY
+    from config import PUBLISH_WINDOW, PUBLISH_ACK_TIMEOUT, BATCH_MAX_RECORDS, BATCH_MAX_DELAY_MS
+    from config import UNSENT_PAGE_SIZE, DELIVERY_TRACKING, SYNC_SOURCE
+    from config import SYNC_MIN_INTERVAL, SYNC_MAX_INTERVAL, SYNC_WATCH_INTERVAL, SYNC_NOTIFY_PORT
+    from config import TIMESTAMP_STORAGE
+    from config import RETENTION_ENABLED, RETENTION_MAX_AGE_HOURS, RETENTION_MAX_DELIVERED_ROWS
+    from config import RETENTION_BATCH_ROWS, RETENTION_VACUUM_PAGES, RETENTION_INTERVAL
+    from config import INGEST_MAX_ROWS, INGEST_MAX_DELAY_MS, INGEST_MAX_QUEUE
+    from config import INGEST_MYSQL_ROWS_PER_STATEMENT, SQLITE_WAL, SQLITE_BUSY_TIMEOUT
+    from config import LOG_QUEUED, LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY
+    from config import LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+    from config import METRICS_ENABLED, METRICS_HOST, METRICS_SENDER_PORT
+    from config import METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL
+    from config import TRACE_ENABLED
+except ImportError:
+    print("❌ Файл config.py не найден! Создайте его сначала.")
+    sys.exit(1)
+
+# =============================================================================
+# НАСТРОЙКА ЛОГИРОВАНИЯ
+# =============================================================================
+def setup_logging():
+    hot_logging.setup_logging('logs/universal_sender.log', LOG_QUEUED)
+    return logging.getLogger(__name__)
+
+logger = setup_logging()
+# Подробности отдельных записей - выборочно, режим меняется на лету
+detail = MessageDetail(
+    LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY, LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+)
+
+# =============================================================================
+# 1. УНИВЕРСАЛЬНОЕ ПОДКЛЮЧЕНИЕ К БАЗЕ ДАННЫХ
+# =============================================================================
+
+# Триггеры, которые пишут изменения sensor_data в sensor_outbox
+OUTBOX_TRIGGERS = (
+    'trg_sensor_data_outbox_insert',
+    'trg_sensor_data_outbox_update',
+    'trg_sensor_data_outbox_delete',
+)
+
+# Запросы DatabaseManager; {p} - параметр в синтаксисе СУБД. Тексты постоянные:
+# SQLite берет разобранный запрос из кэша соединения, MySQL выполняет их
+# подготовленными (mysql_pool.MySQLSession). *_page - страница для SQLite,
+# без суффикса - потоковая выборка MySQL
+_UNSENT = "SELECT id, sensor_id, value, timestamp FROM sensor_data WHERE sent = 0 AND id > {p} ORDER BY id"
+_AFTER = "SELECT id, sensor_id, value, timestamp FROM sensor_data WHERE id > {p} ORDER BY id"
+_OUTBOX = "SELECT seq, op, row_id, sensor_id, value, timestamp FROM sensor_outbox WHERE seq > {p} ORDER BY seq"
+STATEMENTS = {
+    'count_unsent': "SELECT COUNT(*) FROM sensor_data WHERE sent = 0",
+    'count_after': "SELECT COUNT(*) FROM sensor_data WHERE id > {p}",
+    'unsent': _UNSENT,
+    'unsent_page': _UNSENT + " LIMIT {p}",
+    'after': _AFTER,
+    'after_page': _AFTER + " LIMIT {p}",
+    'mark_sent': "UPDATE sensor_data SET sent = 1 WHERE id = {p}",
+    'mark_sent_range': "UPDATE sensor_data SET sent = 1 WHERE id BETWEEN {p} AND {p}",
+    'get_watermark': "SELECT acked_id FROM sync_checkpoint WHERE destination = {p}",
+    'save_watermark': "REPLACE INTO sync_checkpoint (destination, acked_id, updated_at) VALUES ({p}, {p}, {p})",
+    'insert_reading': "INSERT INTO sensor_data (sensor_id, value, timestamp) VALUES ({p}, {p}, {p})",
+    'count_outbox': "SELECT COUNT(*) FROM sensor_outbox",
+    'outbox': _OUTBOX,
+    'outbox_page': _OUTBOX + " LIMIT {p}",
+    'truncate_outbox': "DELETE FROM sensor_outbox WHERE seq <= {p}",
+}
+PLACEHOLDERS = {'sqlite': '?', 'mysql': '%s'}
+
+def dialect_statements(db_type):
+    """Запросы STATEMENTS с параметрами в синтаксисе СУБД"""
+    return {name: sql.format(p=PLACEHOLDERS[db_type]) for name, sql in STATEMENTS.items()}
+
+class DatabaseManager:
+    def __init__(self, config, capture_changes=False):
+        self.config = config
+        self.capture_changes = capture_changes
+        self.connection = None
+        self.cursor = None
+        # MySQL: пул соединений; SQLite работает через одно соединение
+        self.pool = None
+        self.sql = dialect_statements(config['type']) if config['type'] in PLACEHOLDERS else {}
+        # Режим хранения времени в sensor_data (TIMESTAMP_STORAGE или по схеме SQLite)
+        self.ts_mode = TIMESTAMP_STORAGE
+        
+    def connect(self):
+        """Устанавливает соединение с выбранной СУБД"""
+        try:
+            if self.config['type'] == 'sqlite':
+                self.connection = sqlite3.connect(
+                    self.config['database'], 
+                    check_same_thread=False,
+                    timeout=SQLITE_BUSY_TIMEOUT
+                )
+                self.cursor = self.connection.cursor()
+                enable_incremental_vacuum(self.connection, self.config['database'])
+                if SQLITE_WAL:
+                    enable_wal(self.connection, SQLITE_BUSY_TIMEOUT)
+                logger.info(f"✅ Подключено к SQLite: {self.config['database']}")
+                
+                self._create_tables()
+                
+            elif self.config['type'] == 'mysql' and MYSQL_AVAILABLE:
+                self.pool = MySQLPool(
+                    self.config, MYSQL_POOL_SIZE, MYSQL_PING_INTERVAL,
+                    MYSQL_RECONNECT_ATTEMPTS, MYSQL_RECONNECT_DELAY
+                )
+                # Схема создается на соединении из пула, дальше каждая операция берет своё
+                session = self.pool.acquire()
+                try:
+                    self.connection = session.connection
+                    self.cursor = self.connection.cursor(buffered=True)
+                    self._create_tables()
+                finally:
+                    self.cursor.close()
+                    self.connection = self.cursor = None
+                    self.pool.release(session)
+                logger.info(f"✅ Подключено к MySQL: {self.config['database']} (пул {MYSQL_POOL_SIZE})")
+                
+            else:
+                if self.config['type'] == 'mysql' and not MYSQL_AVAILABLE:
+                    raise Exception("MySQL connector не установлен")
+                else:
+                    raise Exception("Тип базы данных не поддерживается")
+                
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка подключения к базе данных: {e}")
+            return False
+    
+    def _create_tables(self):
+        """Создает необходимые таблицы"""
+        if self.config['type'] == 'sqlite':
+            self.cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS sensor_data (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sensor_id INTEGER NOT NULL,
+                    value REAL NOT NULL,
+                    timestamp {column_type(TIMESTAMP_STORAGE)} NOT NULL,
+                    sent INTEGER DEFAULT 0,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sync_checkpoint (
+                    destination TEXT PRIMARY KEY,
+                    acked_id INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+            self.ts_mode = storage_mode(self.connection, 'sensor_data')
+        elif self.config['type'] == 'mysql':
+            self.cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS sensor_data (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    sensor_id INT NOT NULL,
+                    value FLOAT NOT NULL,
+                    timestamp {column_type(TIMESTAMP_STORAGE, 'BIGINT')} NOT NULL,
+                    sent INT DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sync_checkpoint (
+                    destination VARCHAR(255) PRIMARY KEY,
+                    acked_id INT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+        
+        self._create_unsent_index()
+        if self.capture_changes:
+            self._create_outbox()
+        else:
+            self._drop_outbox_triggers()
+        self.connection.commit()
+        logger.info("✅ Таблицы созданы/проверены")
+
+    def _create_outbox(self):
+        """Создает таблицу sensor_outbox и триггеры захвата изменений.
+
+        При первом создании триггеров в outbox копируются уже накопленные
+        неотправленные записи, чтобы они не потерялись при смене режима.
+        """
+        if self.config['type'] == 'sqlite':
+            self.cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS sensor_outbox (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op TEXT NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    sensor_id INTEGER,
+                    value REAL,
+                    timestamp {column_type(self.ts_mode)}
+                )
+            ''')
+            self.cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                (OUTBOX_TRIGGERS[0],)
+            )
+            if self.cursor.fetchone()[0]:
+                return
+            self.cursor.execute('''
+                CREATE TRIGGER trg_sensor_data_outbox_insert AFTER INSERT ON sensor_data
+                BEGIN
+                    INSERT INTO sensor_outbox (op, row_id, sensor_id, value, timestamp)
+                    VALUES ('I', NEW.id, NEW.sensor_id, NEW.value, NEW.timestamp);
+                END
+            ''')
+            # Срабатывает только на изменение данных, а не флага sent
+            self.cursor.execute('''
+                CREATE TRIGGER trg_sensor_data_outbox_update
+                AFTER UPDATE OF sensor_id, value, timestamp ON sensor_data
+                BEGIN
+                    INSERT INTO sensor_outbox (op, row_id, sensor_id, value, timestamp)
+                    VALUES ('U', NEW.id, NEW.sensor_id, NEW.value, NEW.timestamp);
+                END
+            ''')
+            self.cursor.execute('''
+                CREATE TRIGGER trg_sensor_data_outbox_delete AFTER DELETE ON sensor_data
+                BEGIN
+                    INSERT INTO sensor_outbox (op, row_id, sensor_id, value, timestamp)
+                    VALUES ('D', OLD.id, OLD.sensor_id, OLD.value, OLD.timestamp);
+                END
+            ''')
+        else:
+            self.cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS sensor_outbox (
+                    seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    op CHAR(1) NOT NULL,
+                    row_id INT NOT NULL,
+                    sensor_id INT,
+                    value FLOAT,
+                    timestamp {column_type(self.ts_mode, 'BIGINT')}
+                )
+            ''')
+            self.cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.TRIGGERS "
+                "WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = %s",
+                (OUTBOX_TRIGGERS[0],)
+            )
+            if self.cursor.fetchone()[0]:
+                return
+            self.cursor.execute('''
+                CREATE TRIGGER trg_sensor_data_outbox_insert AFTER INSERT ON sensor_data
+                FOR EACH ROW
+                    INSERT INTO sensor_outbox (op, row_id, sensor_id, value, timestamp)
+                    VALUES ('I', NEW.id, NEW.sensor_id, NEW.value, NEW.timestamp)
+            ''')
+            # В MySQL нет UPDATE OF: изменение только флага sent отсекаем условием
+            self.cursor.execute('''
+                CREATE TRIGGER trg_sensor_data_outbox_update AFTER UPDATE ON sensor_data
+                FOR EACH ROW
+                BEGIN
+                    IF NOT (NEW.sensor_id <=> OLD.sensor_id AND NEW.value <=> OLD.value
+                            AND NEW.timestamp <=> OLD.timestamp) THEN
+                        INSERT INTO sensor_outbox (op, row_id, sensor_id, value, timestamp)
+                        VALUES ('U', NEW.id, NEW.sensor_id, NEW.value, NEW.timestamp);
+                    END IF;
+                END
+            ''')
+            self.cursor.execute('''
+                CREATE TRIGGER trg_sensor_data_outbox_delete AFTER DELETE ON sensor_data
+                FOR EACH ROW
+                    INSERT INTO sensor_outbox (op, row_id, sensor_id, value, timestamp)
+                    VALUES ('D', OLD.id, OLD.sensor_id, OLD.value, OLD.timestamp)
+            ''')
+
+        self.cursor.execute('''
+            INSERT INTO sensor_outbox (op, row_id, sensor_id, value, timestamp)
+            SELECT 'I', id, sensor_id, value, timestamp FROM sensor_data WHERE sent = 0 ORDER BY id
+        ''')
+        logger.info(f"✅ Захват изменений включен, в outbox перенесено {self.cursor.rowcount} записей")
+
+    def _drop_outbox_triggers(self):
+        """Убирает триггеры, чтобы outbox не рос, когда режим выключен"""
+        for trigger in OUTBOX_TRIGGERS:
+            self.cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    def _create_unsent_index(self):
+        """Индекс только по неотправленным записям, чтобы не сканировать всю таблицу"""
+        if self.config['type'] == 'sqlite':
+            # Частичный индекс: отправленные строки в него не попадают
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sensor_data_unsent ON sensor_data (id) WHERE sent = 0"
+            )
+        else:
+            # В MySQL нет частичных индексов; составной (sent, id) дает тот же диапазонный поиск
+            try:
+                self.cursor.execute("CREATE INDEX idx_sensor_data_unsent ON sensor_data (sent, id)")
+            except mysql.connector.Error as e:
+                if e.errno != 1061:  # индекс уже существует
+                    raise
+    
+    def insert_test_data(self):
+        """Добавляет тестовые данные"""
+        self.insert_readings([(1, 23.5), (2, 18.9), (1, 24.1), (3, 19.7), (2, 22.3)])
+        logger.info("✅ Тестовые данные добавлены")
+
+    def insert_readings(self, readings):
+        """Вставляет показания одной транзакцией.
+
+        readings - кортежи (sensor_id, value[, timestamp]) или словари, см.
+        ingest.reading(). SQLite пишет их через executemany, MySQL -
+        многострочными INSERT по INGEST_MYSQL_ROWS_PER_STATEMENT строк.
+        """
+        rows = []
+        for item in readings:
+            sensor_id, value, timestamp = reading(item)
+            rows.append((sensor_id, value, to_storage(timestamp, self.ts_mode)))
+        if not rows:
+            return 0
+
+        if self.pool is None:
+            try:
+                self.cursor.executemany(self.sql['insert_reading'], rows)
+                self.connection.commit()
+            except sqlite3.Error:
+                # Иначе открытая транзакция держит блокировку базы для остальных писателей
+                self.connection.rollback()
+                raise
+            return len(rows)
+
+        def insert(session):
+            cursor = session.connection.cursor()
+            for start in range(0, len(rows), INGEST_MYSQL_ROWS_PER_STATEMENT):
+                chunk = rows[start:start + INGEST_MYSQL_ROWS_PER_STATEMENT]
+                cursor.execute(
+                    "INSERT INTO sensor_data (sensor_id, value, timestamp) VALUES "
+                    + ", ".join(["(%s, %s, %s)"] * len(chunk)),
+                    [field for row in chunk for field in row]
+                )
+            cursor.close()
+
+        # Без повтора в пуле: обрыв до COMMIT ReadingBuffer повторит,
+        # обрыв на COMMIT (CommitUncertain) - нет, чтобы не задвоить показания
+        self.pool.run(insert, retry=False)
+        return len(rows)
+
+    def ingest(self, max_rows=INGEST_MAX_ROWS, max_delay_ms=INGEST_MAX_DELAY_MS, max_queue=INGEST_MAX_QUEUE):
+        """Буфер для производителей показаний (ingest.ReadingBuffer).
+
+        add()/add_many() можно вызывать из любого числа потоков, показания
+        пишутся группами через отдельное соединение и не мешают циклу
+        отправки на этом. close() буфера дописывает остаток и закрывает его.
+        """
+        if self.pool is not None:
+            # MySQL: каждая группа берет соединение из общего пула
+            return ReadingBuffer(self.insert_readings, max_rows, max_delay_ms, max_queue).start()
+        writer = DatabaseManager(self.config, self.capture_changes)
+        if not writer.connect():
+            raise RuntimeError("Не удалось открыть соединение для записи показаний")
+        return ReadingBuffer(
+            writer.insert_readings, max_rows, max_delay_ms, max_queue, on_close=writer.close
+        ).start()
+    
+    def get_unsent_data(self):
+        """Получает неотправленные данные"""
+        return list(self.iter_unsent_data())
+
+    def count_unsent(self, watermark=None):
+        """Количество неотправленных записей (считается по частичному индексу).
+
+        Если передан watermark, неотправленными считаются записи с id после него.
+        """
+        if watermark is None:
+            return self._query('count_unsent')[0][0]
+        return self._query('count_after', (watermark,))[0][0]
+
+    def iter_unsent_data(self, page_size=1000, watermark=None):
+        """Отдает неотправленные записи по возрастанию id, не держа их все в памяти.
+
+        Если передан watermark, флаг sent не проверяется: отдаются записи после него.
+        """
+        name = 'unsent' if watermark is None else 'after'
+        return self._iter_ordered(name, watermark or 0, page_size)
+    
+    def mark_as_sent(self, record_id):
+        """Помечает запись как отправленную"""
+        self._modify('mark_sent', (record_id,))
+
+    def mark_many_as_sent(self, record_ids):
+        """Помечает записи отправленными диапазонными UPDATE в одной транзакции"""
+        self._modify('mark_sent_range', id_ranges(record_ids), many=True)
+
+    def get_watermark(self, destination):
+        """Возвращает последний непрерывно подтвержденный id для получателя"""
+        rows = self._query('get_watermark', (destination,))
+        return rows[0][0] if rows else 0
+
+    def save_watermark(self, destination, acked_id):
+        """Сохраняет водяной знак получателя (одна строка, один commit)"""
+        self._modify('save_watermark', (destination, acked_id, datetime.now().isoformat()))
+    
+    def count_outbox(self):
+        """Количество изменений, ожидающих отправки"""
+        return self._query('count_outbox')[0][0]
+
+    def iter_outbox(self, page_size=1000):
+        """Отдает изменения из outbox в порядке их появления:
+        (seq, op, row_id, sensor_id, value, timestamp)"""
+        return self._iter_ordered('outbox', 0, page_size)
+
+    def truncate_outbox(self, acked_seq):
+        """Удаляет из outbox все изменения до acked_seq включительно"""
+        self._modify('truncate_outbox', (acked_seq,))
+
+    def close(self):
+        """Закрывает соединение"""
+        if self.connection:
+            self.connection.close()
+        if self.pool is not None:
+            self.pool.close()
+
+    def _query(self, name, params=()):
+        """Все строки запроса name (короткие выборки: счетчики, водяной знак)"""
+        sql = self.sql[name]
+        if self.pool is not None:
+            return self.pool.run(lambda session: session.execute(sql, params).fetchall())
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def _modify(self, name, params=(), many=False):
+        """Изменение одной транзакцией; в MySQL повторяется после переподключения"""
+        sql = self.sql[name]
+        if self.pool is not None:
+            if many:
+                self.pool.run(lambda session: session.executemany(sql, params))
+            else:
+                self.pool.run(lambda session: session.execute(sql, params))
+            return
+        if many:
+            self.cursor.executemany(sql, params)
+        else:
+            self.cursor.execute(sql, params)
+        self.connection.commit()
+
+    def _iter_ordered(self, name, start, page_size):
+        """Строки запроса name по возрастанию первой колонки, начиная после start.
+
+        SQLite читается страницами по page_size (условие по последнему
+        ключу предыдущей страницы). MySQL - одним потоковым запросом
+        (mysql_pool.MySQLPool.stream); если соединение потеряно, чтение
+        продолжается после последней отданной строки.
+        """
+        last = start
+        if self.pool is None:
+            while True:
+                self.cursor.execute(self.sql[name + '_page'], (last, page_size))
+                rows = self.cursor.fetchall()
+                yield from rows
+                if len(rows) < page_size:
+                    return
+                last = rows[-1][0]
+
+        failures = 0
+        while True:
+            try:
+                for row in self.pool.stream(self.sql[name], (last,), page_size):
+                    last = row[0]
+                    yield row
+                return
+            except mysql.connector.Error as e:
+                failures += 1
+                if not is_connection_lost(e) or failures >= MYSQL_RECONNECT_ATTEMPTS:
+                    raise
+                logger.warning(f"⚠️  Чтение из MySQL прервано ({e}), продолжаем после {last}")
+                time.sleep(MYSQL_RECONNECT_DELAY)
+
+# =============================================================================
+# 2. MQTT КЛИЕНТ
+# =============================================================================
+
+def setup_mqtt_client():
+    client_id = f"universal_sender_{datetime.now().strftime('%H%M%S')}"
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+    
+    publisher = PipelinedPublisher(client, MQTT_TOPIC, PUBLISH_WINDOW, PUBLISH_ACK_TIMEOUT)
+    # По умолчанию paho держит в полёте 20 сообщений, остальные ждали бы в его очереди
+    client.max_inflight_messages_set(PUBLISH_WINDOW)
+
+    def on_connect(client, userdata, flags, rc, properties):
+        if rc == 0:
+            logger.info("✅ Успешно подключились к MQTT брокеру!")
+        else:
+            logger.error(f"❌ Ошибка подключения к брокеру. Код: {rc}")
+
+    def on_publish(client, userdata, mid, reason_code, properties):
+        publisher.handle_ack(mid)
+        logger.debug(f"📨 Подтверждение доставки для сообщения ID {mid}")
+
+    client.on_connect = on_connect
+    client.on_publish = on_publish
+
+    try:
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        client.loop_start()
+        time.sleep(2)
+        return client, publisher
+    except Exception as e:
+        logger.error(f"❌ Не удалось подключиться к MQTT брокеру: {e}")
+        raise
+
+# =============================================================================
+# 3. ФУНКЦИЯ СИНХРОНИЗАЦИИ
+# =============================================================================
+
+# Получатель, для которого хранится водяной знак в sync_checkpoint
+DESTINATION = f"{MQTT_BROKER}/{MQTT_TOPIC}"
+
+# Очередь на отправку, обновляется в начале и в конце каждого цикла
+UNSENT_BACKLOG = REGISTRY.gauge('sender_unsent_backlog', 'Неотправленных записей (изменений outbox)')
+
+def mark_acked(db_manager, publisher, tracker=None):
+    """Учитывает записи, подтвержденные брокером, одной транзакцией.
+
+    В режиме 'flag' ставит sent = 1 диапазонами, в режиме 'watermark'
+    сдвигает водяной знак получателя в sync_checkpoint.
+    """
+    acked_ids = []
+    for record_ids in publisher.pop_acked():
+        # Одна строка на подтвержденный пакет
+        logger.info("✅ " + fields(delivered=f"{record_ids[0]}-{record_ids[-1]}", records=len(record_ids)))
+        acked_ids.extend(record_ids)
+
+    if not acked_ids:
+        return 0
+    if tracker is None:
+        db_manager.mark_many_as_sent(acked_ids)
+    elif tracker.acked(acked_ids):
+        db_manager.save_watermark(DESTINATION, tracker.watermark)
+    return len(acked_ids)
+
+def publish_batch(publisher, records, tracker=None, key="id", picked_at=None):
+    """Публикует пакет записей одним сообщением с общим заголовком.
+
+    key - поле записи, по которому отслеживается подтверждение (id или seq outbox),
+    picked_at - когда первая запись пакета выбрана из базы (для трассировки).
+    """
+    header = {
+        "source": ACTIVE_DATABASE,
+        "database_type": DATABASE_CONFIG[ACTIVE_DATABASE]['type'],
+        "version": "3.0"
+    }
+    picked_at = picked_at or time.time()
+
+    def encode():
+        # Вызывается публикатором после ожидания окна: время публикации - без него
+        if TRACE_ENABLED:
+            header.update(trace_header(picked_at))
+        return encode_message(records, header)
+
+    record_ids = [record[key] for record in records]
+    if tracker is not None:
+        # Регистрируем до публикации, чтобы неотправленный пакет задержал водяной знак
+        tracker.published(record_ids)
+    if not publisher.publish(encode, record_ids):
+        logger.error(f"❌ Ошибка публикации пакета записей {key} {record_ids[0]}-{record_ids[-1]}")
+        return False
+    return True
+
+def sync_data(db_manager, publisher):
+    success_count = 0
+    tracker = None
+    try:
+        watermark = None
+        if DELIVERY_TRACKING == TRACKING_WATERMARK:
+            watermark = db_manager.get_watermark(DESTINATION)
+            tracker = AckWatermark(watermark)
+
+        unsent_count = db_manager.count_unsent(watermark)
+        UNSENT_BACKLOG.set(unsent_count)
+
+        if not unsent_count:
+            logger.info("💤 Новых данных для отправки нет")
+            return True
+
+        logger.info(f"📦 Найдено {unsent_count} новых записей")
+
+        batch = BatchAccumulator(BATCH_MAX_RECORDS, BATCH_MAX_DELAY_MS)
+        for record in db_manager.iter_unsent_data(UNSENT_PAGE_SIZE, watermark):
+            record_id, sensor_id, value, timestamp = record
+
+            payload = {
+                "id": record_id,
+                "sensor_id": sensor_id,
+                "value": value,
+                # По сети время всегда ISO строка, как бы оно ни хранилось
+                "timestamp": to_iso(timestamp)
+            }
+
+            if detail.enabled():
+                logger.info(f"🚀 Отправляем запись ID {record_id} из {DATABASE_CONFIG[ACTIVE_DATABASE]['type'].upper()}")
+
+            if batch.add(payload):
+                publish_batch(publisher, batch.take(), tracker, picked_at=batch.picked_at)
+
+            success_count += mark_acked(db_manager, publisher, tracker)
+
+        if batch.records:
+            publish_batch(publisher, batch.take(), tracker, picked_at=batch.picked_at)
+
+        # Ждем подтверждения оставшихся сообщений
+        publisher.wait_all()
+        success_count += mark_acked(db_manager, publisher, tracker)
+
+        UNSENT_BACKLOG.set(unsent_count - success_count)
+        logger.info(f"🎉 Успешно отправлено {success_count} из {unsent_count} записей")
+        return True
+
+    except DeliveryTimeout as e:
+        mark_acked(db_manager, publisher, tracker)
+        logger.warning(f"⚠️  Таймаут доставки: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"💥 Ошибка синхронизации: {e}")
+        return False
+
+def sync_outbox(db_manager, publisher):
+    """Отправляет изменения из sensor_outbox и удаляет подтвержденные.
+
+    Порядок подтверждений отслеживается по seq: outbox обрезается только
+    до непрерывно подтвержденного префикса.
+    """
+    success_count = 0
+    tracker = AckWatermark()
+
+    def truncate_acked():
+        acked_seqs = []
+        for seqs in publisher.pop_acked():
+            logger.info("✅ " + fields(delivered_seq=f"{seqs[0]}-{seqs[-1]}", changes=len(seqs)))
+            acked_seqs.extend(seqs)
+        if acked_seqs and tracker.acked(acked_seqs):
+            db_manager.truncate_outbox(tracker.watermark)
+        return len(acked_seqs)
+
+    try:
+        pending_count = db_manager.count_outbox()
+        UNSENT_BACKLOG.set(pending_count)
+
+        if not pending_count:
+            logger.info("💤 Новых изменений для отправки нет")
+            return True
+
+        logger.info(f"📦 В outbox {pending_count} изменений")
+
+        batch = BatchAccumulator(BATCH_MAX_RECORDS, BATCH_MAX_DELAY_MS)
+        for seq, op, row_id, sensor_id, value, timestamp in db_manager.iter_outbox(UNSENT_PAGE_SIZE):
+            payload = {
+                "seq": seq,
+                "op": op,
+                "id": row_id,
+                "sensor_id": sensor_id,
+                "value": value,
+                "timestamp": to_iso(timestamp)
+            }
+
+            if detail.enabled():
+                logger.info(f"🚀 Отправляем изменение {op} записи ID {row_id}")
+
+            if batch.add(payload):
+                publish_batch(publisher, batch.take(), tracker, key="seq", picked_at=batch.picked_at)
+
+            success_count += truncate_acked()
+
+        if batch.records:
+            publish_batch(publisher, batch.take(), tracker, key="seq", picked_at=batch.picked_at)
+
+        publisher.wait_all()
+        success_count += truncate_acked()
+
+        UNSENT_BACKLOG.set(pending_count - success_count)
+        logger.info(f"🎉 Успешно отправлено {success_count} из {pending_count} изменений")
+        return True
+
+    except DeliveryTimeout as e:
+        truncate_acked()
+        logger.warning(f"⚠️  Таймаут доставки: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"💥 Ошибка синхронизации: {e}")
+        return False
+
+# =============================================================================
+# 4. ГЛАВНАЯ ФУНКЦИЯ
+# =============================================================================
+
+def main():
+    logger.info("🚀 УНИВЕРСАЛЬНАЯ СИСТЕМА ПЕРЕДАЧИ ДАННЫХ")
+    logger.info(f"📊 Активная СУБД: {ACTIVE_DATABASE.upper()}")
+    logger.info("=" * 50)
+    
+    db_manager = None
+    client = None
+    trigger = None
+    metrics_server = None
+    
+    try:
+        # Инициализация базы данных
+        db_manager = DatabaseManager(
+            DATABASE_CONFIG[ACTIVE_DATABASE], capture_changes=(SYNC_SOURCE == 'outbox')
+        )
+        if not db_manager.connect():
+            return
+        sync = sync_outbox if db_manager.capture_changes else sync_data
+        
+        # Добавляем тестовые данные
+        db_manager.insert_test_data()
+        
+        # MQTT клиент
+        client, publisher = setup_mqtt_client()
+
+        # Пробуждение по изменениям: data_version есть только у SQLite
+        db_config = DATABASE_CONFIG[ACTIVE_DATABASE]
+        trigger = SyncTrigger(
+            db_config['database'] if db_config['type'] == 'sqlite' else None,
+            SYNC_NOTIFY_PORT, SYNC_MIN_INTERVAL, SYNC_MAX_INTERVAL, SYNC_WATCH_INTERVAL
+        )
+
+        # Очистка доставленных записей: нужна на устройствах с SQLite
+        retention = None
+        if RETENTION_ENABLED and db_config['type'] == 'sqlite':
+            retention = Retention(
+                db_manager.connection, db_config['database'], RETENTION_MAX_AGE_HOURS,
+                RETENTION_MAX_DELIVERED_ROWS, RETENTION_BATCH_ROWS, RETENTION_VACUUM_PAGES,
+                RETENTION_INTERVAL
+            )
+        if METRICS_ENABLED:
+            metrics_server = MetricsServer(
+                REGISTRY, METRICS_HOST, METRICS_SENDER_PORT,
+                METRICS_SNAPSHOT_FILE.format(name='universal_sender'), METRICS_SNAPSHOT_INTERVAL
+            ).start()
+        
+        # Основной цикл
+        cycle_count = 0
+        logger.info("\n🔄 Служба синхронизации запущена")
+        
+        while True:
+            cycle_count += 1
+            logger.info(f"\n{'='*30}")
+            logger.info(f"ЦИКЛ СИНХРОНИЗАЦИИ #{cycle_count}")
+            logger.info(f"{'='*30}")
+            
+            published_before = publisher.published
+            sync_success = sync(db_manager, publisher)
+            
+            if sync_success:
+                logger.info("✅ Цикл завершен успешно")
+            else:
+                logger.warning("⚠️  В цикле возникли проблемы")
+
+            if retention:
+                watermark = None
+                if DELIVERY_TRACKING == TRACKING_WATERMARK and not db_manager.capture_changes:
+                    watermark = db_manager.get_watermark(DESTINATION)
+                retention.maybe_purge(watermark, outbox=db_manager.capture_changes)
+            
+            logger.info("⏳ Ожидание новых данных...")
+            reason = trigger.wait(found_data=publisher.published != published_before)
+            logger.info(f"🔔 Пробуждение: {reason}")
+            
+    except KeyboardInterrupt:
+        logger.info("\n🛑 ОСТАНОВКА СИСТЕМЫ")
+    except Exception as e:
+        logger.error(f"💥 Критическая ошибка: {e}")
+    finally:
+        logger.info("\n🔚 Завершение работы...")
+        if client:
+            client.loop_stop()
+            client.disconnect()
+        if trigger:
+            trigger.close()
+        if db_manager:
+            db_manager.close()
+        if metrics_server:
+            metrics_server.stop()
+        logger.info("🎯 СИСТЕМА ОСТАНОВЛЕНА")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
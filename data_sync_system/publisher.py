@@ -0,0 +1,150 @@
+# publisher.py - Конвейерная публикация MQTT сообщений с ограниченным окном
+import threading
+import time
+from collections import OrderedDict, deque
+
+import paho.mqtt.client as mqtt
+
+from metrics import REGISTRY, LATENCY_BUCKETS
+
+PUBLISHED = REGISTRY.counter('sync_published_total', 'Опубликовано MQTT сообщений')
+ACKED = REGISTRY.counter('sync_acked_total', 'Сообщений, подтвержденных PUBACK')
+TIMED_OUT = REGISTRY.counter('sync_ack_timeouts_total', 'Сообщений без PUBACK за ack_timeout')
+IN_FLIGHT = REGISTRY.gauge('sync_in_flight', 'Сообщений, ожидающих PUBACK')
+ACK_SECONDS = REGISTRY.histogram(
+    'sync_publish_ack_seconds', 'Время от публикации до PUBACK, секунд', LATENCY_BUCKETS
+)
+
+class DeliveryTimeout(Exception):
+    """Брокер не подтвердил самое старое сообщение за отведённое время"""
+
+
+# =============================================================================
+# КОНВЕЙЕРНЫЙ ОТПРАВИТЕЛЬ
+# =============================================================================
+
+class PipelinedPublisher:
+    """Публикует сообщения с QoS 1, не дожидаясь PUBACK после каждого.
+
+    Одновременно «в полёте» может находиться не больше window сообщений
+    (у клиента paho должен стоять max_inflight_messages_set(window), иначе
+    лишние ждут отправки в его очереди, а таймаут для них уже идёт).
+    Подтверждения приходят через handle_ack() из потока paho, а
+    pop_acked() отдаёт метки подтверждённых сообщений в порядке прихода PUBACK.
+    Сообщения без PUBACK дольше ack_timeout убираются из окна вместе с
+    DeliveryTimeout: их записи остаются неподтверждёнными и уходят повторно.
+    """
+
+    def __init__(self, client, topic, window=100, ack_timeout=10, qos=1):
+        self.client = client
+        self.topic = topic
+        self.window = max(1, int(window))
+        self.ack_timeout = ack_timeout
+        self.qos = qos
+        # Сколько сообщений опубликовано за всё время работы
+        self.published = 0
+
+        self._cond = threading.Condition()
+        # mid -> (метка, время публикации); порядок = порядок публикации
+        self._in_flight = OrderedDict()
+        # PUBACK, пришедшие раньше, чем publish() успел зарегистрировать mid
+        self._early_acks = set()
+        # mid сообщений, убранных из окна по таймауту: их поздний PUBACK не учитывается
+        self._expired = set()
+        self._acked = deque()
+        IN_FLIGHT.set_function(self.in_flight)
+
+    def handle_ack(self, mid):
+        """Вызывается из on_publish: отмечает сообщение mid как доставленное"""
+        with self._cond:
+            entry = self._in_flight.pop(mid, None)
+            if entry is None and mid in self._expired:
+                self._expired.discard(mid)
+            elif entry is None:
+                self._early_acks.add(mid)
+            else:
+                self._acked.append(entry[0])
+                ACKED.inc()
+                ACK_SECONDS.observe(time.monotonic() - entry[1])
+            self._cond.notify_all()
+
+    def publish(self, payload, token):
+        """Публикует сообщение, при заполненном окне ждёт освобождения места.
+
+        payload - байты сообщения или функция без аргументов, которая их
+        собирает: она вызывается после ожидания места в окне, так что
+        время публикации в заголовке (трассировка) не включает это ожидание.
+        token - произвольная метка (например, ID записи), которая вернётся
+        из pop_acked() после подтверждения. Возвращает False, если paho
+        отказался публиковать; бросает DeliveryTimeout, если окно не
+        освобождается дольше ack_timeout.
+        """
+        with self._cond:
+            while len(self._in_flight) >= self.window:
+                self._wait_oldest()
+
+        if callable(payload):
+            payload = payload()
+        sent_at = time.monotonic()
+        msg_info = self.client.publish(self.topic, payload, qos=self.qos)
+        if msg_info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+
+        PUBLISHED.inc()
+        with self._cond:
+            self.published += 1
+            # paho снова выдал этот mid: старый таймаут к новому сообщению не относится
+            self._expired.discard(msg_info.mid)
+            if msg_info.mid in self._early_acks:
+                self._early_acks.discard(msg_info.mid)
+                self._acked.append(token)
+                ACKED.inc()
+                ACK_SECONDS.observe(time.monotonic() - sent_at)
+            else:
+                self._in_flight[msg_info.mid] = (token, sent_at)
+        return True
+
+    def wait_all(self):
+        """Ждёт подтверждения всех отправленных сообщений"""
+        with self._cond:
+            while self._in_flight:
+                self._wait_oldest()
+
+    def pop_acked(self):
+        """Возвращает метки подтверждённых сообщений в порядке PUBACK"""
+        with self._cond:
+            acked = list(self._acked)
+            self._acked.clear()
+        return acked
+
+    def in_flight(self):
+        """Количество сообщений, ожидающих PUBACK"""
+        with self._cond:
+            return len(self._in_flight)
+
+    def _wait_oldest(self):
+        # Вызывается под self._cond
+        token, sent_at = next(iter(self._in_flight.values()))
+        remaining = sent_at + self.ack_timeout - time.monotonic()
+        if remaining <= 0:
+            expired = self._expire()
+            TIMED_OUT.inc(expired)
+            raise DeliveryTimeout(
+                f"нет подтверждения для {token!r} за {self.ack_timeout} с "
+                f"(убрано из окна сообщений: {expired})"
+            )
+        self._cond.wait(remaining)
+
+    def _expire(self):
+        """Убирает из окна все сообщения, ждущие PUBACK дольше ack_timeout; возвращает их число"""
+        # Вызывается под self._cond; окно упорядочено по времени публикации
+        deadline = time.monotonic() - self.ack_timeout
+        expired = 0
+        while self._in_flight:
+            mid, (_, sent_at) = next(iter(self._in_flight.items()))
+            if sent_at > deadline:
+                break
+            del self._in_flight[mid]
+            self._expired.add(mid)
+            expired += 1
+        return expired
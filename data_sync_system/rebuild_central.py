@@ -0,0 +1,292 @@
+# rebuild_central.py - Восстановление центральной базы из журнала принятых данных
+import gzip
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+from central_query import create_query_indexes
+from dedup import create_origin_index, remove_duplicates
+from journal import list_segments
+from message_format import is_delete
+from rollup import create_rollups, rebuild_rollups
+from timestamps import column_type, to_storage
+
+logger = logging.getLogger(__name__)
+
+# Схемы received_data: receiver.py (central) и универсальных приёмников (universal).
+# Колонки после received_at и значения по умолчанию, как их пишут приёмники
+LAYOUTS = {
+    'central': {
+        'source_column': 'source',
+        'columns': (('source', 'source', 'unknown'), ('version', 'version', '1.0')),
+    },
+    'universal': {
+        'source_column': 'source_db',
+        'columns': (('source_db', 'source', None), ('db_type', 'database_type', None),
+                    ('version', 'version', None)),
+    },
+}
+
+# =============================================================================
+# РАЗБОР ЖУРНАЛА (в процессах пула)
+# =============================================================================
+
+def parse_line(line):
+    """Строка журнала -> (received_at, запись); старый формат '<время> | <json>' тоже"""
+    if line.startswith(b'{'):
+        entry = json.loads(line)
+        return entry['received_at'], entry['data']
+    received_at, _, data = line.partition(b' | ')
+    return received_at.decode(), json.loads(data)
+
+def _parse_chunk(task):
+    """Разбирает кусок сегмента; (сегмент, конец куска, строки received_data, битые строки)"""
+    name, path, start, end, data, layout, ts_mode = task
+    if data is None:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm[start:end]
+
+    extra = LAYOUTS[layout]['columns']
+    rows = []
+    bad = 0
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            received_at, record = parse_line(line)
+            # Удаления на отправителе приёмники в базу не применяют
+            if is_delete(record):
+                continue
+            rows.append((
+                record.get('id'),
+                record['sensor_id'],
+                record['value'],
+                to_storage(record['timestamp'], ts_mode),
+                to_storage(received_at, ts_mode),
+            ) + tuple(record.get(key, default) for _, key, default in extra))
+        except (ValueError, KeyError, TypeError):
+            # Оборванная при сбое последняя строка сегмента и т.п.
+            bad += 1
+    return name, end, rows, bad
+
+# =============================================================================
+# ВОССТАНОВЛЕНИЕ
+# =============================================================================
+
+class CentralRebuild:
+    """Заполняет новую базу received_data из сегментов журнала.
+
+    Несжатые сегменты читаются через mmap, сжатые - потоком gzip; журнал
+    режется на куски по chunk_bytes по границам строк, куски разбираются
+    пулом из workers процессов. Строки вставляются без индексов и
+    триггеров в порядке журнала, вместе с каждым куском в rebuild_checkpoint
+    сохраняется сегмент и смещение - прерванное восстановление продолжается
+    с него. После загрузки удаляются повторы (остается последняя запись,
+    как при идемпотентном приёме), строятся индексы и агрегаты.
+    """
+
+    def __init__(self, journal, database, layout='central', ts_mode='text',
+                 workers=4, chunk_bytes=16 * 1024 * 1024, rollups=True, rollup_batch=50000):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Неизвестная схема: {layout}")
+        self.journal = journal
+        self.database = database
+        self.layout = layout
+        self.ts_mode = ts_mode
+        self.workers = workers
+        self.chunk_bytes = chunk_bytes
+        self.rollups = rollups
+        self.rollup_batch = rollup_batch
+        self.conn = None
+
+    def run(self):
+        started = time.monotonic()
+        self.conn = sqlite3.connect(self.database)
+        try:
+            position = self._prepare()
+            loaded, bad = self._load(position)
+            self._finish()
+        finally:
+            self.conn.close()
+        logger.info(
+            f"✅ {self.database} восстановлена: {loaded} строк, пропущено битых строк {bad}, "
+            f"за {time.monotonic() - started:.1f} с"
+        )
+
+    def _prepare(self):
+        """Создает схему новой базы или возвращает сохраненную позицию"""
+        # WAL и synchronous=NORMAL: быстро и без порчи базы при падении процесса
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA cache_size = -262144")
+
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'rebuild_checkpoint' in tables:
+            segment, offset = self.conn.execute("SELECT segment, offset FROM rebuild_checkpoint").fetchone()
+            logger.info(f"🔁 Продолжаем восстановление с {segment}, смещение {offset}")
+            return segment, offset
+        if 'received_data' in tables:
+            raise RuntimeError(f"{self.database} уже содержит received_data, укажите новый файл")
+
+        ts_type = column_type(self.ts_mode)
+        extra = ',\n'.join(f"{column} TEXT" for column, _, _ in LAYOUTS[self.layout]['columns'])
+        with self.conn:
+            self.conn.execute(f'''
+                CREATE TABLE received_data (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    original_id INTEGER,
+                    sensor_id INTEGER NOT NULL,
+                    value REAL NOT NULL,
+                    timestamp {ts_type} NOT NULL,
+                    received_at {ts_type} NOT NULL,
+                    {extra}
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE rebuild_checkpoint (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    segment TEXT,
+                    offset INTEGER NOT NULL,
+                    loaded_at TEXT NOT NULL
+                )
+            ''')
+            self.conn.execute(
+                "INSERT INTO rebuild_checkpoint VALUES (1, NULL, 0, ?)", (datetime.now().isoformat(),)
+            )
+        logger.info(f"🚀 Восстановление {self.database} из {self.journal}")
+        return None, 0
+
+    def _load(self, position):
+        columns = ['original_id', 'sensor_id', 'value', 'timestamp', 'received_at']
+        columns += [column for column, _, _ in LAYOUTS[self.layout]['columns']]
+        insert_sql = (
+            f"INSERT INTO received_data ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})"
+        )
+
+        loaded = bad = 0
+        with multiprocessing.Pool(self.workers) as pool:
+            # Куски вставляются в порядке журнала, позиция двигается только вперед;
+            # в работе не больше двух кусков на процесс, чтобы не держать журнал в памяти
+            pending = deque()
+            tasks = self._chunks(position)
+            while True:
+                for task in tasks:
+                    pending.append(pool.apply_async(_parse_chunk, (task + (self.layout, self.ts_mode),)))
+                    if len(pending) >= self.workers * 2:
+                        break
+                if not pending:
+                    break
+                segment, end, rows, bad_lines = pending.popleft().get()
+                with self.conn:
+                    self.conn.executemany(insert_sql, rows)
+                    self.conn.execute(
+                        "UPDATE rebuild_checkpoint SET segment = ?, offset = ?, loaded_at = ?",
+                        (segment, end, datetime.now().isoformat())
+                    )
+                loaded += len(rows)
+                bad += bad_lines
+                logger.info(f"📦 {segment}: загружено до смещения {end}, всего строк {loaded}")
+        return loaded, bad
+
+    def _chunks(self, position):
+        """Куски журнала (сегмент, начало, конец, данные или None для mmap) после позиции"""
+        saved_segment, saved_offset = position
+        segments = list_segments(self.journal)
+        names = [self._segment_name(path) for path in segments]
+        if saved_segment is not None:
+            if saved_segment not in names:
+                raise RuntimeError(f"Сегмент {saved_segment} из контрольной точки не найден")
+            segments = segments[names.index(saved_segment):]
+
+        for path in segments:
+            name = self._segment_name(path)
+            start = saved_offset if name == saved_segment else 0
+            if path.endswith('.gz'):
+                yield from self._gzip_chunks(path, name, start)
+            else:
+                yield from self._mmap_chunks(path, name, start)
+
+    def _mmap_chunks(self, path, name, start):
+        size = os.path.getsize(path)
+        if start >= size:
+            return
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while start < size:
+                newline = mm.find(b'\n', min(start + self.chunk_bytes, size) - 1)
+                end = size if newline < 0 else newline + 1
+                yield name, path, start, end, None
+                start = end
+
+    def _gzip_chunks(self, path, name, start):
+        # Смещения считаются в распакованных данных, начало пропускается чтением
+        with gzip.open(path, 'rb') as f:
+            f.seek(start)
+            tail = b''
+            while True:
+                block = f.read(self.chunk_bytes)
+                if not block:
+                    break
+                data = tail + block
+                cut = data.rfind(b'\n') + 1
+                if not cut:
+                    tail = data
+                    continue
+                tail = data[cut:]
+                yield name, path, start, start + cut, data[:cut]
+                start += cut
+            if tail:
+                yield name, path, start, start + len(tail), tail
+
+    @staticmethod
+    def _segment_name(path):
+        """Имя сегмента не меняется после сжатия"""
+        name = os.path.basename(path)
+        return name[:-3] if name.endswith('.gz') else name
+
+    def _finish(self):
+        """Повторы, индексы и агрегаты строятся после загрузки"""
+        logger.info("🔧 Построение индексов...")
+        # Повторы QoS 1 из журнала в новой базе не нужны, копию не храним
+        source_column = LAYOUTS[self.layout]['source_column']
+        remove_duplicates(self.conn, source_column, backup_table=None)
+        create_origin_index(self.conn, source_column)
+        create_query_indexes(self.conn)
+        if self.rollups:
+            create_rollups(self.conn)
+            rebuild_rollups(self.conn, self.rollup_batch)
+        with self.conn:
+            self.conn.execute("DROP TABLE rebuild_checkpoint")
+
+# =============================================================================
+# ЗАПУСК ИЗ КОМАНДНОЙ СТРОКИ
+# =============================================================================
+
+def main():
+    """python rebuild_central.py <журнал> <новая база> [central|universal]"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    from config import REBUILD_WORKERS, REBUILD_CHUNK_MB, TIMESTAMP_STORAGE
+    from config import ROLLUPS_ENABLED, ROLLUP_REBUILD_BATCH
+
+    if len(sys.argv) < 3:
+        print("Использование: python rebuild_central.py <журнал> <новая база> [central|universal]")
+        sys.exit(1)
+    journal, database = sys.argv[1], sys.argv[2]
+    layout = sys.argv[3] if len(sys.argv) > 3 else ('universal' if 'universal' in journal else 'central')
+    try:
+        CentralRebuild(
+            journal, database, layout, TIMESTAMP_STORAGE,
+            REBUILD_WORKERS, REBUILD_CHUNK_MB * 1024 * 1024, ROLLUPS_ENABLED, ROLLUP_REBUILD_BATCH
+        ).run()
+    except KeyboardInterrupt:
+        logger.info("\n🛑 Восстановление прервано, следующий запуск продолжит его")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# receive_pipeline.py - Приём MQTT сообщений без работы с диском в сетевом потоке paho
+import logging
+import queue
+import threading
+import time
+import zlib
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Счётчики stats() с теми же именами, в метриках процесса
+PIPELINE_COUNTERS = {
+    name: REGISTRY.counter(f'receive_{name}_total', help_text)
+    for name, help_text in (
+        ('enqueued', 'Сообщений, принятых в очередь'),
+        ('processed', 'Сообщений, обработанных без ошибок'),
+        ('failed', 'Сообщений, обработка которых завершилась ошибкой'),
+        ('dropped', 'Сообщений, отброшенных при заполненной очереди'),
+        ('blocked', 'Ожиданий места в заполненной очереди'),
+    )
+}
+QUEUE_DEPTH = REGISTRY.gauge('receive_queue_depth', 'Сообщений в очереди приёма')
+
+# Политики при заполненной очереди
+POLICY_BLOCK = 'block'              # ждать место (не дольше block_timeout, если он задан)
+POLICY_DROP_NEWEST = 'drop_newest'  # сразу отбросить новое сообщение
+POLICY_DROP_OLDEST = 'drop_oldest'  # вытеснить самое старое сообщение из очереди
+
+_STOP = object()
+
+# =============================================================================
+# КОНВЕЙЕР ПРИЁМА
+# =============================================================================
+
+class ReceivePipeline:
+    """Ограниченные очереди сырых сообщений и потоки-обработчики.
+
+    on_message только вызывает submit() с байтами сообщения, а декодирование
+    и сохранение выполняет handler(topic, payload) в рабочих потоках. Так
+    медленный диск не задерживает keepalive и PUBACK в сетевом потоке.
+
+    У каждого потока своя очередь, сообщение попадает в неё по топику:
+    сообщения одного топика обрабатываются строго по порядку прихода, и
+    старая версия строки не перезапишет более новую. Несколько потоков
+    ускоряют приём, только если отправители пишут в разные топики.
+
+    paho подтверждает (PUBACK) сообщение QoS 1 после возврата из on_message,
+    поэтому отброшенное здесь сообщение брокер уже не повторит. Политика
+    'block' без block_timeout не теряет сообщений: сетевой поток ждет места
+    в очереди, и брокер притормаживает отправку.
+    """
+
+    def __init__(self, handler, workers=1, max_queue=10000, policy=POLICY_BLOCK,
+                 block_timeout=None, stats_interval=60):
+        if policy not in (POLICY_BLOCK, POLICY_DROP_NEWEST, POLICY_DROP_OLDEST):
+            raise ValueError(f"Неизвестная политика очереди: {policy}")
+        self.handler = handler
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.stats_interval = stats_interval
+
+        workers = max(1, int(workers))
+        self._queues = [queue.Queue(maxsize=max(1, max_queue // workers)) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'processed': 0,
+            'failed': 0,
+            'dropped': 0,
+            'blocked': 0,
+            'blocked_seconds': 0.0,
+            'max_depth': 0,
+        }
+        self._workers = [
+            threading.Thread(target=self._work, args=(work_queue,),
+                             name=f"receive-worker-{i}", daemon=True)
+            for i, work_queue in enumerate(self._queues)
+        ]
+        self._stopped = threading.Event()
+        self._monitor = threading.Thread(target=self._report, name="receive-monitor", daemon=True)
+        QUEUE_DEPTH.set_function(self._depth)
+
+    def start(self):
+        """Запускает рабочие потоки и периодический отчёт о состоянии очереди"""
+        for worker in self._workers:
+            worker.start()
+        if self.stats_interval:
+            self._monitor.start()
+        return self
+
+    def submit(self, topic, payload):
+        """Ставит сообщение в очередь. Возвращает False, если оно отброшено"""
+        item = (topic, payload)
+        work_queue = self._route(topic)
+        try:
+            work_queue.put_nowait(item)
+        except queue.Full:
+            if not self._put_when_full(work_queue, item):
+                dropped = self._count('dropped')
+                # Не засоряем лог при перегрузке: первое и каждое тысячное
+                if dropped % 1000 == 1:
+                    logger.error(
+                        f"❌ Очередь приёма заполнена, отброшено уже подтвержденных "
+                        f"сообщений: {dropped}"
+                    )
+                return False
+
+        depth = self._depth()
+        PIPELINE_COUNTERS['enqueued'].inc()
+        with self._lock:
+            self._stats['enqueued'] += 1
+            if depth > self._stats['max_depth']:
+                self._stats['max_depth'] = depth
+        return True
+
+    def stop(self):
+        """Дообрабатывает всё, что уже в очереди, и останавливает потоки"""
+        self._stopped.set()
+        for work_queue in self._queues:
+            work_queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        logger.info(f"📊 Конвейер приёма остановлен: {self.stats()}")
+
+    def stats(self):
+        """Снимок счётчиков: принято, обработано, ошибок, отброшено, ожиданий и глубина"""
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot['depth'] = self._depth()
+        return snapshot
+
+    def _route(self, topic):
+        """Очередь потока для топика: один топик - всегда один поток"""
+        if len(self._queues) == 1:
+            return self._queues[0]
+        return self._queues[zlib.crc32(topic.encode('utf-8')) % len(self._queues)]
+
+    def _depth(self):
+        return sum(work_queue.qsize() for work_queue in self._queues)
+
+    def _put_when_full(self, work_queue, item):
+        if self.policy == POLICY_DROP_NEWEST:
+            return False
+
+        if self.policy == POLICY_DROP_OLDEST:
+            while True:
+                try:
+                    work_queue.get_nowait()
+                    work_queue.task_done()
+                    self._count('dropped')
+                except queue.Empty:
+                    pass
+                try:
+                    work_queue.put_nowait(item)
+                    return True
+                except queue.Full:
+                    continue
+
+        # POLICY_BLOCK: притормаживаем сетевой поток (без block_timeout - до появления места)
+        started = time.monotonic()
+        try:
+            work_queue.put(item, timeout=self.block_timeout)
+            return True
+        except queue.Full:
+            return False
+        finally:
+            PIPELINE_COUNTERS['blocked'].inc()
+            with self._lock:
+                self._stats['blocked'] += 1
+                self._stats['blocked_seconds'] += time.monotonic() - started
+
+    def _count(self, name):
+        PIPELINE_COUNTERS[name].inc()
+        with self._lock:
+            self._stats[name] += 1
+            return self._stats[name]
+
+    def _work(self, work_queue):
+        while True:
+            item = work_queue.get()
+            try:
+                if item is _STOP:
+                    return
+                topic, payload = item
+                try:
+                    self.handler(topic, payload)
+                    self._count('processed')
+                except Exception as e:
+                    self._count('failed')
+                    logger.error(f"💥 Ошибка обработки сообщения: {e}")
+            finally:
+                work_queue.task_done()
+
+    def _report(self):
+        while not self._stopped.wait(self.stats_interval):
+            logger.info(f"📊 Очередь приёма: {self.stats()}")
@@ -1,198 +1,307 @@
-import paho.mqtt.client as mqtt
-import json
-from datetime import datetime
-import logging
-import sqlite3
-import os
-import sys
-
-# =============================================================================
-# НАСТРОЙКА ЛОГИРОВАНИЯ
-# =============================================================================
-def setup_logging():
-    """Настраивает логирование для приёмника"""
-    os.makedirs('logs', exist_ok=True)
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('logs/receiver.log', encoding='utf-8'),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    return logging.getLogger(__name__)
-
-logger = setup_logging()
-
-# =============================================================================
-# НАСТРОЙКА ЦЕНТРАЛЬНОЙ БАЗЫ ДАННЫХ
-# =============================================================================
-
-def setup_central_database():
-    """Создает центральную базу данных для приема данных"""
-    try:
-        conn = sqlite3.connect('central_storage.db', check_same_thread=False)
-        cursor = conn.cursor()
-        
-        # Создаем таблицу для принятых данных
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS received_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                original_id INTEGER,
-                sensor_id INTEGER NOT NULL,
-                value REAL NOT NULL,
-                timestamp TEXT NOT NULL,
-                received_at TEXT NOT NULL,
-                source TEXT,
-                version TEXT
-            )
-        ''')
-        conn.commit()
-        logger.info("✅ Центральная база данных готова")
-        return conn
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка создания центральной базы: {e}")
-        raise
-
-# =============================================================================
-# MQTT НАСТРОЙКИ
-# =============================================================================
-
-MQTT_BROKER = "broker.hivemq.com"
-MQTT_TOPIC = "my_school_project/sensor_data_v2"
-
-# =============================================================================
-# ОБРАБОТЧИКИ MQTT СОБЫТИЙ
-# =============================================================================
-
-def on_connect(client, userdata, flags, rc, properties=None):
-    """Обработчик подключения к брокеру"""
-    if rc == 0:
-        logger.info("✅ ПРИЁМНИК ПОДКЛЮЧЕН К MQTT БРОКЕРУ!")
-        client.subscribe(MQTT_TOPIC)
-        logger.info(f"📡 ПОДПИСКА НА ТОПИК: '{MQTT_TOPIC}'")
-        logger.info("🎧 ОЖИДАНИЕ ДАННЫХ...")
-    else:
-        logger.error(f"❌ ОШИБКА ПОДКЛЮЧЕНИЯ. Код: {rc}")
-
-def on_message(client, userdata, msg):
-    """Обработчик входящих сообщений"""
-    try:
-        # Декодируем JSON сообщение
-        payload = json.loads(msg.payload.decode())
-        
-        logger.info(f"\n📨 ПОЛУЧЕНО НОВОЕ СООБЩЕНИЕ")
-        logger.info(f"├─ Время: {datetime.now().strftime('%H:%M:%S')}")
-        logger.info(f"├─ Топик: {msg.topic}")
-        logger.info(f"├─ Данные: {json.dumps(payload, indent=2)}")
-        
-        # Сохраняем в центральную базу
-        save_to_database(payload)
-        
-        # Дублируем в лог-файл
-        save_to_logfile(payload)
-        
-        logger.info("✅ ДАННЫЕ УСПЕШНО СОХРАНЕНЫ")
-
-    except json.JSONDecodeError as e:
-        logger.error(f"❌ ОШИБКА JSON: {e}")
-    except Exception as e:
-        logger.error(f"💥 ОШИБКА ОБРАБОТКИ: {e}")
-
-def on_subscribe(client, userdata, mid, granted_qos, properties=None):
-    """Обработчик успешной подписки"""
-    logger.info(f"✅ УСПЕШНАЯ ПОДПИСКА. QoS: {granted_qos[0]}")
-
-def on_disconnect(client, userdata, rc, properties=None):
-    """Обработчик отключения от брокера"""
-    if rc != 0:
-        logger.warning("⚠️  НЕОЖИДАННОЕ ОТКЛЮЧЕНИЕ ОТ БРОКЕРА")
-
-# =============================================================================
-# ФУНКЦИИ СОХРАНЕНИЯ ДАННЫХ
-# =============================================================================
-
-def save_to_database(payload):
-    """Сохраняет данные в SQLite базу"""
-    try:
-        conn = sqlite3.connect('central_storage.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO received_data 
-            (original_id, sensor_id, value, timestamp, received_at, source, version) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            payload.get('id'),
-            payload.get('sensor_id'),
-            payload.get('value'),
-            payload.get('timestamp'),
-            datetime.now().isoformat(),
-            payload.get('source', 'unknown'),
-            payload.get('version', '1.0')
-        ))
-        
-        conn.commit()
-        conn.close()
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка сохранения в базу: {e}")
-
-def save_to_logfile(payload):
-    """Сохраняет данные в текстовый лог-файл"""
-    try:
-        with open("received_data.log", "a", encoding="utf-8") as f:
-            log_entry = {
-                "received_at": datetime.now().isoformat(),
-                "data": payload
-            }
-            f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
-    except Exception as e:
-        logger.error(f"❌ Ошибка записи в лог-файл: {e}")
-
-# =============================================================================
-# ГЛАВНАЯ ФУНКЦИЯ ПРИЁМНИКА
-# =============================================================================
-
-def main():
-    """Основная функция приёмника"""
-    logger.info("🚀 ЗАПУСК СИСТЕМЫ ПРИЁМА ДАННЫХ")
-    logger.info("=" * 50)
-    
-    client = None
-    
-    try:
-        # Инициализация базы данных
-        setup_central_database()
-        
-        # Создание MQTT клиента
-        client_id = f"receiver_{datetime.now().strftime('%H%M%S')}"
-        client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv311)
-        
-        # Назначение обработчиков событий
-        client.on_connect = on_connect
-        client.on_message = on_message
-        client.on_subscribe = on_subscribe
-        client.on_disconnect = on_disconnect
-
-        # Подключение к брокеру
-        logger.info(f"🔗 ПОДКЛЮЧЕНИЕ К БРОКЕРУ {MQTT_BROKER}...")
-        client.connect(MQTT_BROKER, 1883, 60)
-
-        # Запуск бесконечного цикла
-        logger.info("🔄 ЗАПУСК ПРОСЛУШИВАНИЯ...")
-        client.loop_forever()
-        
-    except KeyboardInterrupt:
-        logger.info("\n🛑 ПРИЁМНИК ОСТАНОВЛЕН ПОЛЬЗОВАТЕЛЕМ")
-    except Exception as e:
-        logger.error(f"💥 КРИТИЧЕСКАЯ ОШИБКА: {e}")
-    finally:
-        if client:
-            client.disconnect()
-        logger.info("🎯 ПРИЁМНИК ЗАВЕРШИЛ РАБОТУ")
-
-if __name__ == "__main__":
+import paho.mqtt.client as mqtt
+import json
+from datetime import datetime
+import logging
+import sqlite3
+import time
+
+from config import MQTT_BROKER, MQTT_PORT
+from config import WRITER_MAX_ROWS, WRITER_MAX_DELAY_MS
+from config import RECEIVE_WORKERS, RECEIVE_QUEUE_SIZE, RECEIVE_QUEUE_POLICY
+from config import RECEIVE_BLOCK_TIMEOUT, RECEIVE_STATS_INTERVAL
+from config import IDEMPOTENT_INGEST, DEDUP_CACHE_SIZE, ROLLUPS_ENABLED, TIMESTAMP_STORAGE
+from config import SQLITE_BUSY_TIMEOUT
+from config import JOURNAL_SEGMENT_MAX_MB, JOURNAL_SEGMENT_MAX_SECONDS, JOURNAL_FSYNC
+from config import JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPRESS, JOURNAL_BUFFER_KB
+from config import LOG_QUEUED, LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY
+from config import LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_RECEIVER_PORT
+from config import METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL
+from config import TRACE_ENABLED, TRACE_WINDOW, TRACE_REPORT_INTERVAL, TRACE_SNAPSHOT_FILE
+from message_format import unpack_message, is_delete
+from codec import decode_message
+from batch_writer import BatchWriter
+from ingest import enable_wal
+from receive_pipeline import ReceivePipeline
+from journal import JournalWriter
+from dedup import RecentIds, dedup_key, upsert_clause, create_origin_index
+from rollup import create_rollups, drop_rollup_triggers
+from central_query import create_query_indexes
+from timestamps import column_type, storage_mode, to_storage
+import hot_logging
+from hot_logging import MessageDetail, fields
+from metrics import REGISTRY, MetricsServer
+from tracing import TraceStats
+
+# =============================================================================
+# НАСТРОЙКА ЛОГИРОВАНИЯ
+# =============================================================================
+def setup_logging():
+    """Настраивает логирование для приёмника"""
+    hot_logging.setup_logging('logs/receiver.log', LOG_QUEUED)
+    return logging.getLogger(__name__)
+
+logger = setup_logging()
+# Подробности отдельных сообщений - выборочно, режим меняется на лету
+detail = MessageDetail(
+    LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY, LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+)
+
+# =============================================================================
+# НАСТРОЙКА ЦЕНТРАЛЬНОЙ БАЗЫ ДАННЫХ
+# =============================================================================
+
+def setup_central_database(database='central_storage.db', wal=False):
+    """Создает центральную базу данных для приема данных.
+
+    wal=True - базу пишут несколько процессов (multi_receiver.py): WAL и
+    ожидание блокировки другого писателя вместо ошибки.
+    """
+    global ts_mode
+    try:
+        conn = sqlite3.connect(database, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        if wal:
+            enable_wal(conn, SQLITE_BUSY_TIMEOUT)
+        cursor = conn.cursor()
+        
+        # Создаем таблицу для принятых данных
+        ts_type = column_type(TIMESTAMP_STORAGE)
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS received_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                original_id INTEGER,
+                sensor_id INTEGER NOT NULL,
+                value REAL NOT NULL,
+                timestamp {ts_type} NOT NULL,
+                received_at {ts_type} NOT NULL,
+                source TEXT,
+                version TEXT
+            )
+        ''')
+        conn.commit()
+        # Существующая таблица хранит время так, как была создана (или мигрирована)
+        ts_mode = storage_mode(conn, 'received_data')
+        if IDEMPOTENT_INGEST:
+            create_origin_index(conn, 'source')
+        if ROLLUPS_ENABLED:
+            create_rollups(conn)
+        else:
+            drop_rollup_triggers(conn)
+        create_query_indexes(conn)
+        logger.info("✅ Центральная база данных готова")
+        return conn
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка создания центральной базы: {e}")
+        raise
+
+# =============================================================================
+# MQTT НАСТРОЙКИ
+# =============================================================================
+
+MQTT_TOPIC = "my_school_project/sensor_data_v2"
+
+# =============================================================================
+# ОБРАБОТЧИКИ MQTT СОБЫТИЙ
+# =============================================================================
+
+def on_connect(client, userdata, flags, rc, properties=None):
+    """Обработчик подключения к брокеру"""
+    if rc == 0:
+        logger.info("✅ ПРИЁМНИК ПОДКЛЮЧЕН К MQTT БРОКЕРУ!")
+        client.subscribe(MQTT_TOPIC)
+        logger.info(f"📡 ПОДПИСКА НА ТОПИК: '{MQTT_TOPIC}'")
+        logger.info("🎧 ОЖИДАНИЕ ДАННЫХ...")
+    else:
+        logger.error(f"❌ ОШИБКА ПОДКЛЮЧЕНИЯ. Код: {rc}")
+
+def on_message(client, userdata, msg):
+    """Обработчик входящих сообщений: только ставит их в очередь обработки"""
+    pipeline.submit(msg.topic, msg.payload)
+
+def process_message(topic, raw_payload):
+    """Декодирует и сохраняет сообщение (выполняется в рабочем потоке)"""
+    try:
+        received_at = time.time()
+        # Декодируем сообщение (JSON или двоичное, одна запись или пакет)
+        payload = decode_message(raw_payload)
+        records = unpack_message(payload)
+        
+        accepted = []
+        for record in records:
+            if recent_ids and recent_ids.seen(dedup_key(record)):
+                # Повтор QoS 1 после переподключения - уже принят
+                continue
+            accepted.append(record)
+
+        # Удаления на отправителе только журналируются, строки в базе остаются
+        inserts = [record for record in accepted if not is_delete(record)]
+        # Трассировка идет с последней строкой: её фиксация завершает сообщение
+        trace = tracer.start(records, received_at) if tracer and inserts else None
+        for i, record in enumerate(inserts):
+            # Сохраняем в центральную базу
+            save_to_database(record, trace if i == len(inserts) - 1 else None)
+        
+        # Дублируем в журнал одной записью на сообщение
+        save_to_logfile(accepted)
+        
+        # Одна строка на сообщение-пакет вместо нескольких на каждое
+        logger.info("📨 " + fields(
+            topic=topic, source=records[0].get('source', 'unknown') if records else None,
+            records=len(records), new=len(accepted)
+        ))
+        if detail.enabled():
+            logger.info(f"├─ Данные: {json.dumps(payload, indent=2)}")
+
+    except json.JSONDecodeError as e:
+        logger.error(f"❌ ОШИБКА JSON: {e}")
+    except Exception as e:
+        logger.error(f"💥 ОШИБКА ОБРАБОТКИ: {e}")
+
+def on_subscribe(client, userdata, mid, granted_qos, properties=None):
+    """Обработчик успешной подписки"""
+    logger.info(f"✅ УСПЕШНАЯ ПОДПИСКА. QoS: {granted_qos[0]}")
+
+def on_disconnect(client, userdata, rc, properties=None):
+    """Обработчик отключения от брокера"""
+    if rc != 0:
+        logger.warning("⚠️  НЕОЖИДАННОЕ ОТКЛЮЧЕНИЕ ОТ БРОКЕРА")
+
+# =============================================================================
+# ФУНКЦИИ СОХРАНЕНИЯ ДАННЫХ
+# =============================================================================
+
+INSERT_SQL = '''
+    INSERT INTO received_data 
+    (original_id, sensor_id, value, timestamp, received_at, source, version) 
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+if IDEMPOTENT_INGEST:
+    INSERT_SQL += upsert_clause('source')
+
+# Недавно принятые записи, повторы отбрасываются до записи в базу
+recent_ids = RecentIds(DEDUP_CACHE_SIZE) if IDEMPOTENT_INGEST else None
+
+# Фоновый писатель, конвейер приёма, журнал и HTTP метрик, создаются в main()
+db_writer = None
+pipeline = None
+journal = None
+metrics_server = None
+tracer = None
+# Режим хранения времени в received_data, определяется в setup_central_database()
+ts_mode = TIMESTAMP_STORAGE
+
+def save_to_database(payload, trace=None):
+    """Ставит данные в очередь пакетной записи в SQLite базу"""
+    try:
+        db_writer.put((
+            payload.get('id'),
+            payload.get('sensor_id'),
+            payload.get('value'),
+            to_storage(payload.get('timestamp'), ts_mode),
+            to_storage(datetime.now(), ts_mode),
+            payload.get('source', 'unknown'),
+            payload.get('version', '1.0')
+        ), trace, dedup_key(payload) if recent_ids else None)
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка сохранения в базу: {e}")
+
+def open_tracer(name="receiver"):
+    """Сбор задержек по этапам (TRACE_ENABLED) или None"""
+    if not TRACE_ENABLED:
+        return None
+    return TraceStats(
+        name, TRACE_WINDOW, TRACE_REPORT_INTERVAL, TRACE_SNAPSHOT_FILE.format(name=name)
+    ).run_reports()
+
+def open_journal(path="received_data.log"):
+    """Журнал принятых записей с настройками из config.py"""
+    return JournalWriter(
+        path, JOURNAL_SEGMENT_MAX_MB * 1024 * 1024, JOURNAL_SEGMENT_MAX_SECONDS,
+        JOURNAL_FSYNC, JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPRESS, JOURNAL_BUFFER_KB * 1024
+    )
+
+def save_to_logfile(records):
+    """Добавляет записи сообщения в журнал received_data.log"""
+    try:
+        received_at = datetime.now().isoformat()
+        journal.append([{"received_at": received_at, "data": record} for record in records])
+    except Exception as e:
+        logger.error(f"❌ Ошибка записи в лог-файл: {e}")
+
+# =============================================================================
+# ГЛАВНАЯ ФУНКЦИЯ ПРИЁМНИКА
+# =============================================================================
+
+def main():
+    """Основная функция приёмника"""
+    global db_writer, pipeline, journal, metrics_server, tracer
+    logger.info("🚀 ЗАПУСК СИСТЕМЫ ПРИЁМА ДАННЫХ")
+    logger.info("=" * 50)
+    
+    client = None
+    
+    try:
+        # Инициализация базы данных
+        setup_central_database().close()
+        journal = open_journal()
+        tracer = open_tracer()
+        db_writer = BatchWriter(
+            'central_storage.db', INSERT_SQL, WRITER_MAX_ROWS, WRITER_MAX_DELAY_MS,
+            on_commit=tracer.committed if tracer else None,
+            on_reject=recent_ids.forget if recent_ids else None
+        ).start()
+        pipeline = ReceivePipeline(
+            process_message, RECEIVE_WORKERS, RECEIVE_QUEUE_SIZE,
+            RECEIVE_QUEUE_POLICY, RECEIVE_BLOCK_TIMEOUT, RECEIVE_STATS_INTERVAL
+        ).start()
+        if METRICS_ENABLED:
+            metrics_server = MetricsServer(
+                REGISTRY, METRICS_HOST, METRICS_RECEIVER_PORT,
+                METRICS_SNAPSHOT_FILE.format(name='receiver'), METRICS_SNAPSHOT_INTERVAL
+            ).start()
+        
+        # Создание MQTT клиента
+        client_id = f"receiver_{datetime.now().strftime('%H%M%S')}"
+        client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv311)
+        
+        # Назначение обработчиков событий
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.on_subscribe = on_subscribe
+        client.on_disconnect = on_disconnect
+
+        # Подключение к брокеру
+        logger.info(f"🔗 ПОДКЛЮЧЕНИЕ К БРОКЕРУ {MQTT_BROKER}...")
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+
+        # Запуск бесконечного цикла
+        logger.info("🔄 ЗАПУСК ПРОСЛУШИВАНИЯ...")
+        client.loop_forever()
+        
+    except KeyboardInterrupt:
+        logger.info("\n🛑 ПРИЁМНИК ОСТАНОВЛЕН ПОЛЬЗОВАТЕЛЕМ")
+    except Exception as e:
+        logger.error(f"💥 КРИТИЧЕСКАЯ ОШИБКА: {e}")
+    finally:
+        if client:
+            client.disconnect()
+        if pipeline:
+            # Обрабатываем сообщения, уже принятые в очередь
+            pipeline.stop()
+        if db_writer:
+            # Дописываем на диск всё, что осталось в очереди
+            db_writer.close()
+        if journal:
+            journal.close()
+        if tracer:
+            tracer.close()
+        if metrics_server:
+            metrics_server.stop()
+        if recent_ids:
+            logger.info(f"♻️  Отброшено повторов: {recent_ids.duplicates}")
+        logger.info("🎯 ПРИЁМНИК ЗАВЕРШИЛ РАБОТУ")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
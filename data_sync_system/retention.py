@@ -0,0 +1,194 @@
+# retention.py - Очистка доставленных записей на отправителе и возврат места на диске
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+from timestamps import storage_mode, to_storage
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA auto_vacuum: 0 - NONE, 1 - FULL, 2 - INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+def enable_incremental_vacuum(conn, database):
+    """Включает auto_vacuum=INCREMENTAL для новой базы.
+
+    Для пустой базы режим просто запоминается до создания таблиц.
+    Существующую SQLite переводит только полный VACUUM, который блокирует
+    весь файл, поэтому здесь он не выполняется: без него очистка удаляет
+    строки, но место остается в базе для новых. Перевод - отдельной
+    командой python retention.py <база> в окно обслуживания.
+    Возвращает True, если режим INCREMENTAL действует.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        return True
+    if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+        logger.info(
+            f"ℹ️  {database}: auto_vacuum не INCREMENTAL, освобожденное место не вернется "
+            f"файловой системе (перевод: python retention.py {database})"
+        )
+        return False
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    return True
+
+def convert_to_incremental(database, busy_timeout=30):
+    """Переводит существующую базу в auto_vacuum=INCREMENTAL полным VACUUM.
+
+    VACUUM переписывает весь файл и держит его заблокированным; отправитель
+    на это время лучше остановить.
+    """
+    conn = sqlite3.connect(database, timeout=busy_timeout)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            logger.info(f"✅ {database}: auto_vacuum уже INCREMENTAL")
+            return
+        logger.info(f"🧹 Перевод {database} в auto_vacuum=INCREMENTAL (VACUUM)...")
+        started = time.monotonic()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        logger.info(f"✅ {database}: VACUUM за {time.monotonic() - started:.1f} с")
+    finally:
+        conn.close()
+
+# =============================================================================
+# ОЧИСТКА
+# =============================================================================
+
+class Retention:
+    """Удаляет доставленные строки sensor_data небольшими транзакциями.
+
+    Строка удаляется, если она доставлена и либо старше max_age_hours,
+    либо не входит в max_delivered_rows последних доставленных. Доставленной
+    считается строка с sent = 1, с id не больше водяного знака или, в режиме
+    outbox, строка без неотправленных изменений в sensor_outbox. Освободившиеся
+    страницы возвращаются файловой системе через PRAGMA incremental_vacuum
+    по vacuum_pages за шаг, поэтому база не блокируется надолго.
+    """
+
+    def __init__(self, conn, database, max_age_hours=24, max_delivered_rows=100000,
+                 batch_rows=1000, vacuum_pages=256, interval=300):
+        self.conn = conn
+        self.database = database
+        self.max_age = timedelta(hours=max_age_hours)
+        self.max_delivered_rows = max_delivered_rows
+        self.batch_rows = batch_rows
+        self.vacuum_pages = vacuum_pages
+        self.interval = interval
+        self._last_run = None
+
+    def maybe_purge(self, watermark=None, outbox=False):
+        """Запускает purge(), если с прошлой очистки прошло interval секунд"""
+        now = time.monotonic()
+        if self._last_run is not None and now - self._last_run < self.interval:
+            return None
+        self._last_run = now
+        return self.purge(watermark, outbox)
+
+    def purge(self, watermark=None, outbox=False):
+        """Удаляет доставленные строки и возвращает место; возвращает отчёт"""
+        started = time.monotonic()
+        file_before = self._file_size()
+        condition, params = self._condition(watermark, outbox)
+
+        deleted = 0
+        while True:
+            with self.conn:
+                # Захватываем запись сразу: между чтением seq и удалением никто не пишет
+                self.conn.execute("BEGIN IMMEDIATE")
+                if outbox:
+                    (last_seq,) = self.conn.execute(
+                        "SELECT COALESCE(MAX(seq), 0) FROM sensor_outbox"
+                    ).fetchone()
+                count = self.conn.execute(f'''
+                    DELETE FROM sensor_data WHERE id IN (
+                        SELECT id FROM sensor_data WHERE {condition} ORDER BY id LIMIT ?
+                    )
+                ''', params + (self.batch_rows,)).rowcount
+                if outbox:
+                    # Триггер захвата изменений записал удаления очистки - это не изменения данных
+                    self.conn.execute(
+                        "DELETE FROM sensor_outbox WHERE seq > ? AND op = 'D'", (last_seq,)
+                    )
+            deleted += count
+            if count < self.batch_rows:
+                break
+
+        freed_pages = self._incremental_vacuum()
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        report = {
+            'deleted_rows': deleted,
+            'freed_bytes': freed_pages * page_size,
+            'file_before': file_before,
+            'file_after': self._file_size(),
+            'seconds': round(time.monotonic() - started, 3),
+        }
+        if deleted or freed_pages:
+            logger.info(
+                f"🧹 Очистка: удалено {deleted} доставленных строк, освобождено "
+                f"{report['freed_bytes'] // 1024} КБ, размер базы "
+                f"{report['file_before'] // 1024} -> {report['file_after'] // 1024} КБ "
+                f"за {report['seconds']} с"
+            )
+        return report
+
+    def _condition(self, watermark, outbox):
+        if outbox:
+            delivered = "id NOT IN (SELECT row_id FROM sensor_outbox)"
+            delivered_params = ()
+        elif watermark is not None:
+            delivered = "id <= ?"
+            delivered_params = (watermark,)
+        else:
+            delivered = "sent = 1"
+            delivered_params = ()
+
+        # Граница по количеству: всё, что старше max_delivered_rows последних доставленных
+        row = self.conn.execute(
+            f"SELECT id FROM sensor_data WHERE {delivered} ORDER BY id DESC LIMIT 1 OFFSET ?",
+            delivered_params + (self.max_delivered_rows,)
+        ).fetchone()
+        size_bound = row[0] if row else 0
+
+        cutoff = to_storage(datetime.now() - self.max_age, storage_mode(self.conn, 'sensor_data'))
+        return (
+            f"{delivered} AND (timestamp < ? OR id <= ?)",
+            delivered_params + (cutoff, size_bound)
+        )
+
+    def _incremental_vacuum(self):
+        """Возвращает свободные страницы порциями; число освобожденных страниц"""
+        freed = 0
+        while True:
+            free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                return freed
+            self.conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+            left = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if left >= free:
+                # auto_vacuum не INCREMENTAL: страницы останутся в базе для новых строк
+                return freed
+            freed += free - left
+
+    def _file_size(self):
+        try:
+            return os.path.getsize(self.database)
+        except OSError:
+            return 0
+
+# =============================================================================
+# ЗАПУСК ИЗ КОМАНДНОЙ СТРОКИ
+# =============================================================================
+
+def main():
+    """python retention.py <база> - однократный перевод базы в auto_vacuum=INCREMENTAL"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if len(sys.argv) < 2:
+        print("Использование: python retention.py <база>")
+        sys.exit(1)
+    convert_to_incremental(sys.argv[1])
+
+if __name__ == "__main__":
+    main()
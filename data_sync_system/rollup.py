@@ -0,0 +1,282 @@
+# rollup.py - Агрегаты по датчикам (минута, час, день), обновляемые при приёме
+import logging
+import sqlite3
+import sys
+from datetime import datetime
+
+from timestamps import TS_MICROS, column_type, storage_mode, to_iso
+
+logger = logging.getLogger(__name__)
+
+# Гранулярность -> длина префикса ISO времени 'YYYY-MM-DDTHH:MM'
+GRANULARITIES = {
+    'minute': 16,
+    'hour': 13,
+    'day': 10,
+}
+ROLLUP_TABLES = {name: f'rollup_{name}' for name in GRANULARITIES}
+
+ROLLUP_TRIGGERS = (
+    'trg_received_data_rollup_insert',
+    'trg_received_data_rollup_update',
+)
+
+# Позиция прерываемого перестроения агрегатов (rebuild_rollups)
+_REBUILD_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS rollup_rebuild (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        position INTEGER NOT NULL,
+        target INTEGER NOT NULL,
+        started_at TEXT NOT NULL
+    )
+'''
+
+# Слияние новой порции с уже накопленной строкой агрегата
+_MERGE_SQL = '''
+    ON CONFLICT(sensor_id, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        min_value = MIN(min_value, excluded.min_value),
+        max_value = MAX(max_value, excluded.max_value),
+        sum_value = sum_value + excluded.sum_value,
+        last_value = CASE WHEN excluded.last_timestamp >= last_timestamp
+                          THEN excluded.last_value ELSE last_value END,
+        last_timestamp = MAX(last_timestamp, excluded.last_timestamp)
+'''
+
+def bucket_of(timestamp, granularity):
+    """Начало интервала в виде префикса ISO строки ('2024-01-01T10:05')"""
+    return to_iso(timestamp).replace(' ', 'T')[:GRANULARITIES[granularity]]
+
+def _bucket_sql(column, granularity, mode):
+    if mode == TS_MICROS:
+        text = f"strftime('%Y-%m-%dT%H:%M', {column} / 1000000, 'unixepoch', 'localtime')"
+    else:
+        text = f"replace({column}, ' ', 'T')"
+    return f"substr({text}, 1, {GRANULARITIES[granularity]})"
+
+def _bucket_rows_sql(name, mode):
+    """Условие на строки received_data интервала агрегата OLD-строки.
+
+    Диапазон по времени (сутки OLD.timestamp с запасом) дает индексу
+    (sensor_id, timestamp) сузить поиск, точное совпадение - по bucket.
+    """
+    if mode == TS_MICROS:
+        # Местные сутки - не дольше 25 часов, запас - двое суток в каждую сторону
+        window = "OLD.timestamp - 172800000000 AND OLD.timestamp + 172800000000"
+    else:
+        # Все символы ISO времени меньше '~'
+        window = "substr(OLD.timestamp, 1, 10) AND substr(OLD.timestamp, 1, 10) || '~'"
+    return (
+        f"sensor_id = OLD.sensor_id AND timestamp BETWEEN {window} "
+        f"AND {_bucket_sql('timestamp', name, mode)} = {_bucket_sql('OLD.timestamp', name, mode)}"
+    )
+
+def _upsert_sql(table, values):
+    return f'''
+        INSERT INTO {table}
+        (sensor_id, bucket, count, min_value, max_value, sum_value, last_value, last_timestamp)
+        VALUES ({values})
+        {_MERGE_SQL}
+    '''
+
+# =============================================================================
+# СХЕМА И ТРИГГЕРЫ
+# =============================================================================
+
+def create_rollups(conn):
+    """Создает таблицы агрегатов и триггеры на received_data.
+
+    Триггеры срабатывают внутри той же транзакции, что и пакетная вставка
+    BatchWriter, и только для реально вставленных строк: повторы,
+    отброшенные уникальным индексом, в агрегаты не попадают. Триггеры
+    пересоздаются при каждом вызове, чтобы база получила текущую версию.
+    """
+    # Интервалы одинаковы для ISO строк и микросекунд: и те, и другие - в местном времени
+    mode = storage_mode(conn, 'received_data')
+    for table in ROLLUP_TABLES.values():
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                sensor_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                min_value REAL,
+                max_value REAL,
+                sum_value REAL,
+                last_value REAL,
+                last_timestamp {column_type(mode)},
+                PRIMARY KEY (sensor_id, bucket)
+            ) WITHOUT ROWID
+        ''')
+
+    # Триггер изменения читает позицию перестроения (rebuild_rollups)
+    conn.execute(_REBUILD_TABLE_SQL)
+
+    exists = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+        (ROLLUP_TRIGGERS[0],)
+    ).fetchone()[0]
+    for trigger in ROLLUP_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for sql in rollup_triggers_sql(mode):
+        conn.execute(sql)
+    conn.commit()
+
+    if not exists and conn.execute("SELECT 1 FROM received_data LIMIT 1").fetchone():
+        logger.warning("⚠️  Агрегаты включены для непустой базы, постройте их: python rollup.py <база>")
+
+def rollup_triggers_sql(mode):
+    """CREATE TRIGGER для обновления агрегатов при вставке и изменении received_data"""
+    insert_new = ''.join(
+        _upsert_sql(
+            table,
+            f"NEW.sensor_id, {_bucket_sql('NEW.timestamp', name, mode)}, 1, "
+            "NEW.value, NEW.value, NEW.value, NEW.value, NEW.timestamp"
+        ) + ';'
+        for name, table in ROLLUP_TABLES.items()
+    )
+    insert_trigger = f'''
+        CREATE TRIGGER {ROLLUP_TRIGGERS[0]} AFTER INSERT ON received_data
+        BEGIN {insert_new} END
+    '''
+
+    # Изменение записи (outbox 'U'): старое значение вычитается из count и sum.
+    # min/max и последнее значение вычесть нельзя - после слияния новой версии
+    # они пересчитываются по строкам интервала старой версии в received_data
+    remove_old = ''.join(
+        f'''
+        UPDATE {table} SET count = count - 1, sum_value = sum_value - OLD.value
+        WHERE sensor_id = OLD.sensor_id AND bucket = {_bucket_sql('OLD.timestamp', name, mode)};
+        DELETE FROM {table}
+        WHERE sensor_id = OLD.sensor_id AND bucket = {_bucket_sql('OLD.timestamp', name, mode)}
+          AND count <= 0;
+        '''
+        for name, table in ROLLUP_TABLES.items()
+    )
+    recompute_old = ''.join(
+        f'''
+        UPDATE {table} SET
+            (min_value, max_value) = (
+                SELECT MIN(value), MAX(value) FROM received_data
+                WHERE {_bucket_rows_sql(name, mode)}
+            ),
+            (last_value, last_timestamp) = (
+                SELECT value, timestamp FROM received_data
+                WHERE {_bucket_rows_sql(name, mode)}
+                ORDER BY timestamp DESC, id DESC LIMIT 1
+            )
+        WHERE sensor_id = OLD.sensor_id AND bucket = {_bucket_sql('OLD.timestamp', name, mode)};
+        '''
+        for name, table in ROLLUP_TABLES.items()
+    )
+    # Строку, которую идущее перестроение еще не добавило, оно прочитает
+    # уже новой версией: вычитать старую из агрегатов нельзя
+    update_trigger = f'''
+        CREATE TRIGGER {ROLLUP_TRIGGERS[1]}
+        AFTER UPDATE OF sensor_id, value, timestamp ON received_data
+        WHEN NOT EXISTS (
+            SELECT 1 FROM rollup_rebuild WHERE OLD.id > position AND OLD.id <= target
+        )
+        BEGIN {remove_old} {insert_new} {recompute_old} END
+    '''
+    return insert_trigger, update_trigger
+
+def drop_rollup_triggers(conn):
+    """Отключает обновление агрегатов при приёме (таблицы остаются)"""
+    for trigger in ROLLUP_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.commit()
+
+# =============================================================================
+# ДОБАВЛЕНИЕ СТРОК И ПЕРЕСТРОЕНИЕ
+# =============================================================================
+
+def merge_rows(conn, rows):
+    """Добавляет в агрегаты строки (sensor_id, value, timestamp) без коммита"""
+    for name, table in ROLLUP_TABLES.items():
+        groups = {}
+        for sensor_id, value, timestamp in rows:
+            key = (sensor_id, bucket_of(timestamp, name))
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [1, value, value, value, value, timestamp]
+                continue
+            group[0] += 1
+            group[1] = min(group[1], value)
+            group[2] = max(group[2], value)
+            group[3] += value
+            if timestamp >= group[5]:
+                group[4], group[5] = value, timestamp
+        conn.executemany(
+            _upsert_sql(table, "?, ?, ?, ?, ?, ?, ?, ?"),
+            [key + tuple(group) for key, group in groups.items()]
+        )
+
+def rebuild_rollups(conn, batch_rows=50000):
+    """Пересчитывает агрегаты из received_data порциями по batch_rows строк.
+
+    Позиция сохраняется в rollup_rebuild после каждой порции, поэтому
+    прерванное перестроение продолжается с места остановки. Строки,
+    вставленные во время перестроения, учитывают триггеры: пересчитываются
+    только id не больше максимального на момент старта. Чтение порции и
+    слияние идут в одной транзакции BEGIN IMMEDIATE: приём не может
+    изменить строки порции между ними, а изменения еще не прочитанных
+    строк триггер пропускает (см. rollup_triggers_sql).
+    """
+    conn.execute(_REBUILD_TABLE_SQL)
+    conn.commit()
+    state = conn.execute("SELECT position, target FROM rollup_rebuild").fetchone()
+    if state:
+        position, target = state
+        logger.info(f"🔁 Продолжаем перестроение агрегатов с id {position} до {target}")
+    else:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            position = 0
+            target = conn.execute("SELECT COALESCE(MAX(id), 0) FROM received_data").fetchone()[0]
+            for table in ROLLUP_TABLES.values():
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute(
+                "INSERT INTO rollup_rebuild (id, position, target, started_at) VALUES (1, ?, ?, ?)",
+                (position, target, datetime.now().isoformat())
+            )
+        logger.info(f"🔁 Перестроение агрегатов: строк до id {target}")
+
+    while position < target:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute('''
+                SELECT id, sensor_id, value, timestamp FROM received_data
+                WHERE id > ? AND id <= ? ORDER BY id LIMIT ?
+            ''', (position, target, batch_rows)).fetchall()
+            if not rows:
+                break
+            merge_rows(conn, [row[1:] for row in rows])
+            position = rows[-1][0]
+            conn.execute("UPDATE rollup_rebuild SET position = ?", (position,))
+        logger.info(f"📊 Агрегаты пересчитаны до id {position} из {target}")
+
+    with conn:
+        conn.execute("DELETE FROM rollup_rebuild")
+    logger.info("✅ Перестроение агрегатов завершено")
+
+# =============================================================================
+# ЗАПУСК ИЗ КОМАНДНОЙ СТРОКИ
+# =============================================================================
+
+def main():
+    """python rollup.py [база] - перестраивает агрегаты центральной базы"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    from config import ROLLUP_REBUILD_BATCH
+
+    database = sys.argv[1] if len(sys.argv) > 1 else 'central_storage.db'
+    conn = sqlite3.connect(database)
+    try:
+        create_rollups(conn)
+        rebuild_rollups(conn, ROLLUP_REBUILD_BATCH)
+    except KeyboardInterrupt:
+        logger.info("\n🛑 Перестроение прервано, следующий запуск продолжит его")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,280 +1,416 @@
-import sqlite3
-import time
-import json
-from datetime import datetime
-import paho.mqtt.client as mqtt
-import logging
-import sys
-import os
-
-# =============================================================================
-# НАСТРОЙКА ЛОГИРОВАНИЯ
-# =============================================================================
-def setup_logging():
-    """Настраивает логирование для системы"""
-    # Создаем папку для логов если её нет
-    os.makedirs('logs', exist_ok=True)
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('logs/sync_system.log', encoding='utf-8'),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    return logging.getLogger(__name__)
-
-logger = setup_logging()
-
-# =============================================================================
-# 1. СОЗДАНИЕ И ЗАПОЛНЕНИЕ БАЗЫ ДАННЫХ
-# =============================================================================
-
-def setup_database():
-    """Создает и наполняет базу данных тестовыми данными"""
-    try:
-        # Подключаемся к базе данных
-        conn = sqlite3.connect('local_sensor_data.db', check_same_thread=False)
-        cursor = conn.cursor()
-
-        # Создаем таблицу для данных с датчиков
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sensor_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sensor_id INTEGER NOT NULL,
-                value REAL NOT NULL,
-                timestamp TEXT NOT NULL,
-                sent INTEGER DEFAULT 0,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-
-        # Проверяем, есть ли данные в таблице
-        cursor.execute("SELECT COUNT(*) FROM sensor_data WHERE sent = 0")
-        unsent_count = cursor.fetchone()[0]
-        
-        if unsent_count == 0:
-            logger.info("Добавляем тестовые данные в базу...")
-            test_data = [
-                (1, 23.5, datetime.now().isoformat(), 0),
-                (2, 18.9, datetime.now().isoformat(), 0),
-                (1, 24.1, datetime.now().isoformat(), 0),
-                (3, 19.7, datetime.now().isoformat(), 0),
-                (2, 22.3, datetime.now().isoformat(), 0),
-            ]
-            cursor.executemany(
-                "INSERT INTO sensor_data (sensor_id, value, timestamp, sent) VALUES (?, ?, ?, ?)", 
-                test_data
-            )
-            conn.commit()
-            logger.info("✅ Добавлено 5 тестовых записей")
-        else:
-            logger.info(f"📊 В базе найдено {unsent_count} неотправленных записей")
-
-        return conn, cursor
-
-    except Exception as e:
-        logger.error(f"❌ Ошибка при создании базы данных: {e}")
-        raise
-
-# =============================================================================
-# 2. НАСТРОЙКА MQTT КЛИЕНТА
-# =============================================================================
-
-def setup_mqtt_client():
-    """Настраивает и подключает MQTT клиента"""
-    
-    # Настройки MQTT
-    MQTT_BROKER = "broker.hivemq.com"
-    MQTT_PORT = 1883
-    MQTT_TOPIC = "my_school_project/sensor_data_v2"
-    
-    # Создаем клиента MQTT с уникальным ID
-    client_id = f"sender_{datetime.now().strftime('%H%M%S')}"
-    client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv311)
-    
-    # Словарь для отслеживания статуса доставки
-    delivery_status = {}
-
-    def on_connect(client, userdata, flags, rc, properties=None):
-        """Обработчик подключения к брокеру"""
-        if rc == 0:
-            logger.info("✅ Успешно подключились к MQTT брокеру!")
-            logger.info(f"📡 Брокер: {MQTT_BROKER}:{MQTT_PORT}")
-            logger.info(f"🎯 Топик: {MQTT_TOPIC}")
-        else:
-            error_codes = {
-                1: "неверная версия протокола",
-                2: "неверный идентификатор клиента", 
-                3: "сервер недоступен",
-                4: "неверные логин/пароль",
-                5: "ошибка авторизации"
-            }
-            error_msg = error_codes.get(rc, f"неизвестная ошибка (код {rc})")
-            logger.error(f"❌ Ошибка подключения: {error_msg}")
-
-    def on_publish(client, userdata, mid, properties=None):
-        """Обработчик подтверждения публикации"""
-        delivery_status[mid] = True
-        logger.debug(f"📨 Подтверждение доставки для сообщения ID {mid}")
-
-    def on_disconnect(client, userdata, rc, properties=None):
-        """Обработчик отключения от брокера"""
-        if rc != 0:
-            logger.warning("⚠️  Неожиданное отключение от брокера. Попытка переподключения...")
-
-    # Назначаем обработчики событий
-    client.on_connect = on_connect
-    client.on_publish = on_publish
-    client.on_disconnect = on_disconnect
-
-    # Подключаемся к брокеру
-    logger.info(f"🔗 Подключаемся к MQTT брокеру {MQTT_BROKER}...")
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        # Запускаем фоновый поток
-        client.loop_start()
-        # Даем время на установление соединения
-        time.sleep(2)
-        return client, delivery_status, MQTT_TOPIC
-    except Exception as e:
-        logger.error(f"❌ Не удалось подключиться к MQTT брокеру: {e}")
-        raise
-
-# =============================================================================
-# 3. ФУНКЦИЯ СИНХРОНИЗАЦИИ ДАННЫХ
-# =============================================================================
-
-def sync_data(conn, cursor, client, delivery_status, MQTT_TOPIC):
-    """Основная функция синхронизации данных"""
-    try:
-        # Получаем новые записи для отправки
-        cursor.execute("""
-            SELECT id, sensor_id, value, timestamp 
-            FROM sensor_data 
-            WHERE sent = 0 
-            ORDER BY id
-        """)
-        new_records = cursor.fetchall()
-
-        if not new_records:
-            logger.info("💤 Новых данных для отправки нет")
-            return True
-
-        logger.info(f"📦 Найдено {len(new_records)} новых записей")
-
-        success_count = 0
-        for record in new_records:
-            record_id, sensor_id, value, timestamp = record
-
-            # Подготавливаем данные для отправки
-            payload = {
-                "id": record_id,
-                "sensor_id": sensor_id,
-                "value": value,
-                "timestamp": timestamp,
-                "source": "local_sqlite",
-                "version": "2.0"
-            }
-            json_payload = json.dumps(payload, ensure_ascii=False)
-
-            # Сбрасываем флаг доставки
-            message_mid = None
-
-            logger.info(f"🚀 Отправляем запись ID {record_id} (Датчик {sensor_id}: {value}°C)")
-            
-            # Публикуем сообщение с гарантией доставки
-            msg_info = client.publish(MQTT_TOPIC, json_payload, qos=1)
-            
-            if msg_info.rc != mqtt.MQTT_ERR_SUCCESS:
-                logger.error(f"❌ Ошибка публикации записи ID {record_id}")
-                continue
-                
-            message_mid = msg_info.mid
-            delivery_status[message_mid] = False
-
-            # Ждем подтверждения (макс. 10 секунд)
-            wait_time = 0
-            while not delivery_status.get(message_mid, False) and wait_time < 10:
-                time.sleep(0.5)
-                wait_time += 0.5
-
-            if delivery_status.get(message_mid, False):
-                # Помечаем запись как отправленную
-                cursor.execute("UPDATE sensor_data SET sent = 1 WHERE id = ?", (record_id,))
-                conn.commit()
-                success_count += 1
-                logger.info(f"✅ Запись ID {record_id} доставлена")
-                
-                # Очищаем словарь статусов
-                delivery_status.pop(message_mid, None)
-            else:
-                logger.warning(f"⚠️  Таймаут доставки записи ID {record_id}")
-                return False
-
-        logger.info(f"🎉 Успешно отправлено {success_count} из {len(new_records)} записей")
-        return True
-
-    except Exception as e:
-        logger.error(f"💥 Ошибка синхронизации: {e}")
-        return False
-
-# =============================================================================
-# 4. ГЛАВНАЯ ФУНКЦИЯ
-# =============================================================================
-
-def main():
-    """Основная функция программы"""
-    logger.info("🚀 ЗАПУСК СИСТЕМЫ ПЕРЕДАЧИ ДАННЫХ")
-    logger.info("=" * 50)
-    
-    conn = None
-    client = None
-    
-    try:
-        # Инициализируем компоненты системы
-        conn, cursor = setup_database()
-        client, delivery_status, MQTT_TOPIC = setup_mqtt_client()
-        
-        # Основной цикл работы
-        cycle_count = 0
-        logger.info("\n🔄 Служба синхронизации запущена")
-        logger.info("⏰ Интервал проверки: 30 секунд")
-        logger.info("⏹️  Для остановки нажмите Ctrl+C\n")
-        
-        while True:
-            cycle_count += 1
-            logger.info(f"\n{'='*30}")
-            logger.info(f"ЦИКЛ СИНХРОНИЗАЦИИ #{cycle_count}")
-            logger.info(f"{'='*30}")
-            
-            sync_success = sync_data(conn, cursor, client, delivery_status, MQTT_TOPIC)
-            
-            if sync_success:
-                logger.info("✅ Цикл завершен успешно")
-            else:
-                logger.warning("⚠️  В цикле возникли проблемы")
-            
-            logger.info("⏳ Ожидание 30 секунд...")
-            time.sleep(30)
-            
-    except KeyboardInterrupt:
-        logger.info("\n🛑 ОСТАНОВКА СИСТЕМЫ ПОЛЬЗОВАТЕЛЕМ")
-    except Exception as e:
-        logger.error(f"💥 КРИТИЧЕСКАЯ ОШИБКА: {e}")
-    finally:
-        # Корректное завершение работы
-        logger.info("\n🔚 Завершение работы системы...")
-        if client:
-            client.loop_stop()
-            client.disconnect()
-            logger.info("✅ MQTT клиент отключен")
-        if conn:
-            conn.close()
-            logger.info("✅ База данных закрыта")
-        logger.info("🎯 СИСТЕМА ОСТАНОВЛЕНА")
-
-if __name__ == "__main__":
+import sqlite3
+import time
+from datetime import datetime
+import paho.mqtt.client as mqtt
+import logging
+
+from config import MQTT_BROKER, MQTT_PORT
+from config import PUBLISH_WINDOW, PUBLISH_ACK_TIMEOUT, BATCH_MAX_RECORDS, BATCH_MAX_DELAY_MS
+from config import UNSENT_PAGE_SIZE, DELIVERY_TRACKING
+from config import SYNC_MIN_INTERVAL, SYNC_MAX_INTERVAL, SYNC_WATCH_INTERVAL, SYNC_NOTIFY_PORT
+from config import TIMESTAMP_STORAGE, SQLITE_WAL, SQLITE_BUSY_TIMEOUT
+from config import RETENTION_ENABLED, RETENTION_MAX_AGE_HOURS, RETENTION_MAX_DELIVERED_ROWS
+from config import RETENTION_BATCH_ROWS, RETENTION_VACUUM_PAGES, RETENTION_INTERVAL
+from config import LOG_QUEUED, LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY
+from config import LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_SENDER_PORT
+from config import METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL
+from config import TRACE_ENABLED
+from publisher import PipelinedPublisher, DeliveryTimeout
+from message_format import BatchAccumulator
+from codec import encode_message
+from ack_tracker import AckWatermark, TRACKING_WATERMARK, id_ranges
+from sync_trigger import SyncTrigger
+from timestamps import column_type, storage_mode, to_storage, to_iso
+from retention import Retention, enable_incremental_vacuum
+from ingest import enable_wal
+import hot_logging
+from hot_logging import MessageDetail, fields
+from metrics import REGISTRY, MetricsServer
+from tracing import trace_header
+
+# =============================================================================
+# НАСТРОЙКА ЛОГИРОВАНИЯ
+# =============================================================================
+def setup_logging():
+    """Настраивает логирование для системы"""
+    hot_logging.setup_logging('logs/sync_system.log', LOG_QUEUED)
+    return logging.getLogger(__name__)
+
+logger = setup_logging()
+# Подробности отдельных записей - выборочно, режим меняется на лету
+detail = MessageDetail(
+    LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY, LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+)
+
+# =============================================================================
+# 1. СОЗДАНИЕ И ЗАПОЛНЕНИЕ БАЗЫ ДАННЫХ
+# =============================================================================
+
+def setup_database(database='local_sensor_data.db'):
+    """Создает и наполняет базу данных тестовыми данными"""
+    try:
+        # Подключаемся к базе данных
+        conn = sqlite3.connect(database, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT)
+        cursor = conn.cursor()
+        # Место после очистки доставленных записей возвращается постепенно
+        enable_incremental_vacuum(conn, database)
+        if SQLITE_WAL:
+            # Запись показаний не блокирует выборку неотправленных
+            enable_wal(conn, SQLITE_BUSY_TIMEOUT)
+
+        # Создаем таблицу для данных с датчиков
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS sensor_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sensor_id INTEGER NOT NULL,
+                value REAL NOT NULL,
+                timestamp {column_type(TIMESTAMP_STORAGE)} NOT NULL,
+                sent INTEGER DEFAULT 0,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Водяной знак доставки для режима DELIVERY_TRACKING = 'watermark'
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_checkpoint (
+                destination TEXT PRIMARY KEY,
+                acked_id INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        # Частичный индекс по неотправленным записям: поиск не зависит от числа отправленных
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sensor_data_unsent ON sensor_data (id) WHERE sent = 0"
+        )
+        conn.commit()
+
+        # Проверяем, есть ли данные в таблице
+        cursor.execute("SELECT COUNT(*) FROM sensor_data WHERE sent = 0")
+        unsent_count = cursor.fetchone()[0]
+        
+        if unsent_count == 0:
+            logger.info("Добавляем тестовые данные в базу...")
+            ts_mode = storage_mode(conn, 'sensor_data')
+            test_data = [
+                (1, 23.5, to_storage(datetime.now(), ts_mode), 0),
+                (2, 18.9, to_storage(datetime.now(), ts_mode), 0),
+                (1, 24.1, to_storage(datetime.now(), ts_mode), 0),
+                (3, 19.7, to_storage(datetime.now(), ts_mode), 0),
+                (2, 22.3, to_storage(datetime.now(), ts_mode), 0),
+            ]
+            cursor.executemany(
+                "INSERT INTO sensor_data (sensor_id, value, timestamp, sent) VALUES (?, ?, ?, ?)", 
+                test_data
+            )
+            conn.commit()
+            logger.info("✅ Добавлено 5 тестовых записей")
+        else:
+            logger.info(f"📊 В базе найдено {unsent_count} неотправленных записей")
+
+        return conn, cursor
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка при создании базы данных: {e}")
+        raise
+
+# =============================================================================
+# 2. НАСТРОЙКА MQTT КЛИЕНТА
+# =============================================================================
+
+def setup_mqtt_client():
+    """Настраивает и подключает MQTT клиента"""
+    
+    # Настройки MQTT (брокер и порт - из config.py)
+    MQTT_TOPIC = "my_school_project/sensor_data_v2"
+    
+    # Создаем клиента MQTT с уникальным ID
+    client_id = f"sender_{datetime.now().strftime('%H%M%S')}"
+    client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv311)
+    
+    # Конвейер публикации: до PUBLISH_WINDOW сообщений ждут PUBACK одновременно
+    publisher = PipelinedPublisher(client, MQTT_TOPIC, PUBLISH_WINDOW, PUBLISH_ACK_TIMEOUT)
+    # По умолчанию paho держит в полёте 20 сообщений, остальные ждали бы в его очереди
+    client.max_inflight_messages_set(PUBLISH_WINDOW)
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        """Обработчик подключения к брокеру"""
+        if rc == 0:
+            logger.info("✅ Успешно подключились к MQTT брокеру!")
+            logger.info(f"📡 Брокер: {MQTT_BROKER}:{MQTT_PORT}")
+            logger.info(f"🎯 Топик: {MQTT_TOPIC}")
+        else:
+            error_codes = {
+                1: "неверная версия протокола",
+                2: "неверный идентификатор клиента", 
+                3: "сервер недоступен",
+                4: "неверные логин/пароль",
+                5: "ошибка авторизации"
+            }
+            error_msg = error_codes.get(rc, f"неизвестная ошибка (код {rc})")
+            logger.error(f"❌ Ошибка подключения: {error_msg}")
+
+    def on_publish(client, userdata, mid, properties=None):
+        """Обработчик подтверждения публикации"""
+        publisher.handle_ack(mid)
+        logger.debug(f"📨 Подтверждение доставки для сообщения ID {mid}")
+
+    def on_disconnect(client, userdata, rc, properties=None):
+        """Обработчик отключения от брокера"""
+        if rc != 0:
+            logger.warning("⚠️  Неожиданное отключение от брокера. Попытка переподключения...")
+
+    # Назначаем обработчики событий
+    client.on_connect = on_connect
+    client.on_publish = on_publish
+    client.on_disconnect = on_disconnect
+
+    # Подключаемся к брокеру
+    logger.info(f"🔗 Подключаемся к MQTT брокеру {MQTT_BROKER}...")
+    try:
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        # Запускаем фоновый поток
+        client.loop_start()
+        # Даем время на установление соединения
+        time.sleep(2)
+        return client, publisher
+    except Exception as e:
+        logger.error(f"❌ Не удалось подключиться к MQTT брокеру: {e}")
+        raise
+
+# =============================================================================
+# 3. ФУНКЦИЯ СИНХРОНИЗАЦИИ ДАННЫХ
+# =============================================================================
+
+# Общие поля, которые передаются один раз на пакет
+MESSAGE_HEADER = {"source": "local_sqlite", "version": "2.0"}
+
+# Очередь на отправку, обновляется в начале и в конце каждого цикла
+UNSENT_BACKLOG = REGISTRY.gauge('sender_unsent_backlog', 'Неотправленных записей (изменений outbox)')
+
+def get_watermark(cursor, destination):
+    """Последний непрерывно подтвержденный id для получателя"""
+    cursor.execute("SELECT acked_id FROM sync_checkpoint WHERE destination = ?", (destination,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def mark_acked(conn, cursor, publisher, tracker=None):
+    """Учитывает записи, подтверждённые брокером, одной транзакцией.
+
+    Без tracker ставит sent = 1 диапазонами id, с tracker сохраняет
+    водяной знак получателя в sync_checkpoint.
+    """
+    acked_ids = []
+    for record_ids in publisher.pop_acked():
+        # Одна строка на подтвержденный пакет
+        logger.info("✅ " + fields(delivered=f"{record_ids[0]}-{record_ids[-1]}", records=len(record_ids)))
+        acked_ids.extend(record_ids)
+
+    if not acked_ids:
+        return 0
+    if tracker is None:
+        cursor.executemany(
+            "UPDATE sensor_data SET sent = 1 WHERE id BETWEEN ? AND ?", id_ranges(acked_ids)
+        )
+        conn.commit()
+    elif tracker.acked(acked_ids):
+        cursor.execute(
+            "REPLACE INTO sync_checkpoint (destination, acked_id, updated_at) VALUES (?, ?, ?)",
+            (publisher.topic, tracker.watermark, datetime.now().isoformat())
+        )
+        conn.commit()
+    return len(acked_ids)
+
+def publish_batch(publisher, records, tracker=None, picked_at=None):
+    """Публикует пакет записей одним сообщением.
+
+    picked_at - когда sync_data выбрал первую запись пакета (для трассировки).
+    """
+    record_ids = [record["id"] for record in records]
+    if tracker is not None:
+        # Регистрируем до публикации, чтобы неотправленный пакет задержал водяной знак
+        tracker.published(record_ids)
+    picked_at = picked_at or time.time()
+
+    def encode():
+        # Вызывается публикатором после ожидания окна: время публикации - без него
+        header = MESSAGE_HEADER
+        if TRACE_ENABLED:
+            header = {**MESSAGE_HEADER, **trace_header(picked_at)}
+        return encode_message(records, header)
+
+    if not publisher.publish(encode, record_ids):
+        logger.error(f"❌ Ошибка публикации пакета записей ID {record_ids[0]}-{record_ids[-1]}")
+        return False
+    return True
+
+def iter_unsent(cursor, page_size=1000, watermark=None):
+    """Постранично отдает неотправленные записи (не больше page_size строк в памяти).
+
+    С watermark флаг sent не проверяется: отдаются все записи после водяного знака.
+    """
+    condition = "sent = 0 AND " if watermark is None else ""
+    last_id = watermark or 0
+    while True:
+        cursor.execute(f"""
+            SELECT id, sensor_id, value, timestamp 
+            FROM sensor_data 
+            WHERE {condition}id > ? 
+            ORDER BY id 
+            LIMIT ?
+        """, (last_id, page_size))
+        rows = cursor.fetchall()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+def sync_data(conn, cursor, publisher):
+    """Основная функция синхронизации данных"""
+    success_count = 0
+    tracker = None
+    try:
+        # Считаем новые записи для отправки
+        watermark = None
+        if DELIVERY_TRACKING == TRACKING_WATERMARK:
+            watermark = get_watermark(cursor, publisher.topic)
+            tracker = AckWatermark(watermark)
+            cursor.execute("SELECT COUNT(*) FROM sensor_data WHERE id > ?", (watermark,))
+        else:
+            cursor.execute("SELECT COUNT(*) FROM sensor_data WHERE sent = 0")
+        unsent_count = cursor.fetchone()[0]
+        UNSENT_BACKLOG.set(unsent_count)
+
+        if not unsent_count:
+            logger.info("💤 Новых данных для отправки нет")
+            return True
+
+        logger.info(f"📦 Найдено {unsent_count} новых записей")
+
+        # Записи копятся в пакет до BATCH_MAX_RECORDS штук или BATCH_MAX_DELAY_MS мс
+        batch = BatchAccumulator(BATCH_MAX_RECORDS, BATCH_MAX_DELAY_MS)
+        for record in iter_unsent(cursor, UNSENT_PAGE_SIZE, watermark):
+            record_id, sensor_id, value, timestamp = record
+
+            # Подготавливаем данные для отправки
+            payload = {
+                "id": record_id,
+                "sensor_id": sensor_id,
+                "value": value,
+                # По сети время всегда ISO строка, как бы оно ни хранилось
+                "timestamp": to_iso(timestamp)
+            }
+
+            if detail.enabled():
+                logger.info(f"🚀 Отправляем запись ID {record_id} (Датчик {sensor_id}: {value}°C)")
+            
+            # Публикуем без ожидания PUBACK, пока в окне есть место
+            if batch.add(payload):
+                publish_batch(publisher, batch.take(), tracker, batch.picked_at)
+
+            success_count += mark_acked(conn, cursor, publisher, tracker)
+
+        if batch.records:
+            publish_batch(publisher, batch.take(), tracker, batch.picked_at)
+
+        # Дожидаемся подтверждения оставшихся сообщений
+        publisher.wait_all()
+        success_count += mark_acked(conn, cursor, publisher, tracker)
+
+        UNSENT_BACKLOG.set(unsent_count - success_count)
+        logger.info(f"🎉 Успешно отправлено {success_count} из {unsent_count} записей")
+        return True
+
+    except DeliveryTimeout as e:
+        mark_acked(conn, cursor, publisher, tracker)
+        logger.warning(f"⚠️  Таймаут доставки: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"💥 Ошибка синхронизации: {e}")
+        return False
+
+# =============================================================================
+# 4. ГЛАВНАЯ ФУНКЦИЯ
+# =============================================================================
+
+def main():
+    """Основная функция программы"""
+    logger.info("🚀 ЗАПУСК СИСТЕМЫ ПЕРЕДАЧИ ДАННЫХ")
+    logger.info("=" * 50)
+    
+    conn = None
+    client = None
+    trigger = None
+    metrics_server = None
+    
+    try:
+        # Инициализируем компоненты системы
+        conn, cursor = setup_database()
+        client, publisher = setup_mqtt_client()
+        trigger = SyncTrigger(
+            'local_sensor_data.db', SYNC_NOTIFY_PORT,
+            SYNC_MIN_INTERVAL, SYNC_MAX_INTERVAL, SYNC_WATCH_INTERVAL
+        )
+        retention = None
+        if RETENTION_ENABLED:
+            retention = Retention(
+                conn, 'local_sensor_data.db', RETENTION_MAX_AGE_HOURS, RETENTION_MAX_DELIVERED_ROWS,
+                RETENTION_BATCH_ROWS, RETENTION_VACUUM_PAGES, RETENTION_INTERVAL
+            )
+        if METRICS_ENABLED:
+            metrics_server = MetricsServer(
+                REGISTRY, METRICS_HOST, METRICS_SENDER_PORT,
+                METRICS_SNAPSHOT_FILE.format(name='sender'), METRICS_SNAPSHOT_INTERVAL
+            ).start()
+        
+        # Основной цикл работы
+        cycle_count = 0
+        logger.info("\n🔄 Служба синхронизации запущена")
+        logger.info(f"⏰ Проверка по изменению базы, не реже чем раз в {SYNC_MAX_INTERVAL} секунд")
+        logger.info("⏹️  Для остановки нажмите Ctrl+C\n")
+        
+        while True:
+            cycle_count += 1
+            logger.info(f"\n{'='*30}")
+            logger.info(f"ЦИКЛ СИНХРОНИЗАЦИИ #{cycle_count}")
+            logger.info(f"{'='*30}")
+            
+            published_before = publisher.published
+            sync_success = sync_data(conn, cursor, publisher)
+            
+            if sync_success:
+                logger.info("✅ Цикл завершен успешно")
+            else:
+                logger.warning("⚠️  В цикле возникли проблемы")
+
+            if retention:
+                watermark = None
+                if DELIVERY_TRACKING == TRACKING_WATERMARK:
+                    watermark = get_watermark(cursor, publisher.topic)
+                retention.maybe_purge(watermark)
+            
+            logger.info("⏳ Ожидание новых данных...")
+            reason = trigger.wait(found_data=publisher.published != published_before)
+            logger.info(f"🔔 Пробуждение: {reason}")
+            
+    except KeyboardInterrupt:
+        logger.info("\n🛑 ОСТАНОВКА СИСТЕМЫ ПОЛЬЗОВАТЕЛЕМ")
+    except Exception as e:
+        logger.error(f"💥 КРИТИЧЕСКАЯ ОШИБКА: {e}")
+    finally:
+        # Корректное завершение работы
+        logger.info("\n🔚 Завершение работы системы...")
+        if client:
+            client.loop_stop()
+            client.disconnect()
+            logger.info("✅ MQTT клиент отключен")
+        if trigger:
+            trigger.close()
+        if conn:
+            conn.close()
+            logger.info("✅ База данных закрыта")
+        if metrics_server:
+            metrics_server.stop()
+        logger.info("🎯 СИСТЕМА ОСТАНОВЛЕНА")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,106 @@
+# sync_trigger.py - Пробуждение цикла синхронизации по появлению новых данных
+import logging
+import select
+import socket
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Адрес, на который производители данных шлют уведомление (любой UDP пакет)
+NOTIFY_HOST = '127.0.0.1'
+
+# =============================================================================
+# УВЕДОМЛЕНИЕ ОТ ПРОИЗВОДИТЕЛЯ
+# =============================================================================
+
+def notify_sync(port, host=NOTIFY_HOST):
+    """Будит отправителя: вызывается производителем после записи в sensor_data"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(b'1', (host, port))
+
+# =============================================================================
+# ОЖИДАНИЕ СЛЕДУЮЩЕГО ЦИКЛА
+# =============================================================================
+
+class SyncTrigger:
+    """Ждет до следующего цикла синхронизации.
+
+    Цикл запускается сразу, как только:
+    - производитель прислал UDP уведомление на notify_port;
+    - у SQLite базы изменился PRAGMA data_version (коммит другого соединения).
+    Иначе срабатывает адаптивный таймер: после цикла с данными ждем
+    min_interval, после пустого - вдвое дольше прошлого, но не больше max_interval.
+    """
+
+    def __init__(self, database=None, notify_port=None, min_interval=0.5,
+                 max_interval=30, watch_interval=0.1):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.watch_interval = watch_interval
+        self.interval = min_interval
+
+        # Отдельное соединение: data_version меняется только от чужих коммитов
+        self._conn = sqlite3.connect(database, check_same_thread=False) if database else None
+        self._version = self._data_version()
+
+        self._sock = None
+        if notify_port:
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind((NOTIFY_HOST, notify_port))
+                sock.setblocking(False)
+                self._sock = sock
+                logger.info(f"🔔 Ожидание уведомлений на {NOTIFY_HOST}:{notify_port}")
+            except OSError as e:
+                logger.warning(f"⚠️  Порт уведомлений {notify_port} недоступен: {e}")
+
+    def wait(self, found_data):
+        """Ждет следующего цикла; found_data - нашел ли прошлый цикл данные.
+
+        Возвращает причину пробуждения: 'notify', 'data_version' или 'timer'.
+        """
+        if found_data:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+        # Коммиты самого отправителя за прошедший цикл не должны его будить
+        self._version = self._data_version()
+        deadline = time.monotonic() + self.interval
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return 'timer'
+            timeout = min(remaining, self.watch_interval) if self._conn else remaining
+
+            if self._sock:
+                ready, _, _ = select.select([self._sock], [], [], timeout)
+                if ready:
+                    self._drain_notifications()
+                    return 'notify'
+            else:
+                time.sleep(timeout)
+
+            if self._data_version() != self._version:
+                return 'data_version'
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+        if self._conn:
+            self._conn.close()
+
+    def _data_version(self):
+        if not self._conn:
+            return None
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _drain_notifications(self):
+        # Несколько уведомлений подряд - один цикл
+        while True:
+            try:
+                self._sock.recv(64)
+            except BlockingIOError:
+                return
@@ -0,0 +1,5 @@
+# conftest.py - Модули системы лежат плоско в data_sync_system/, тесты импортируют их по имени
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,31 @@
+# test_ack_tracker.py - Водяной знак подтверждений и диапазоны id
+from ack_tracker import AckWatermark, id_ranges
+
+def test_out_of_order_acks_wait_for_the_gap():
+    tracker = AckWatermark(10)
+    tracker.published([11, 12, 13])
+    assert not tracker.acked([12, 13])
+    assert tracker.watermark == 10 and tracker.out_of_order() == 2
+    assert tracker.acked([11])
+    assert tracker.watermark == 13 and tracker.out_of_order() == 0
+
+def test_late_acks_from_previous_cycle_are_ignored():
+    """PUBACK пакета прошлого цикла не копится в новом трекере (регрессия)"""
+    tracker = AckWatermark(100)
+    tracker.published([101, 102])
+    assert not tracker.acked(range(1, 101))
+    assert not tracker.acked([500])
+    assert tracker.out_of_order() == 0
+    assert tracker.acked([101, 102]) and tracker.watermark == 102
+
+def test_repeated_ack_after_advance_is_ignored():
+    tracker = AckWatermark()
+    tracker.published([1, 2])
+    assert tracker.acked([1])
+    assert not tracker.acked([1])
+    assert tracker.out_of_order() == 0
+
+def test_id_ranges_collapses_unsorted_ids_with_repeats():
+    assert id_ranges([5, 3, 4, 10, 4, 1, 11]) == [(1, 1), (3, 5), (10, 11)]
+    assert id_ranges([7]) == [(7, 7)]
+    assert id_ranges([]) == []
@@ -0,0 +1,56 @@
+# test_batch_writer.py - Пакетная запись: деление отвергнутого пакета и повторы
+import sqlite3
+
+import batch_writer
+from batch_writer import BatchWriter
+
+class FakeBackend:
+    """Хранилище central_backends: строки с отрицательным значением нарушают ограничение"""
+
+    def __init__(self, busy=0):
+        self.busy = busy
+        self.batches = []
+
+    def write_batch(self, rows):
+        if self.busy:
+            self.busy -= 1
+            raise sqlite3.OperationalError("database is locked")
+        if any(row[1] < 0 for row in rows):
+            raise sqlite3.IntegrityError("CHECK constraint failed: value")
+        self.batches.append(list(rows))
+        return len(rows)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def write(backend, rows, **callbacks):
+    writer = BatchWriter(backend, max_rows=100, max_delay_ms=10000, **callbacks).start()
+    for number, row in enumerate(rows):
+        writer.put(row, context={'n': number}, key=('edge_1', row[0], None))
+    writer.close()
+    return writer
+
+def test_rejected_batch_is_split_and_only_bad_rows_dropped():
+    backend = FakeBackend()
+    rejected, written, committed = [], [], []
+    rows = [(1, 1.0), (2, -1.0), (3, 3.0), (4, -4.0)]
+    writer = write(backend, rows, on_reject=rejected.extend, on_written=written.extend,
+                   on_commit=committed.extend)
+
+    assert [row for batch in backend.batches for row in batch] == [(1, 1.0), (3, 3.0)]
+    assert rejected == [('edge_1', 2, None), ('edge_1', 4, None)]
+    assert written == [(1, 1.0), (3, 3.0)]
+    assert committed == [{'n': 0}, {'n': 2}]
+    assert writer.rows_written == 2
+
+def test_busy_database_is_retried_without_splitting(monkeypatch):
+    monkeypatch.setattr(batch_writer, 'RETRY_BASE_DELAY', 0)
+    backend = FakeBackend(busy=2)
+    rejected = []
+    write(backend, [(1, 1.0), (2, 2.0)], on_reject=rejected.extend)
+
+    assert backend.batches == [[(1, 1.0), (2, 2.0)]]
+    assert rejected == []
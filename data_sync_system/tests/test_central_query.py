@@ -0,0 +1,55 @@
+# test_central_query.py - Сброс кэша запросов без триггеров на received_data
+import sqlite3
+
+from central_query import CentralQuery
+
+def make_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE received_data (
+            id INTEGER PRIMARY KEY, original_id INTEGER, sensor_id INTEGER,
+            value REAL, timestamp TEXT
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO received_data (original_id, sensor_id, value, timestamp) VALUES (?, ?, ?, ?)",
+        [(1, 1, 1.0, '2024-01-01T10:00:00'), (2, 2, 2.0, '2024-01-01T10:00:00')])
+    conn.commit()
+    return conn
+
+def values(query, sensor_id):
+    return [row[2] for row in query.latest(sensor_id)]
+
+def test_no_triggers_on_received_data(tmp_path):
+    database = str(tmp_path / "central.db")
+    make_db(database).close()
+    CentralQuery(database).close()
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall() == []
+
+def test_writer_notification_invalidates_only_its_sensors(tmp_path):
+    database = str(tmp_path / "central.db")
+    writer = make_db(database)
+    query = CentralQuery(database, notified=True)
+    assert values(query, 1) == [1.0] and values(query, 2) == [2.0]
+
+    writer.execute("UPDATE received_data SET value = value + 10")
+    writer.commit()
+    query.changed({1})
+
+    assert values(query, 1) == [11.0]
+    # Датчик 2 писатель не называл - результат остался в кэше
+    assert values(query, 2) == [2.0]
+    query.close()
+
+def test_external_write_clears_cache(tmp_path):
+    database = str(tmp_path / "central.db")
+    writer = make_db(database)
+    query = CentralQuery(database)
+    assert values(query, 2) == [2.0]
+
+    writer.execute("UPDATE received_data SET value = 5.0 WHERE sensor_id = 2")
+    writer.commit()
+
+    assert values(query, 2) == [5.0]
+    query.close()
@@ -0,0 +1,54 @@
+# test_codec.py - Кодеки полезной нагрузки: запись восстанавливается без потерь
+import pytest
+
+from codec import CODECS, BinaryCodec, decode_message, encode_message
+from message_format import OP_DELETE, OP_INSERT, unpack_message
+
+HEADER = {"source": "edge_1", "version": "2.0", "trace_picked": 1704103200.25, "trace_id": None}
+
+def records(count, timestamp="2024-01-01T10:{minute:02d}:{second:02d}.{micros:06d}", op=False):
+    result = []
+    for i in range(count):
+        record = {
+            "id": i + 1,
+            "sensor_id": i % 7,
+            "value": None if i == 3 else i * 1.5,
+            "timestamp": timestamp.format(minute=i // 60 % 60, second=i % 60, micros=(i * 37) % 999999 + 1),
+        }
+        if op:
+            record["op"] = OP_DELETE if i % 5 == 0 else OP_INSERT
+            record["seq"] = 1000 + i
+        result.append(record)
+    return result
+
+@pytest.mark.parametrize("codec", sorted(CODECS))
+@pytest.mark.parametrize("batch", [
+    records(1),
+    records(150),
+    records(20, op=True),
+    records(3, timestamp="2024-01-01T10:{minute:02d}:{second:02d}"),          # без микросекунд
+    records(3, timestamp="2024-01-01 10:{minute:02d}:{second:02d}+03:00"),    # не isoformat()
+    records(2, timestamp="1969-12-31T23:{minute:02d}:{second:02d}.{micros:06d}"),
+])
+def test_round_trip(codec, batch):
+    decoded = unpack_message(decode_message(CODECS[codec].encode(batch, HEADER)))
+    assert decoded == [{**HEADER, **record} for record in batch]
+
+def test_binary_header_keeps_value_types():
+    payload = decode_message(BinaryCodec().encode(records(2), HEADER))
+    assert payload["header"] == HEADER
+    assert isinstance(payload["header"]["trace_picked"], float)
+
+def test_binary_uses_micros_for_isoformat_timestamps():
+    compact = BinaryCodec().encode(records(50), HEADER)
+    text = BinaryCodec().encode(records(50, timestamp="2024-01-01 10:{minute:02d}:{second:02d}"), HEADER)
+    assert len(compact) < len(text)
+
+def test_binary_rejects_unknown_version():
+    raw = bytearray(BinaryCodec().encode(records(1), HEADER))
+    raw[1] = 99
+    with pytest.raises(ValueError):
+        BinaryCodec().decode(bytes(raw))
+
+def test_default_codec_is_json():
+    assert encode_message(records(1), HEADER)[:1] == b'{'
@@ -0,0 +1,79 @@
+# test_columnar.py - Колоночные файлы и выгрузка received_data по дням
+import os
+import sqlite3
+
+from columnar import ColumnarWriter, INT64, FLOAT64, STRING, read_columns, valid_length
+from export_columnar import ColumnarExporter, scan
+
+SCHEMA = [('id', INT64), ('value', FLOAT64), ('source', STRING)]
+
+def test_round_trip_with_nulls(tmp_path):
+    path = str(tmp_path / "a.col")
+    writer = ColumnarWriter(path, SCHEMA)
+    writer.append([(1, 1.5, "a"), (None, None, None)])
+    writer.append([(3, -2.0, "в")])
+    writer.close()
+    assert read_columns(path) == {'id': [1, None, 3], 'value': [1.5, None, -2.0], 'source': ["a", None, "в"]}
+    assert read_columns(path, ['value']) == {'value': [1.5, None, -2.0]}
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    path = str(tmp_path / "a.col")
+    writer = ColumnarWriter(path, SCHEMA)
+    writer.append([(1, 1.0, "a")])
+    writer.close()
+    good = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b'SDC1\x00\x00\x01\x00{"rows"')  # недописанный блок
+    assert valid_length(path) == good
+
+    writer = ColumnarWriter(path, SCHEMA)
+    assert os.path.getsize(path) == good == writer.length
+    writer.append([(2, 2.0, "b")])
+    writer.close()
+    assert read_columns(path, ['id']) == {'id': [1, 2]}
+
+def test_known_length_beyond_file_falls_back_to_scan(tmp_path):
+    path = str(tmp_path / "a.col")
+    ColumnarWriter(path, SCHEMA).close()
+    writer = ColumnarWriter(path, SCHEMA, length=1000)
+    assert writer.length == 0
+    writer.close()
+
+def receiver_db(path):
+    """Схема receiver.py: source и version, без source_db/db_type"""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE received_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, original_id INTEGER, sensor_id INTEGER NOT NULL,
+            value REAL NOT NULL, timestamp TEXT NOT NULL, received_at TEXT NOT NULL,
+            source TEXT, version TEXT
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO received_data (original_id, sensor_id, value, timestamp, received_at, source, version) "
+        "VALUES (?, ?, ?, ?, ?, 'edge', '1.0')",
+        [(i, i % 3, float(i), f"2024-01-0{1 + i % 2}T10:00:00", "2024-01-02T10:00:00") for i in range(10)]
+        + [(99, 1, 1.0, "не время", "2024-01-02T10:00:00")]
+    )
+    conn.commit()
+    conn.close()
+
+def test_exporter_follows_receiver_schema_and_resumes(tmp_path):
+    database = str(tmp_path / "central.db")
+    receiver_db(database)
+    directory = str(tmp_path / "out")
+
+    report = ColumnarExporter(database, directory, batch_rows=4).export()
+    assert (report['exported_rows'], report['skipped_rows'], report['last_id']) == (10, 1, 11)
+    blocks = list(scan(directory, ['original_id', 'source']))
+    assert sorted(v for b in blocks for v in b['original_id']) == list(range(10))
+    assert {v for b in blocks for v in b['source']} == {'edge'}
+
+    conn = sqlite3.connect(database)
+    conn.execute("INSERT INTO received_data (original_id, sensor_id, value, timestamp, received_at, source) "
+                 "VALUES (10, 1, 1.0, '2024-01-01T11:00:00', '2024-01-02T10:00:00', 'edge')")
+    conn.commit()
+    conn.close()
+    assert ColumnarExporter(database, directory).export()['exported_rows'] == 1
+    ids = [v for b in scan(directory, ['original_id'], '2024-01-01', '2024-01-01') for v in b['original_id']]
+    assert ids == [0, 2, 4, 6, 8, 10]
@@ -0,0 +1,90 @@
+# test_dedup.py - Ключ повторов и идемпотентная запись изменений outbox
+import sqlite3
+
+import pytest
+
+from codec import CODECS, decode_message
+from dedup import RecentIds, dedup_key, upsert_clause, create_origin_index, remove_duplicates
+from message_format import OP_UPDATE, unpack_message
+
+HEADER = {"source": "edge_1", "version": "2.0"}
+
+def update(seq, value):
+    return {"seq": seq, "op": OP_UPDATE, "id": 7, "sensor_id": 3, "value": value,
+            "timestamp": "2024-01-01T10:00:00"}
+
+@pytest.mark.parametrize("codec", sorted(CODECS))
+def test_two_updates_of_one_row_are_both_accepted(codec):
+    """Второе изменение той же строки - не повтор QoS 1 (регрессия: ключ без seq)"""
+    recent = RecentIds()
+    accepted = []
+    for record in (update(1, 1.0), update(2, 9.0)):
+        for received in unpack_message(decode_message(CODECS[codec].encode([record], HEADER))):
+            assert received["seq"] == record["seq"]
+            if not recent.seen(dedup_key(received)):
+                accepted.append(received)
+    assert [r["value"] for r in accepted] == [1.0, 9.0]
+
+def test_redelivered_update_is_dropped():
+    recent = RecentIds()
+    record = {**update(5, 2.0), **HEADER}
+    assert not recent.seen(dedup_key(record))
+    assert recent.seen(dedup_key(dict(record)))
+    assert recent.duplicates == 1
+
+def test_change_without_seq_is_never_dropped():
+    recent = RecentIds()
+    record = {"op": OP_UPDATE, "id": 7, "source": "old_sender"}
+    assert dedup_key(record) is None
+    assert not recent.seen(dedup_key(record))
+    assert not recent.seen(dedup_key(record))
+
+def test_plain_records_keyed_by_id():
+    assert dedup_key({"id": 4, "source": "s"}) == ("s", 4, None)
+
+def test_forget_lets_key_through_again():
+    recent = RecentIds()
+    key = dedup_key({"id": 1, "source": "s"})
+    recent.seen(key)
+    recent.forget([key])
+    assert not recent.seen(key)
+
+def central_db():
+    conn = sqlite3.connect(":memory:")
+    conn.execute('''
+        CREATE TABLE received_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, original_id INTEGER, sensor_id INTEGER,
+            value REAL, timestamp TEXT, received_at TEXT, source TEXT, version TEXT
+        )
+    ''')
+    return conn
+
+def test_upsert_applies_second_update():
+    conn = central_db()
+    create_origin_index(conn, 'source')
+    sql = '''
+        INSERT INTO received_data
+        (original_id, sensor_id, value, timestamp, received_at, source, version)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''' + upsert_clause('source')
+    for value in (1.0, 9.0):
+        with conn:
+            conn.execute(sql, (7, 3, value, "2024-01-01T10:00:00", "2024-01-01T10:00:01", "edge_1", "2.0"))
+    assert conn.execute("SELECT COUNT(*), MAX(value) FROM received_data").fetchone() == (1, 9.0)
+
+def test_origin_index_does_not_delete_existing_duplicates():
+    conn = central_db()
+    conn.executemany("INSERT INTO received_data (original_id, value, source) VALUES (?, ?, ?)",
+                     [(1, 1.0, "s"), (1, 2.0, "s"), (2, 3.0, "s")])
+    with pytest.raises(RuntimeError):
+        create_origin_index(conn, 'source')
+    assert conn.execute("SELECT COUNT(*) FROM received_data").fetchone() == (3,)
+
+def test_remove_duplicates_keeps_last_and_backs_up_removed():
+    conn = central_db()
+    conn.executemany("INSERT INTO received_data (original_id, value, source) VALUES (?, ?, ?)",
+                     [(1, 1.0, "s"), (1, 2.0, "s"), (2, 3.0, "s")])
+    assert remove_duplicates(conn, 'source') == 1
+    create_origin_index(conn, 'source')
+    assert conn.execute("SELECT value FROM received_data ORDER BY id").fetchall() == [(2.0,), (3.0,)]
+    assert conn.execute("SELECT value FROM received_data_duplicates").fetchall() == [(1.0,)]
@@ -0,0 +1,67 @@
+# test_ingest.py - Повторы и деление групп ReadingBuffer
+import sqlite3
+
+from ingest import ReadingBuffer
+from mysql_pool import CommitUncertain
+
+def rows(n):
+    return [(i, float(i), '2024-01-01T10:00:00') for i in range(n)]
+
+class FakeWrite:
+    """write(rows) буфера: записывает группы, ошибки берет по очереди из errors"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+        self.written = []
+
+    def __call__(self, part):
+        self.calls.append(list(part))
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        self.written.extend(part)
+
+def test_lost_connection_on_commit_is_not_retried():
+    write = FakeWrite(CommitUncertain("Lost connection to MySQL server during query"))
+    buffer = ReadingBuffer(write, max_rows=10)
+    assert buffer._write(rows(4)) == []
+    assert len(write.calls) == 1
+    assert write.written == [] and buffer.rows_written == 0
+
+def test_busy_database_returns_group_for_retry():
+    write = FakeWrite(sqlite3.OperationalError("database is locked"))
+    buffer = ReadingBuffer(write, max_rows=2)
+    pending = rows(5)
+    # Первая группа не записана - повторить нужно её и всё после неё
+    assert buffer._write(pending) == pending
+    assert buffer._write(pending) == []
+    assert write.written == pending
+    assert buffer.batches_written == 3
+
+def test_rejected_group_is_split_until_bad_rows_are_found():
+    bad = (3, float('nan'), '2024-01-01T10:00:00')
+
+    def write(part):
+        if bad in part:
+            raise sqlite3.IntegrityError("CHECK constraint failed: value")
+        written.append(list(part))
+
+    written = []
+    pending = rows(8)
+    pending[3] = bad
+    buffer = ReadingBuffer(write, max_rows=8)
+    assert buffer._write(pending) == []
+    # Строки записаны в исходном порядке, без отброшенной
+    assert [row for part in written for row in part] == pending[:3] + pending[4:]
+    assert buffer.rows_written == 7
+
+def test_transient_error_after_split_keeps_remaining_parts():
+    write = FakeWrite(sqlite3.IntegrityError("CHECK constraint failed"), None,
+                      sqlite3.OperationalError("database is locked"))
+    buffer = ReadingBuffer(write, max_rows=4)
+    pending = rows(4)
+    # Половина 0-1 записана, на половине 2-3 база занята: вернуть её для повтора
+    assert buffer._write_group(pending) == pending[2:]
+    assert write.written == pending[:2]
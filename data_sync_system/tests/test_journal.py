@@ -0,0 +1,47 @@
+# test_journal.py - Сегменты журнала: ротация, нумерация, сжатие
+import gzip
+import json
+import os
+
+from journal import FSYNC_NEVER, JournalWriter, list_segments, segment_path
+
+def read_all(path):
+    entries = []
+    for segment in list_segments(path):
+        opener = gzip.open if segment.endswith('.gz') else open
+        with opener(segment, 'rt', encoding='utf-8') as f:
+            entries.extend(json.loads(line) for line in f)
+    return entries
+
+def test_segment_rotates_by_size_and_keeps_order(tmp_path):
+    path = str(tmp_path / "received_data.log")
+    journal = JournalWriter(path, segment_max_bytes=100, fsync=FSYNC_NEVER, compress=False)
+    for i in range(10):
+        journal.append([{'id': i, 'value': 'x' * 20}])
+    journal.close()
+
+    segments = list_segments(path)
+    assert len(segments) > 1
+    assert segments[0] == segment_path(path, 1)
+    # Пачка не делится между сегментами, сегмент превышает предел не больше чем на одну пачку
+    assert all(os.path.getsize(s) < 200 for s in segments)
+    assert [e['id'] for e in read_all(path)] == list(range(10))
+
+def test_restart_continues_numbering_and_compresses(tmp_path):
+    path = str(tmp_path / "received_data.log")
+    for run in range(2):
+        journal = JournalWriter(path, fsync=FSYNC_NEVER, compress=True)
+        journal.append([{'run': run, 'n': n} for n in range(3)])
+        journal.close()
+
+    segments = list_segments(path)
+    assert segments == [segment_path(path, 1) + '.gz', segment_path(path, 2) + '.gz']
+    assert [(e['run'], e['n']) for e in read_all(path)] == [(r, n) for r in range(2) for n in range(3)]
+
+def test_segment_rotates_by_age(tmp_path):
+    path = str(tmp_path / "received_data.log")
+    journal = JournalWriter(path, segment_max_seconds=0, fsync=FSYNC_NEVER, compress=False)
+    journal.append([{'id': 1}])
+    journal.append([{'id': 2}])
+    journal.close()
+    assert len(list_segments(path)) == 2
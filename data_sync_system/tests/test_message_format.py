@@ -0,0 +1,41 @@
+# test_message_format.py - Накопление записей в пакеты
+import message_format
+from message_format import BatchAccumulator
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def test_batch_is_due_by_count():
+    batch = BatchAccumulator(max_records=3, max_delay_ms=60000)
+    assert not batch.add(1)
+    assert not batch.add(2)
+    assert batch.add(3)
+    assert batch.take() == [1, 2, 3]
+    assert batch.records == [] and not batch.is_due()
+
+def test_batch_is_due_by_delay_from_first_record(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(message_format.time, 'monotonic', clock)
+    batch = BatchAccumulator(max_records=100, max_delay_ms=200)
+    assert not batch.add('a')
+    clock.now += 0.15
+    assert not batch.add('b')
+    clock.now += 0.05
+    assert batch.is_due()
+
+    batch.take()
+    # Новый пакет отсчитывает задержку от своей первой записи
+    clock.now += 10
+    assert not batch.add('c')
+
+def test_take_keeps_picked_at_of_taken_batch():
+    batch = BatchAccumulator(max_records=1)
+    batch.add('a')
+    picked_at = batch.picked_at
+    assert batch.take() == ['a']
+    assert batch.picked_at == picked_at
+    assert batch.take() == []
@@ -0,0 +1,52 @@
+# test_receive_pipeline.py - Порядок обработки и поведение заполненной очереди
+import threading
+import time
+
+from receive_pipeline import ReceivePipeline, POLICY_DROP_NEWEST
+
+def test_messages_of_one_topic_keep_order_with_several_workers():
+    handled = {}
+    lock = threading.Lock()
+
+    def handler(topic, payload):
+        time.sleep(0.0005 if payload % 3 else 0)
+        with lock:
+            handled.setdefault(topic, []).append(payload)
+
+    pipeline = ReceivePipeline(handler, workers=4, max_queue=1000, stats_interval=0).start()
+    for i in range(200):
+        for topic in ("a", "b", "c"):
+            pipeline.submit(topic, i)
+    pipeline.stop()
+    assert handled == {topic: list(range(200)) for topic in ("a", "b", "c")}
+
+def test_block_policy_waits_instead_of_dropping():
+    release = threading.Event()
+    handled = []
+
+    def handler(topic, payload):
+        release.wait()
+        handled.append(payload)
+
+    pipeline = ReceivePipeline(handler, workers=1, max_queue=1, stats_interval=0).start()
+    results = []
+    submitter = threading.Thread(target=lambda: results.extend(pipeline.submit("t", i) for i in range(5)))
+    submitter.start()
+    time.sleep(0.2)
+    assert submitter.is_alive()  # сетевой поток ждет места, а не отбрасывает
+    release.set()
+    submitter.join(5)
+    pipeline.stop()
+    assert results == [True] * 5
+    assert handled == list(range(5))
+    assert pipeline.stats()['dropped'] == 0
+
+def test_drop_newest_reports_dropped():
+    release = threading.Event()
+    pipeline = ReceivePipeline(lambda topic, payload: release.wait(), workers=1, max_queue=1,
+                               policy=POLICY_DROP_NEWEST, stats_interval=0).start()
+    results = [pipeline.submit("t", i) for i in range(4)]
+    release.set()
+    pipeline.stop()
+    assert False in results
+    assert pipeline.stats()['dropped'] == results.count(False)
@@ -0,0 +1,45 @@
+# test_retention.py - Очистка доставленных строк отправителя
+import sqlite3
+
+from retention import AUTO_VACUUM_INCREMENTAL, Retention, convert_to_incremental, enable_incremental_vacuum
+
+def sender_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE sensor_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, sensor_id INTEGER, value REAL,
+            timestamp TEXT, sent INTEGER DEFAULT 0
+        )
+    ''')
+    conn.executemany("INSERT INTO sensor_data (sensor_id, value, timestamp, sent) VALUES (1, ?, ?, ?)",
+                     [(i, "2020-01-01T00:00:00", i < 8) for i in range(10)])
+    conn.commit()
+    return conn
+
+def auto_vacuum(conn):
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+def test_new_database_gets_incremental_mode(tmp_path):
+    conn = sqlite3.connect(tmp_path / "new.db")
+    assert enable_incremental_vacuum(conn, "new.db")
+    conn.execute("CREATE TABLE t (x)")
+    assert auto_vacuum(conn) == AUTO_VACUUM_INCREMENTAL
+
+def test_existing_database_is_not_vacuumed_on_startup(tmp_path):
+    path = tmp_path / "old.db"
+    sender_db(path).close()
+    conn = sqlite3.connect(path)
+    assert not enable_incremental_vacuum(conn, str(path))
+    assert auto_vacuum(conn) != AUTO_VACUUM_INCREMENTAL
+    conn.close()
+
+    convert_to_incremental(str(path))
+    conn = sqlite3.connect(path)
+    assert auto_vacuum(conn) == AUTO_VACUUM_INCREMENTAL
+
+def test_purge_deletes_only_delivered_rows(tmp_path):
+    conn = sender_db(tmp_path / "s.db")
+    report = Retention(conn, str(tmp_path / "s.db"), max_age_hours=1, batch_rows=3).purge()
+    assert report['deleted_rows'] == 8
+    assert conn.execute("SELECT COUNT(*) FROM sensor_data WHERE sent = 0").fetchone() == (2,)
+    assert conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone() == (2,)
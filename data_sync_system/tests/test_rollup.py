@@ -0,0 +1,77 @@
+# test_rollup.py - Агрегаты при изменении строк и перестроении
+import sqlite3
+
+import pytest
+
+from rollup import create_rollups, merge_rows, rebuild_rollups
+from timestamps import TS_MICROS, TS_TEXT, column_type, to_storage
+
+def make_db(mode):
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f'''
+        CREATE TABLE received_data (
+            id INTEGER PRIMARY KEY, sensor_id INTEGER, value REAL, timestamp {column_type(mode)}
+        )
+    ''')
+    create_rollups(conn)
+    return conn
+
+def insert(conn, mode, rows):
+    with conn:
+        conn.executemany(
+            "INSERT INTO received_data (sensor_id, value, timestamp) VALUES (?, ?, ?)",
+            [(sensor_id, value, to_storage(ts, mode)) for sensor_id, value, ts in rows]
+        )
+
+def hour(conn, bucket='2024-01-01T10'):
+    return conn.execute('''
+        SELECT count, min_value, max_value, sum_value, last_value FROM rollup_hour
+        WHERE sensor_id = 1 AND bucket = ?
+    ''', (bucket,)).fetchone()
+
+def snapshot(conn):
+    return {
+        table: conn.execute(f"SELECT * FROM {table} ORDER BY sensor_id, bucket").fetchall()
+        for table in ('rollup_minute', 'rollup_hour', 'rollup_day')
+    }
+
+@pytest.mark.parametrize("mode", [TS_TEXT, TS_MICROS])
+def test_update_recomputes_min_max_of_old_bucket(mode):
+    conn = make_db(mode)
+    insert(conn, mode, [(1, 5.0, '2024-01-01T10:00:00'), (1, 50.0, '2024-01-01T10:30:00'),
+                        (1, 7.0, '2024-01-01T10:10:00')])
+    assert hour(conn) == (3, 5.0, 50.0, 62.0, 50.0)
+
+    # Изменение на месте: прежний максимум больше не существует
+    with conn:
+        conn.execute("UPDATE received_data SET value = 6.0 WHERE value = 50.0")
+    assert hour(conn) == (3, 5.0, 7.0, 18.0, 6.0)
+
+    # Перенос в другой час: в старом интервале пересчитывается и последнее значение
+    with conn:
+        conn.execute("UPDATE received_data SET timestamp = ? WHERE value = 6.0",
+                     (to_storage('2024-01-01T11:00:00', mode),))
+    assert hour(conn) == (2, 5.0, 7.0, 12.0, 7.0)
+    assert hour(conn, '2024-01-01T11') == (1, 6.0, 6.0, 6.0, 6.0)
+
+def test_update_during_rebuild_matches_full_rebuild():
+    """Изменение строки, еще не прочитанной перестроением, не учитывается дважды"""
+    conn = make_db(TS_TEXT)
+    insert(conn, TS_TEXT, [(1, float(i), f'2024-01-01T10:{i:02d}:00') for i in range(1, 11)])
+    # Перестроение прервано после порции до id 4
+    with conn:
+        for table in ('rollup_minute', 'rollup_hour', 'rollup_day'):
+            conn.execute(f"DELETE FROM {table}")
+        merge_rows(conn, conn.execute(
+            "SELECT sensor_id, value, timestamp FROM received_data WHERE id <= 4").fetchall())
+        conn.execute("INSERT INTO rollup_rebuild VALUES (1, 4, 10, '2024-01-01T00:00:00')")
+
+    # Приём меняет строки до и после позиции, затем перестроение продолжается
+    with conn:
+        conn.execute("UPDATE received_data SET value = 100.0 WHERE id IN (2, 8)")
+    rebuild_rollups(conn, batch_rows=4)
+    resumed = snapshot(conn)
+
+    rebuild_rollups(conn, batch_rows=4)
+    assert resumed == snapshot(conn)
+    assert hour(conn) == (10, 1.0, 100.0, 55.0 - 2 - 8 + 200.0, 10.0)
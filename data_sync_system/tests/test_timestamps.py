@@ -0,0 +1,40 @@
+# test_timestamps.py - Соглашение о поясе: наивное время - местное, микросекунды - UTC
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from rollup import bucket_of, _bucket_sql
+from timestamps import TS_MICROS, to_iso, to_micros
+
+@pytest.fixture
+def moscow(monkeypatch):
+    monkeypatch.setenv('TZ', 'Europe/Moscow')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_naive_local_and_aware_values_share_one_scale(moscow):
+    local = datetime(2024, 1, 1, 13, 0, 0)
+    aware = datetime(2024, 1, 1, 10, 0, 0, tzinfo=timezone.utc)
+    assert to_micros(local) == to_micros(aware) == to_micros("2024-01-01T12:00:00+02:00")
+    assert to_micros(local) == int(datetime(2024, 1, 1, 10, tzinfo=timezone.utc).timestamp()) * 1000000
+
+def test_round_trip_returns_local_time(moscow):
+    local = datetime(2024, 6, 30, 23, 59, 59, 123456)
+    assert to_iso(to_micros(local)) == local.isoformat()
+    assert to_iso(datetime(2024, 1, 1, 10, tzinfo=timezone.utc)) == "2024-01-01T13:00:00"
+
+def test_rollup_bucket_matches_in_both_modes(moscow):
+    local = datetime(2024, 1, 1, 23, 30)
+    micros = to_micros(local)
+    (bucket,) = sqlite3.connect(":memory:").execute(
+        f"SELECT {_bucket_sql('?', 'day', TS_MICROS)}", (micros,)
+    ).fetchone()
+    assert bucket == bucket_of(micros, 'day') == bucket_of(local.isoformat(), 'day') == "2024-01-01"
+
+def test_integers_pass_through():
+    assert to_micros(5) == 5
+    assert to_micros(None) is None
@@ -0,0 +1,17 @@
+# test_tracing.py - Этапы трассировки задержек
+from tracing import TraceStats, trace_header
+
+def test_total_starts_at_pick_not_at_reading_time():
+    """Показание, записанное задним числом, не раздувает задержку пути по системе"""
+    stats = TraceStats(report_interval=0)
+    header = {'source': 'edge_1', **trace_header(1700000000.0)}
+    header['trace_published'] = '1700000000.5'
+    records = [{**header, 'timestamp': '2020-01-01T00:00:00'}]
+    context = stats.start(records, received_at=1700000001.0)
+    stats.committed([context], committed_at=1700000002.0)
+
+    summary = stats.summary()['edge_1']
+    assert summary['total']['max'] == 2.0
+    assert summary['ingest']['max'] == 1.0
+    # Возраст показания виден отдельно
+    assert summary['backlog']['max'] > 3 * 365 * 86400
@@ -0,0 +1,58 @@
+# timestamps.py - Хранение времени: ISO строки или целые микросекунды от эпохи
+#
+# Соглашение о поясе: время без пояса (datetime.now() производителей, ISO
+# строки без смещения) - местное время машины. Микросекунды - настоящее
+# время UTC от эпохи Unix: наивное значение переводится через astimezone(),
+# значение с поясом - по своему смещению, так что оба попадают в одну шкалу.
+# Обратно (to_iso) микросекунды и значения с поясом дают местное время без
+# пояса, как строки режима 'text'.
+from datetime import datetime, timedelta, timezone
+
+# Режимы хранения (config.TIMESTAMP_STORAGE)
+TS_TEXT = 'text'      # '2024-01-01T10:00:00.123456', местное время, как раньше
+TS_MICROS = 'micros'  # 1704103200123456, INTEGER, UTC
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+def to_micros(value):
+    """ISO строка, datetime или число -> целые микросекунды UTC от эпохи.
+
+    Значение без пояса считается местным временем.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return (value - _EPOCH) // _MICROSECOND
+
+def to_local(value):
+    """Микросекунды UTC или datetime -> местное время без пояса"""
+    if isinstance(value, int):
+        value = _EPOCH + value * _MICROSECOND
+    elif value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+def to_iso(value):
+    """Микросекунды или datetime -> ISO строка местного времени; строки возвращаются как есть"""
+    if isinstance(value, (int, datetime)):
+        return to_local(value).isoformat()
+    return value
+
+def to_storage(value, mode):
+    """Значение времени в виде, в котором оно хранится в режиме mode"""
+    return to_micros(value) if mode == TS_MICROS else to_iso(value)
+
+def column_type(mode, integer_type='INTEGER'):
+    """Тип колонки времени для новых таблиц"""
+    return integer_type if mode == TS_MICROS else 'TEXT'
+
+def storage_mode(conn, table):
+    """Режим хранения существующей SQLite таблицы по объявленному типу колонки timestamp"""
+    for _, name, declared, *_ in conn.execute(f"PRAGMA table_info({table})"):
+        if name == 'timestamp':
+            return TS_MICROS if 'INT' in declared.upper() else TS_TEXT
+    return TS_TEXT
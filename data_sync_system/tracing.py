@@ -0,0 +1,195 @@
+# tracing.py - Задержки по этапам: от строки датчика до записи в центральную базу
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Этапы пути записи; время каждого - секунды от эпохи. measured - время
+# самого старого показания пакета (поле timestamp): его ставит датчик или
+# производитель, а не вставка строки, поэтому путь по системе считается
+# от picked - момента, когда отправитель выбрал пакет из базы
+STAGES = ('measured', 'picked', 'published', 'received', 'committed')
+# Отрезки между этапами, по которым считаются процентили
+SEGMENTS = (
+    ('backlog', 'measured', 'picked'),     # возраст показания при выборке: очередь отправителя,
+                                           # но и задним числом записанные данные, и часы датчика
+    ('batch', 'picked', 'published'),      # накопление пакета и окно публикации
+    ('broker', 'published', 'received'),   # брокер, сеть и очередь приёма
+    ('ingest', 'received', 'committed'),   # разбор и пакетная запись в базу
+    ('total', 'picked', 'committed'),
+)
+# Отрезки пути по системе, среди которых ищется самый долгий (backlog - не этап системы)
+PIPELINE_SEGMENTS = ('batch', 'broker', 'ingest')
+PERCENTILES = (50, 90, 99)
+
+# Поля заголовка сообщения (строками - двоичный кодек передает заголовок строками)
+FIELD_PICKED = 'trace_picked'
+FIELD_PUBLISHED = 'trace_published'
+
+def trace_header(picked_at):
+    """Поля трассировки для заголовка публикуемого пакета.
+
+    Время публикации - момент вызова, поэтому заголовок собирается уже
+    после ожидания окна (PipelinedPublisher.publish с функцией вместо байтов).
+    """
+    return {FIELD_PICKED: f"{picked_at:.6f}", FIELD_PUBLISHED: f"{time.time():.6f}"}
+
+def _epoch(timestamp):
+    """ISO время строки датчика (локальное, как его пишет отправитель) -> секунды от эпохи"""
+    return datetime.fromisoformat(timestamp).timestamp()
+
+# =============================================================================
+# СБОР НА ПРИЁМНИКЕ
+# =============================================================================
+
+class TraceStats:
+    """Процентили задержек по источникам и отрезкам пути.
+
+    start() вызывается при разборе сообщения и возвращает контекст, который
+    передается в BatchWriter вместе с последней строкой сообщения; после
+    фиксации транзакции писатель вызывает committed(). Для пакета этап
+    measured - время самого старого показания. Учитываются последние window
+    сообщений каждого источника. Отрезок broker сравнивает часы отправителя
+    и приёмника - при их расхождении он смещен на эту разницу.
+    """
+
+    def __init__(self, name='receiver', window=10000, report_interval=60, snapshot_file=None):
+        self.name = name
+        self.window = window
+        self.report_interval = report_interval
+        self.snapshot_file = snapshot_file
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reporter = None
+
+    def start(self, records, received_at=None):
+        """Контекст трассировки сообщения или None, если отправитель не добавил поля"""
+        header = records[0] if records else {}
+        if FIELD_PUBLISHED not in header:
+            return None
+        try:
+            return {
+                'source': header.get('source', 'unknown'),
+                'measured': min(_epoch(r['timestamp']) for r in records),
+                'picked': float(header[FIELD_PICKED]),
+                'published': float(header[FIELD_PUBLISHED]),
+                'received': received_at or time.time(),
+            }
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def committed(self, contexts, committed_at=None):
+        """Учитывает сообщения, строки которых зафиксированы в базе"""
+        committed_at = committed_at or time.time()
+        with self._lock:
+            for context in contexts:
+                context['committed'] = committed_at
+                for segment, begin, end in SEGMENTS:
+                    key = (context['source'], segment)
+                    samples = self._samples.get(key)
+                    if samples is None:
+                        samples = self._samples[key] = deque(maxlen=self.window)
+                    samples.append(context[end] - context[begin])
+
+    def summary(self):
+        """{источник: {отрезок: {count, p50, p90, p99, max}}} в секундах"""
+        with self._lock:
+            items = [(key, sorted(samples)) for key, samples in self._samples.items()]
+        result = {}
+        for (source, segment), values in items:
+            stats = {'count': len(values), 'max': round(values[-1], 6)}
+            for p in PERCENTILES:
+                # Ближайший ранг
+                stats[f'p{p}'] = round(values[min(len(values) - 1, len(values) * p // 100)], 6)
+            result.setdefault(source, {})[segment] = stats
+        return result
+
+    def run_reports(self):
+        """Запускает периодическую сводку в лог и снимок в файл"""
+        if self.report_interval:
+            self._reporter = threading.Thread(target=self._report_loop, name="trace-report", daemon=True)
+            self._reporter.start()
+        return self
+
+    def close(self):
+        self._stopped.set()
+        if self._reporter:
+            self._reporter.join()
+        self._report()
+
+    def _report_loop(self):
+        while not self._stopped.wait(self.report_interval):
+            self._report()
+
+    def _report(self):
+        summary = self.summary()
+        if not summary:
+            return
+        for source, segments in summary.items():
+            logger.info(f"⏱️  {source}: " + ', '.join(
+                f"{segment} p50={s['p50']:.3f} p99={s['p99']:.3f}" for segment, s in segments.items()
+            ))
+        if self.snapshot_file:
+            data = {'name': self.name, 'time': time.time(), 'sources': summary}
+            try:
+                os.makedirs(os.path.dirname(self.snapshot_file) or '.', exist_ok=True)
+                with open(self.snapshot_file + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(self.snapshot_file + '.tmp', self.snapshot_file)
+            except OSError as e:
+                logger.error(f"❌ Ошибка записи снимка трассировки: {e}")
+
+# =============================================================================
+# ОТЧЁТ
+# =============================================================================
+
+def format_report(snapshots):
+    """Таблица процентилей по снимкам приёмников, миллисекунды"""
+    columns = ('count',) + tuple(f'p{p}' for p in PERCENTILES) + ('max',)
+    lines = []
+    for data in snapshots:
+        taken = datetime.fromtimestamp(data['time']).strftime('%Y-%m-%d %H:%M:%S')
+        lines.append(f"\n📊 {data['name']} (снимок {taken})")
+        for source, segments in sorted(data['sources'].items()):
+            lines.append(f"  {source}")
+            lines.append(f"    {'этап':<8}" + ''.join(f"{c:>12}" for c in columns))
+            for segment, _, _ in SEGMENTS:
+                stats = segments.get(segment)
+                if stats is None:
+                    continue
+                cells = [f"{stats['count']:>12}"] + [f"{stats[c] * 1000:>12.1f}" for c in columns[1:]]
+                lines.append(f"    {segment:<8}" + ''.join(cells))
+            # Отрезок с наибольшей медианой - кандидат на масштабирование
+            stages = [s for s in PIPELINE_SEGMENTS if s in segments]
+            if stages:
+                slowest = max(stages, key=lambda s: segments[s]['p50'])
+                lines.append(f"    ➜ дольше всего: {slowest}")
+    return '\n'.join(lines)
+
+def main():
+    """python tracing.py [снимок.json ...] - отчёт по задержкам этапов"""
+    from config import TRACE_SNAPSHOT_FILE
+
+    paths = sys.argv[1:] or sorted(glob.glob(TRACE_SNAPSHOT_FILE.format(name='*')))
+    snapshots = []
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"⚠️  {path}: {e}")
+    if not snapshots:
+        print("Снимков трассировки нет: включите TRACE_ENABLED на отправителях и приёмниках")
+        sys.exit(1)
+    print(format_report(snapshots))
+
+if __name__ == "__main__":
+    main()
@@ -1,128 +1,233 @@
-import json
-from datetime import datetime
-import paho.mqtt.client as mqtt
-import logging
-import sqlite3
-import sys
-
-# Добавляем путь для VSCode
-sys.path.append("C:\\Users\\Student\\AppData\\Roaming\\Python\\Python313\\site-packages")
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-logger = logging.getLogger(__name__)
-
-# Импортируем конфигурацию
-try:
-    from config import MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
-except ImportError as e:
-    logger.error("❌ config.py не найден!")
-    sys.exit(1)
-
-# Глобальные переменные для базы данных
-conn = None
-cursor = None
-
-def setup_storage():
-    """Настраивает центральное хранилище"""
-    try:
-        conn = sqlite3.connect("central_universal.db", check_same_thread=False)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS received_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                original_id INTEGER,
-                sensor_id INTEGER NOT NULL,
-                value REAL NOT NULL,
-                timestamp TEXT NOT NULL,
-                received_at TEXT NOT NULL,
-                source_db TEXT,
-                db_type TEXT
-            )
-        ''')
-        conn.commit()
-        logger.info("✅ Центральное хранилище готово")
-        return conn, cursor
-    except Exception as e:
-        logger.error(f"❌ Ошибка хранилища: {e}")
-        return None, None
-
-def on_connect(client, userdata, flags, rc, properties):
-    if rc == 0:
-        logger.info("✅ ПРИЁМНИК ПОДКЛЮЧЕН К MQTT!")
-        client.subscribe(MQTT_TOPIC)
-        logger.info(f"📡 Подписан на: {MQTT_TOPIC}")
-    else:
-        logger.error(f"❌ Ошибка подключения: {rc}")
-
-def on_message(client, userdata, msg):
-    try:
-        payload = json.loads(msg.payload.decode())
-        
-        logger.info(f"\n📨 ПОЛУЧЕНО СООБЩЕНИЕ")
-        logger.info(f"├─ Источник: {payload.get('source', 'unknown')}")
-        logger.info(f"├─ База данных: {payload.get('database_type', 'unknown')}")
-        logger.info(f"├─ ID: {payload.get('id')}")
-        logger.info(f"├─ Датчик: {payload.get('sensor_id')}")
-        logger.info(f"└─ Значение: {payload.get('value')}°C")
-        
-        # Сохраняем в базу
-        cursor.execute('''
-            INSERT INTO received_data 
-            (original_id, sensor_id, value, timestamp, received_at, source_db, db_type) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            payload.get('id'),
-            payload.get('sensor_id'),
-            payload.get('value'),
-            payload.get('timestamp'),
-            datetime.now().isoformat(),
-            payload.get('source'),
-            payload.get('database_type')
-        ))
-        conn.commit()
-        
-        # Сохраняем в лог-файл
-        with open("received_universal.log", "a", encoding="utf-8") as f:
-            f.write(f"{datetime.now().isoformat()} | {json.dumps(payload)}\n")
-            
-        logger.info("✅ Данные сохранены")
-        
-    except Exception as e:
-        logger.error(f"💥 Ошибка обработки: {e}")
-
-def main():
-    global conn, cursor
-    
-    logger.info("🚀 УНИВЕРСАЛЬНЫЙ ПРИЁМНИК ЗАПУЩЕН")
-    logger.info("=" * 50)
-    
-    # Настраиваем хранилище
-    conn, cursor = setup_storage()
-    if not conn:
-        return
-    
-    # Настраиваем MQTT клиента
-    client = mqtt.Client("universal_receiver")
-    client.on_connect = on_connect
-    client.on_message = on_message
-    
-    try:
-        logger.info(f"🔗 Подключение к {MQTT_BROKER}...")
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        
-        logger.info("🎧 Ожидание данных...")
-        client.loop_forever()
-        
-    except KeyboardInterrupt:
-        logger.info("\n🛑 Остановка пользователем")
-    except Exception as e:
-        logger.error(f"💥 Ошибка: {e}")
-    finally:
-        client.disconnect()
-        conn.close()
-        logger.info("🎯 Приёмник остановлен")
-
-if __name__ == "__main__":
+from datetime import datetime
+import paho.mqtt.client as mqtt
+import logging
+import sqlite3
+import sys
+import time
+
+from message_format import unpack_message, is_delete
+from codec import decode_message
+from batch_writer import BatchWriter
+from receive_pipeline import ReceivePipeline
+from journal import JournalWriter
+from dedup import RecentIds, dedup_key, upsert_clause, create_origin_index
+from rollup import create_rollups, drop_rollup_triggers
+from central_query import create_query_indexes
+from timestamps import column_type, storage_mode, to_storage
+import hot_logging
+from hot_logging import MessageDetail, fields
+from metrics import REGISTRY, MetricsServer
+from tracing import TraceStats
+
+# Добавляем путь для VSCode
+sys.path.append("C:\\Users\\Student\\AppData\\Roaming\\Python\\Python313\\site-packages")
+
+# Импортируем конфигурацию
+try:
+    from config import MQTT_BROKER, MQTT_PORT, MQTT_TOPIC
+    from config import WRITER_MAX_ROWS, WRITER_MAX_DELAY_MS
+    from config import RECEIVE_WORKERS, RECEIVE_QUEUE_SIZE, RECEIVE_QUEUE_POLICY
+    from config import RECEIVE_BLOCK_TIMEOUT, RECEIVE_STATS_INTERVAL
+    from config import IDEMPOTENT_INGEST, DEDUP_CACHE_SIZE, ROLLUPS_ENABLED, TIMESTAMP_STORAGE
+    from config import JOURNAL_SEGMENT_MAX_MB, JOURNAL_SEGMENT_MAX_SECONDS, JOURNAL_FSYNC
+    from config import JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPRESS, JOURNAL_BUFFER_KB
+    from config import LOG_QUEUED, LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY
+    from config import LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+    from config import METRICS_ENABLED, METRICS_HOST, METRICS_RECEIVER_PORT
+    from config import METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL
+    from config import TRACE_ENABLED, TRACE_WINDOW, TRACE_REPORT_INTERVAL, TRACE_SNAPSHOT_FILE
+except ImportError:
+    print("❌ config.py не найден!")
+    sys.exit(1)
+
+# Настройка логирования
+hot_logging.setup_logging(queued=LOG_QUEUED)
+logger = logging.getLogger(__name__)
+# Подробности отдельных записей - выборочно, режим меняется на лету
+detail = MessageDetail(
+    LOG_MESSAGE_DETAIL, LOG_DETAIL_SAMPLE_EVERY, LOG_DETAIL_MAX_PER_SECOND, LOG_DETAIL_SWITCH_FILE
+)
+
+# Глобальные переменные для базы данных
+conn = None
+cursor = None
+writer = None
+pipeline = None
+journal = None
+tracer = None
+ts_mode = TIMESTAMP_STORAGE
+
+INSERT_SQL = '''
+    INSERT INTO received_data 
+    (original_id, sensor_id, value, timestamp, received_at, source_db, db_type) 
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+if IDEMPOTENT_INGEST:
+    INSERT_SQL += upsert_clause('source_db')
+
+# Недавно принятые записи, повторы отбрасываются до записи в базу
+recent_ids = RecentIds(DEDUP_CACHE_SIZE) if IDEMPOTENT_INGEST else None
+
+def setup_storage():
+    """Настраивает центральное хранилище"""
+    global ts_mode
+    try:
+        conn = sqlite3.connect("central_universal.db", check_same_thread=False)
+        cursor = conn.cursor()
+        
+        ts_type = column_type(TIMESTAMP_STORAGE)
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS received_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                original_id INTEGER,
+                sensor_id INTEGER NOT NULL,
+                value REAL NOT NULL,
+                timestamp {ts_type} NOT NULL,
+                received_at {ts_type} NOT NULL,
+                source_db TEXT,
+                db_type TEXT
+            )
+        ''')
+        conn.commit()
+        ts_mode = storage_mode(conn, 'received_data')
+        if IDEMPOTENT_INGEST:
+            create_origin_index(conn, 'source_db')
+        if ROLLUPS_ENABLED:
+            create_rollups(conn)
+        else:
+            drop_rollup_triggers(conn)
+        create_query_indexes(conn)
+        logger.info("✅ Центральное хранилище готово")
+        return conn, cursor
+    except Exception as e:
+        logger.error(f"❌ Ошибка хранилища: {e}")
+        return None, None
+
+def on_connect(client, userdata, flags, rc, properties):
+    if rc == 0:
+        logger.info("✅ ПРИЁМНИК ПОДКЛЮЧЕН К MQTT!")
+        client.subscribe(MQTT_TOPIC)
+        logger.info(f"📡 Подписан на: {MQTT_TOPIC}")
+    else:
+        logger.error(f"❌ Ошибка подключения: {rc}")
+
+def on_message(client, userdata, msg):
+    """Только ставит сообщение в очередь, разбор и запись - в рабочих потоках"""
+    pipeline.submit(msg.topic, msg.payload)
+
+def process_message(topic, raw_payload):
+    try:
+        started_at = time.time()
+        payload = decode_message(raw_payload)
+        received_at = datetime.now().isoformat()
+        records = unpack_message(payload)
+        entries = []
+        rows = []
+        keys = []
+        
+        for record in records:
+            if recent_ids and recent_ids.seen(dedup_key(record)):
+                # Повтор QoS 1 после переподключения - уже принят
+                continue
+
+            if detail.enabled():
+                logger.info(
+                    f"├─ {record.get('source', 'unknown')}/{record.get('database_type', 'unknown')} "
+                    f"ID {record.get('id')}: датчик {record.get('sensor_id')} = {record.get('value')}°C"
+                )
+            
+            # Удаления на отправителе в базе не применяются, только журналируются
+            if not is_delete(record):
+                rows.append((
+                    record.get('id'),
+                    record.get('sensor_id'),
+                    record.get('value'),
+                    to_storage(record.get('timestamp'), ts_mode),
+                    to_storage(datetime.now(), ts_mode),
+                    record.get('source'),
+                    record.get('database_type')
+                ))
+                keys.append(dedup_key(record) if recent_ids else None)
+            
+            entries.append({"received_at": received_at, "data": record})
+            
+        # Трассировка идет с последней строкой: её фиксация завершает сообщение
+        trace = tracer.start(records, started_at) if tracer and rows else None
+        for i, row in enumerate(rows):
+            writer.put(row, trace if i == len(rows) - 1 else None, keys[i])
+        # Сохраняем в журнал одной записью на сообщение
+        journal.append(entries)
+        # Одна строка на сообщение-пакет
+        logger.info("📨 " + fields(
+            topic=topic, source=records[0].get('source', 'unknown') if records else None,
+            records=len(records), new=len(entries)
+        ))
+        
+    except Exception as e:
+        logger.error(f"💥 Ошибка обработки: {e}")
+
+def main():
+    global conn, cursor, writer, pipeline, journal, tracer
+    
+    logger.info("🚀 УНИВЕРСАЛЬНЫЙ ПРИЁМНИК ЗАПУЩЕН")
+    logger.info("=" * 50)
+    
+    # Настраиваем хранилище
+    conn, cursor = setup_storage()
+    if not conn:
+        return
+    journal = JournalWriter(
+        "received_universal.log", JOURNAL_SEGMENT_MAX_MB * 1024 * 1024, JOURNAL_SEGMENT_MAX_SECONDS,
+        JOURNAL_FSYNC, JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPRESS, JOURNAL_BUFFER_KB * 1024
+    )
+    if TRACE_ENABLED:
+        tracer = TraceStats(
+            'universal_receiver', TRACE_WINDOW, TRACE_REPORT_INTERVAL,
+            TRACE_SNAPSHOT_FILE.format(name='universal_receiver')
+        ).run_reports()
+    writer = BatchWriter(
+        "central_universal.db", INSERT_SQL, WRITER_MAX_ROWS, WRITER_MAX_DELAY_MS,
+        on_commit=tracer.committed if tracer else None,
+        on_reject=recent_ids.forget if recent_ids else None
+    ).start()
+    pipeline = ReceivePipeline(
+        process_message, RECEIVE_WORKERS, RECEIVE_QUEUE_SIZE,
+        RECEIVE_QUEUE_POLICY, RECEIVE_BLOCK_TIMEOUT, RECEIVE_STATS_INTERVAL
+    ).start()
+    metrics_server = None
+    if METRICS_ENABLED:
+        metrics_server = MetricsServer(
+            REGISTRY, METRICS_HOST, METRICS_RECEIVER_PORT,
+            METRICS_SNAPSHOT_FILE.format(name='universal_receiver'), METRICS_SNAPSHOT_INTERVAL
+        ).start()
+    
+    # Настраиваем MQTT клиента
+    client = mqtt.Client("universal_receiver")
+    client.on_connect = on_connect
+    client.on_message = on_message
+    
+    try:
+        logger.info(f"🔗 Подключение к {MQTT_BROKER}...")
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        
+        logger.info("🎧 Ожидание данных...")
+        client.loop_forever()
+        
+    except KeyboardInterrupt:
+        logger.info("\n🛑 Остановка пользователем")
+    except Exception as e:
+        logger.error(f"💥 Ошибка: {e}")
+    finally:
+        client.disconnect()
+        pipeline.stop()
+        writer.close()
+        journal.close()
+        if tracer:
+            tracer.close()
+        if metrics_server:
+            metrics_server.stop()
+        conn.close()
+        logger.info("🎯 Приёмник остановлен")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file